@@ -0,0 +1,384 @@
+"""Latency/throughput benchmark for the portfolio read hot paths.
+
+Runs the app under uvicorn against a local stub Alpha Vantage server and
+measures GET /portfolio/{token}, GET /portfolio/{token}/summary and
+GET /quote/{symbol} for portfolios of 10/100/1000 positions in three cases:
+
+- cold:  quote cache (memory and table) emptied before every request
+- warm:  every quote already cached
+- mixed: concurrent reads with one write (POST /api/positions) in five
+
+Each result reports p50/p99 latency, requests/s, SQL statements per request
+and upstream calls. Save a run with ``--output`` and pass it back as
+``--baseline`` on a later run to fail (exit 1) on regressions:
+
+    python benchmarks/bench_api.py --output before.json
+    python benchmarks/bench_api.py --baseline before.json --max-regression 0.25
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+ROOT = Path(__file__).resolve().parents[1]  # the backend/ folder
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+DEFAULT_SIZES = (10, 100, 1000)
+# absolute slack so sub-millisecond noise on fast paths never counts as a regression
+LATENCY_NOISE_FLOOR_MS = 2.0
+
+
+# ----- Stub Alpha Vantage -----
+
+
+def stub_price(symbol: str) -> float:
+    """Deterministic per-symbol price so runs are comparable."""
+    return 10.0 + int(hashlib.md5(symbol.encode()).hexdigest()[:6], 16) % 49000 / 100.0
+
+
+class StubAlphaVantage:
+    """Threaded HTTP server speaking the GLOBAL_QUOTE / TIME_SERIES_DAILY subset the client uses.
+
+    ``latency_ms`` (+/- ``jitter_ms``) is added to every call; ``error_rate``
+    answers HTTP 500 and ``note_rate`` answers the rate-limit "Note" body.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 50.0,
+        jitter_ms: float = 10.0,
+        error_rate: float = 0.0,
+        note_rate: float = 0.0,
+        seed: int = 7,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.note_rate = note_rate
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/query"
+
+    def _roll(self) -> float:
+        with self._lock:
+            self.calls += 1
+            return self._rng.random()
+
+    def _delay(self) -> float:
+        with self._lock:
+            return max(0.0, self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000.0
+
+    def _respond(self, params: Dict[str, str]):
+        roll = self._roll()
+        time.sleep(self._delay())
+        if roll < self.error_rate:
+            return 500, {"error": "stub failure"}
+        if roll < self.error_rate + self.note_rate:
+            return 200, {"Note": "Our standard API call frequency is 5 calls per minute."}
+        symbol = params.get("symbol", "").upper()
+        price = stub_price(symbol)
+        if params.get("function") == "GLOBAL_QUOTE":
+            quote = {"01. symbol": symbol, "05. price": f"{price:.4f}", "08. previous close": f"{price * 0.99:.4f}"}
+            return 200, {"Global Quote": quote}
+        days = 100 if params.get("outputsize") != "full" else 1000
+        series = {}
+        for i in range(days):
+            close = f"{price * (1 + 0.001 * ((i * 7) % 11 - 5)):.4f}"
+            series[(date.today() - timedelta(days=i)).isoformat()] = {
+                "1. open": close, "2. high": close, "3. low": close, "4. close": close, "5. volume": "1000",
+            }
+        return 200, {"Time Series (Daily)": series}
+
+    def start(self) -> "StubAlphaVantage":
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+                status, body = stub._respond(params)
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="stub-av", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+# ----- Harness -----
+
+
+def configure_environment(stub_url: str, workdir: Path) -> None:
+    """Env for the app under test; must run before ``main`` is imported."""
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{workdir / 'bench.db'}")
+    os.environ["ALPHAVANTAGE_API_KEY"] = "bench"
+    os.environ["ALPHAVANTAGE_BASE_URL"] = stub_url
+    os.environ.setdefault("ALPHAVANTAGE_CALLS_PER_MINUTE", "100000000")  # the stub has no quota
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+class AppServer:
+    """The FastAPI app under uvicorn on a free local port, in a background thread."""
+
+    def __init__(self, app):
+        import uvicorn
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        config = uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning", lifespan="on")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, name="bench-uvicorn", daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self) -> "AppServer":
+        self._thread.start()
+        deadline = time.time() + 15
+        while not self._server.started:
+            if time.time() > deadline:
+                raise RuntimeError("uvicorn did not start")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.should_exit = True
+        self._thread.join(timeout=10)
+
+
+class StatementCounter:
+    """Counts SQL statements issued on behalf of requests; the write-behind quote flusher is not one."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        self._engine = engine
+        self._lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args) -> None:
+        if threading.current_thread().name == "quote-writer":
+            return
+        with self._lock:
+            self.count += 1
+
+    def close(self) -> None:
+        from sqlalchemy import event
+
+        event.remove(self._engine, "before_cursor_execute", self._on_execute)
+
+
+def run_case(
+    http,
+    requests: int,
+    concurrency: int,
+    next_request: Callable[[int], tuple],
+    counter: StatementCounter,
+    stub: StubAlphaVantage,
+    reset: Optional[Callable[[], None]] = None,
+) -> Dict[str, float]:
+    """Issue ``requests`` calls built by ``next_request(i) -> (method, path, kwargs)``.
+
+    With ``reset`` the calls run one at a time and ``reset`` runs (untimed)
+    before each, which is how the cold case empties the caches.
+    """
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(i: int) -> None:
+        nonlocal errors
+        method, path, kwargs = next_request(i)
+        started = time.perf_counter()
+        r = http.request(method, path, **kwargs)
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append(elapsed)
+            errors += r.status_code >= 400
+
+    upstream = stub.calls
+    statements = 0
+    busy = 0.0
+    if reset is not None:
+        for i in range(requests):
+            reset()  # untimed, and its SQL is not billed to the request
+            before, started = counter.count, time.perf_counter()
+            one(i)
+            busy += time.perf_counter() - started
+            statements += counter.count - before
+    else:
+        before, started = counter.count, time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(requests)))
+        busy = time.perf_counter() - started
+        statements = counter.count - before
+    return {
+        "requests": requests,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "rps": round(requests / busy, 1) if busy else 0.0,
+        "sql_per_request": round(statements / requests, 2),
+        "upstream_calls": stub.calls - upstream,
+        "errors": errors,
+    }
+
+
+def run_suite(
+    main,
+    stub: StubAlphaVantage,
+    sizes=DEFAULT_SIZES,
+    requests: int = 50,
+    concurrency: int = 8,
+    cases=("cold", "warm", "mixed"),
+) -> Dict[str, Dict[str, float]]:
+    """Benchmark every endpoint x case x portfolio size; keys look like ``summary/warm/100``."""
+    import httpx
+    from sqlalchemy import delete
+
+    main.init_db()
+    counter = StatementCounter(main.engine)
+    results: Dict[str, Dict[str, float]] = {}
+    with AppServer(main.app) as server, httpx.Client(base_url=server.url, timeout=120) as http:
+        for size in sizes:
+            symbols = [f"BM{size}X{i:04d}" for i in range(size)]
+            positions = [{"symbol": sym, "qty": 1 + i % 7, "avg_cost": 10.0} for i, sym in enumerate(symbols)]
+            token = http.post("/portfolio", json=positions).json()["token"]
+            endpoints = {
+                "portfolio": lambda i: ("GET", f"/portfolio/{token}", {}),
+                "summary": lambda i: ("GET", f"/portfolio/{token}/summary", {}),
+                "quote": lambda i: ("GET", f"/quote/{symbols[i % size]}", {}),
+            }
+
+            def reset() -> None:
+                main.quote_writer.flush()  # or buffered rows would land after the delete
+                main.alpha_client.memory.clear()
+                with main.SessionLocal() as db:
+                    db.execute(delete(main.Quote).where(main.Quote.symbol.in_(symbols)))
+                    db.commit()
+
+            for name, read in endpoints.items():
+                for case in cases:
+                    if case == "cold":
+                        result = run_case(http, requests, 1, read, counter, stub, reset=reset)
+                    elif case == "warm":
+                        for i in range(min(size, requests) if name == "quote" else 1):
+                            http.request(*read(i)[:2])  # prime every quote the case will read
+                        result = run_case(http, requests, concurrency, read, counter, stub)
+                    else:
+                        def mixed(i, read=read):
+                            if i % 5 == 4:
+                                body = {"symbol": symbols[i % size], "qty": 1 + i % 9, "avgCost": 10.0}
+                                return "POST", "/api/positions", {"json": body, "headers": {"x-pt-token": token}}
+                            return read(i)
+
+                        result = run_case(http, requests, concurrency, mixed, counter, stub)
+                    results[f"{name}/{case}/{size}"] = result
+    return results
+
+
+def compare(baseline: Dict[str, dict], current: Dict[str, dict], max_regression: float) -> List[str]:
+    """Human-readable regressions of ``current`` against ``baseline`` (empty when none)."""
+    regressions = []
+    for key, now in sorted(current.items()):
+        before = baseline.get(key)
+        if before is None:
+            continue
+        for metric in ("p50_ms", "p99_ms"):
+            limit = before[metric] * (1 + max_regression) + LATENCY_NOISE_FLOOR_MS
+            if now[metric] > limit:
+                regressions.append(f"{key} {metric}: {before[metric]} -> {now[metric]} (limit {limit:.1f})")
+        if now["rps"] < before["rps"] / (1 + max_regression) and before["p50_ms"] > LATENCY_NOISE_FLOOR_MS:
+            regressions.append(f"{key} rps: {before['rps']} -> {now['rps']}")
+        if now["sql_per_request"] > before["sql_per_request"] + 0.5:
+            regressions.append(f"{key} sql_per_request: {before['sql_per_request']} -> {now['sql_per_request']}")
+    return regressions
+
+
+def print_table(results: Dict[str, Dict[str, float]]) -> None:
+    header = f"{'case':28} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>8} {'sql/req':>8} {'upstream':>9} {'errors':>7}"
+    print(header)
+    print("-" * len(header))
+    for key, r in results.items():
+        print(
+            f"{key:28} {r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['rps']:>8.1f} "
+            f"{r['sql_per_request']:>8.2f} {r['upstream_calls']:>9} {r['errors']:>7}"
+        )
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--requests", type=int, default=50, help="requests per endpoint/case/size")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--cases", nargs="+", default=["cold", "warm", "mixed"], choices=["cold", "warm", "mixed"])
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="stub upstream latency")
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of stub calls answering 500")
+    parser.add_argument("--note-rate", type=float, default=0.0, help="fraction answering the rate-limit Note")
+    parser.add_argument("--output", type=Path, help="write results as JSON")
+    parser.add_argument("--baseline", type=Path, help="earlier --output to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="allowed fractional slowdown")
+    args = parser.parse_args(argv)
+
+    stub = StubAlphaVantage(args.latency_ms, args.jitter_ms, args.error_rate, args.note_rate).start()
+    configure_environment(stub.url, Path(tempfile.mkdtemp(prefix="bench-")))
+    import main  # after the environment is in place
+
+    try:
+        results = run_suite(main, stub, args.sizes, args.requests, args.concurrency, tuple(args.cases))
+    finally:
+        stub.stop()
+    print_table(results)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2, sort_keys=True))
+    if args.baseline:
+        regressions = compare(json.loads(args.baseline.read_text()), results, args.max_regression)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -1,33 +1,138 @@
+import abc
+import asyncio
+import bisect
+import csv
+import hashlib
+import heapq
+import hmac
+import io
+import itertools
+import json
+import logging
+import multiprocessing
 import os
+import re
+import threading
 import time
-from datetime import datetime, timedelta
-from typing import List, Optional
+import uuid
+from collections import OrderedDict
+from contextvars import ContextVar, copy_context
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple, Union
 
 import httpx
+import numpy as np
 from dotenv import load_dotenv
-from fastapi import Depends, FastAPI, HTTPException, Header
+from fastapi import Depends, FastAPI, HTTPException, Header, Query, Request, WebSocket
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from starlette.datastructures import MutableHeaders
 from sqlalchemy import (
+    Boolean,
+    Date,
     DateTime,
     Float,
     ForeignKey,
+    Index,
     Integer,
     String,
+    Text,
     UniqueConstraint,
     create_engine,
+    event,
+    extract,
     func,
+    inspect,
+    select,
+    text,
+    update,
 )
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column, relationship, sessionmaker
+from sqlalchemy.pool import QueuePool
 
 
 # ----- Environment and App -----
 
 load_dotenv()
+# share uvicorn's handler so our lines show up in server output
+logger = logging.getLogger("uvicorn.error")
+
+
+def _env_flag(name: str, default: str = "0") -> bool:
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "on")
+
 
 ALPHAVANTAGE_API_KEY = os.getenv("ALPHAVANTAGE_API_KEY", "")
+# upstream price sources behind the memory and quotes-table tiers, tried in order: alphavantage, replay
+PRICE_PROVIDERS = os.getenv("PRICE_PROVIDERS", "alphavantage")
+PRICE_REPLAY_FILE = os.getenv("PRICE_REPLAY_FILE", "")  # recorded Alpha Vantage responses keyed by symbol
+PRICE_REPLAY_LATENCY_MS = float(os.getenv("PRICE_REPLAY_LATENCY_MS", "0"))  # simulated latency per replayed call
+ALPHAVANTAGE_BASE_URL = os.getenv("ALPHAVANTAGE_BASE_URL", "https://www.alphavantage.co/query")  # e.g. a local stub
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app.db")
 PRICE_CACHE_TTL_SECONDS = int(os.getenv("PRICE_CACHE_TTL_SECONDS", "900"))  # 15 min default
+# serve read routes from an AsyncSession + httpx.AsyncClient instead of the threadpool
+ASYNC_DB_ENABLED = _env_flag("ASYNC_DB_ENABLED")
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))  # rows per bulk upsert statement
+TIMELINE_DEFAULT_DAYS = int(os.getenv("TIMELINE_DEFAULT_DAYS", "90"))
+# a symbol's history is downloaded at most once per window, whether it succeeded or failed
+PRICE_HISTORY_REFETCH_SECONDS = int(os.getenv("PRICE_HISTORY_REFETCH_SECONDS", "21600"))
+# how often each worker picks up alerts created by other worker processes
+ALERT_SYNC_SECONDS = int(os.getenv("ALERT_SYNC_SECONDS", "30"))
+# how often each worker reloads the cross-portfolio exposure index to pick up other workers' writes
+EXPOSURE_SYNC_SECONDS = int(os.getenv("EXPOSURE_SYNC_SECONDS", "60"))
+# how often /api/stream re-reads watched quotes and portfolio versions for other workers' writes (0 disables)
+STREAM_SYNC_SECONDS = float(os.getenv("STREAM_SYNC_SECONDS", "5"))
+# shared secret for the cross-portfolio /api/exposure routes (disabled when empty)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# batch sentiment: worker processes (0 scores in-process), texts per worker task, LRU size, max texts per batch
+SENTIMENT_WORKERS = int(os.getenv("SENTIMENT_WORKERS", str(os.cpu_count() or 1)))
+SENTIMENT_CHUNK_SIZE = int(os.getenv("SENTIMENT_CHUNK_SIZE", "200"))
+SENTIMENT_CACHE_SIZE = int(os.getenv("SENTIMENT_CACHE_SIZE", "10000"))
+SENTIMENT_MAX_BATCH = int(os.getenv("SENTIMENT_MAX_BATCH", "10000"))
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))  # threads computing queued reports
+SENTIMENT_WARMUP = _env_flag("SENTIMENT_WARMUP")  # load the VADER lexicon at startup instead of first use
+# create: create_all + new columns on startup; check: only verify tables exist (run `python main.py init-db` once)
+DB_SCHEMA_MODE = os.getenv("DB_SCHEMA_MODE", "create").lower()
+# connection pool sizing (only for QueuePool-backed engines, not in-memory SQLite or aiosqlite)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT_SECONDS = int(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+DB_POOL_PRE_PING = _env_flag("DB_POOL_PRE_PING", "1")
+# SQLite pragmas applied to every new connection
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+PRICE_FETCH_CONCURRENCY = int(os.getenv("PRICE_FETCH_CONCURRENCY", "8"))  # parallel upstream fetches
+PRICE_MEMORY_CACHE_SIZE = int(os.getenv("PRICE_MEMORY_CACHE_SIZE", "2048"))  # hot quotes kept in-process
+# fetched quotes are buffered per symbol and upserted in one statement per interval, or once this many are waiting
+QUOTE_FLUSH_INTERVAL_SECONDS = float(os.getenv("QUOTE_FLUSH_INTERVAL_SECONDS", "1.0"))
+QUOTE_FLUSH_MAX_ROWS = int(os.getenv("QUOTE_FLUSH_MAX_ROWS", "500"))
+POSITIONS_RESPONSE_CACHE_SIZE = int(os.getenv("POSITIONS_RESPONSE_CACHE_SIZE", "1024"))  # rendered position lists
+# serve expired quotes for this long while one background refresh runs (0 disables)
+PRICE_STALE_WHILE_REVALIDATE_SECONDS = int(os.getenv("PRICE_STALE_WHILE_REVALIDATE_SECONDS", "0"))
+# proactive refresh of held symbols before they expire
+PRICE_REFRESHER_ENABLED = _env_flag("PRICE_REFRESHER_ENABLED")
+PRICE_REFRESH_INTERVAL_SECONDS = int(os.getenv("PRICE_REFRESH_INTERVAL_SECONDS", "15"))
+PRICE_REFRESH_LEAD_SECONDS = int(os.getenv("PRICE_REFRESH_LEAD_SECONDS", "120"))
+ALPHAVANTAGE_CALLS_PER_MINUTE = int(os.getenv("ALPHAVANTAGE_CALLS_PER_MINUTE", "5"))  # free tier quota
+ALPHAVANTAGE_CONNECT_TIMEOUT_SECONDS = float(os.getenv("ALPHAVANTAGE_CONNECT_TIMEOUT_SECONDS", "2"))
+ALPHAVANTAGE_READ_TIMEOUT_SECONDS = float(os.getenv("ALPHAVANTAGE_READ_TIMEOUT_SECONDS", "8"))
+# circuit breaker: consecutive failures before opening, and how long it stays open before one probe
+ALPHAVANTAGE_BREAKER_FAILURES = int(os.getenv("ALPHAVANTAGE_BREAKER_FAILURES", "5"))
+ALPHAVANTAGE_BREAKER_RESET_SECONDS = float(os.getenv("ALPHAVANTAGE_BREAKER_RESET_SECONDS", "60"))
+# process-wide budget for retrying transient upstream failures
+ALPHAVANTAGE_RETRIES_PER_MINUTE = float(os.getenv("ALPHAVANTAGE_RETRIES_PER_MINUTE", "10"))
+# the quota is per API key, so each uvicorn worker process gets an equal share
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+# per-request timing, SQL and upstream counters: Server-Timing header and GET /metrics
+METRICS_ENABLED = _env_flag("METRICS_ENABLED")
 
 app = FastAPI(
     title="Portfolio Tracker API",
@@ -56,6 +161,8 @@ class Portfolio(Base):
     __tablename__ = "portfolios"
     token: Mapped[str] = mapped_column(String(64), primary_key=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+    # bumped by every position write; NULL on rows created before the column existed
+    version: Mapped[Optional[int]] = mapped_column(Integer, nullable=True, default=0)
     positions: Mapped[List["DBPosition"]] = relationship(
         back_populates="portfolio", cascade="all, delete-orphan"
     )
@@ -79,24 +186,249 @@ class Quote(Base):
     symbol: Mapped[str] = mapped_column(String(32), primary_key=True)
     price: Mapped[float] = mapped_column(Float)
     fetched_at: Mapped[datetime] = mapped_column(DateTime, index=True)
+    prev_close: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+
+
+class Alert(Base):
+    __tablename__ = "alerts"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    token: Mapped[str] = mapped_column(String(64), index=True)
+    symbol: Mapped[str] = mapped_column(String(32), index=True)
+    kind: Mapped[str] = mapped_column(String(16))  # see ALERT_KINDS
+    threshold: Mapped[float] = mapped_column(Float)
+    active: Mapped[bool] = mapped_column(Boolean, default=True, index=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+    triggered_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    triggered_price: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+
+
+class PriceBar(Base):
+    """One daily OHLCV bar; the (symbol, day) primary key doubles as the range-scan index."""
+
+    __tablename__ = "price_bars"
+    symbol: Mapped[str] = mapped_column(String(32), primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    open: Mapped[float] = mapped_column(Float)
+    high: Mapped[float] = mapped_column(Float)
+    low: Mapped[float] = mapped_column(Float)
+    close: Mapped[float] = mapped_column(Float)
+    volume: Mapped[float] = mapped_column(Float, default=0.0)
+
+
+class Politician(Base):
+    __tablename__ = "politicians"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    name: Mapped[str] = mapped_column(String(128), unique=True)
+    chamber: Mapped[Optional[str]] = mapped_column(String(16), nullable=True)
+    party: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+    state: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+
+
+class Disclosure(Base):
+    """One disclosed trade; ``fingerprint`` makes re-ingesting the same dump a no-op."""
+
+    __tablename__ = "disclosures"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    fingerprint: Mapped[str] = mapped_column(String(32), unique=True)
+    politician_id: Mapped[int] = mapped_column(Integer, ForeignKey("politicians.id"))
+    ticker: Mapped[str] = mapped_column(String(32))
+    transaction_date: Mapped[date] = mapped_column(Date)
+    disclosure_date: Mapped[Optional[date]] = mapped_column(Date, nullable=True)
+    type: Mapped[str] = mapped_column(String(32))
+    amount_min: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    amount_max: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    owner: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+    asset_description: Mapped[Optional[str]] = mapped_column(String(256), nullable=True)
+
+    __table_args__ = (
+        # the portfolio join probes by ticker and ranges over dates
+        Index("ix_disclosures_ticker_date", "ticker", "transaction_date"),
+        Index("ix_disclosures_politician_date", "politician_id", "transaction_date"),
+        Index("ix_disclosures_transaction_date", "transaction_date"),
+    )
+
+
+class ReportJob(Base):
+    __tablename__ = "report_jobs"
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    token: Mapped[str] = mapped_column(String(64), index=True)
+    kind: Mapped[str] = mapped_column(String(32))
+    params: Mapped[str] = mapped_column(Text, default="{}")
+    status: Mapped[str] = mapped_column(String(16), default="queued")  # queued, running, done, failed
+    cache_key: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+    cached: Mapped[bool] = mapped_column(Boolean, default=False)
+    error: Mapped[Optional[str]] = mapped_column(String(512), nullable=True)
+    # client-side so jobs queued within the same second still list in order
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+
+class ReportResult(Base):
+    """A computed report, keyed by everything it was computed from."""
+
+    __tablename__ = "report_results"
+    cache_key: Mapped[str] = mapped_column(String(32), primary_key=True)
+    token: Mapped[str] = mapped_column(String(64), index=True)
+    kind: Mapped[str] = mapped_column(String(32))
+    result: Mapped[str] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
 
 
 # Create engine and session factory
-if DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-else:
-    engine = create_engine(DATABASE_URL)
+
+
+def _engine_options(url: Union[str, URL]) -> dict:
+    options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE_SECONDS}
+    url = make_url(url)
+    if not issubclass(url.get_dialect().get_pool_class(url), QueuePool):
+        # in-memory SQLite (SingletonThreadPool/StaticPool) and aiosqlite files (NullPool) have nothing to size
+        return options
+    options.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+    )
+    return options
+
+
+def _tune_sqlite(sync_engine) -> None:
+    """WAL lets readers run alongside the quote upserts instead of hitting "database is locked"."""
+
+    @event.listens_for(sync_engine, "connect")
+    def _set_pragmas(dbapi_connection, _record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.close()
+
+
+def describe_engine(target) -> str:
+    """One-line summary of an engine's pool and the options it was built with."""
+    options = _engine_options(target.url)
+    parts = [f"url={target.url.render_as_string(hide_password=True)}", f"pool={type(target.pool).__name__}"]
+    if "pool_size" in options:
+        parts += [
+            f"size={options['pool_size']}",
+            f"max_overflow={options['max_overflow']}",
+            f"timeout={options['pool_timeout']}s",
+        ]
+    parts += [f"pre_ping={options['pool_pre_ping']}", f"recycle={options['pool_recycle']}s"]
+    return " ".join(parts)
+
+
+def build_engine(url: str):
+    if url.startswith("sqlite"):
+        sync_engine = create_engine(url, connect_args={"check_same_thread": False}, **_engine_options(url))
+        _tune_sqlite(sync_engine)
+        return sync_engine
+    return create_engine(url, **_engine_options(url))
+
+
+def build_async_engine(url: str):
+    async_engine = create_async_engine(url, **_engine_options(url))
+    if url.startswith("sqlite"):
+        _tune_sqlite(async_engine.sync_engine)
+    return async_engine
+
+
+engine = build_engine(DATABASE_URL)
 
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
 
+def _async_database_url(url: str) -> str:
+    """Map a sync SQLAlchemy URL onto its asyncio driver."""
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:") :]
+    if url.startswith("postgresql"):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    return url
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_database_url(DATABASE_URL)
+
+# Only built in async mode so the async drivers stay optional
+async_engine = build_async_engine(ASYNC_DATABASE_URL) if ASYNC_DB_ENABLED else None
+AsyncSessionLocal = (
+    async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False) if async_engine else None
+)
+
+
+def _dialect_insert(db: Union[Session, AsyncSession]):
+    """The dialect's ``insert`` with ON CONFLICT support, or None if unsupported."""
+    return {"sqlite": sqlite.insert, "postgresql": postgresql.insert}.get(db.bind.dialect.name)
+
+
+def _quote_upsert(db: Union[Session, AsyncSession]):
+    """INSERT ... ON CONFLICT (symbol) DO UPDATE for quote rows, or None if unsupported."""
+    insert = _dialect_insert(db)
+    if insert is None:
+        return None
+    stmt = insert(Quote)
+    return stmt.on_conflict_do_update(
+        index_elements=[Quote.symbol],
+        set_={c: stmt.excluded[c] for c in ("price", "fetched_at", "prev_close")},
+    )
+
+
+def _add_missing_columns() -> None:
+    """create_all never alters existing tables, so add nullable columns introduced later."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    col_type = column.type.compile(engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+
+
 def init_db():
     Base.metadata.create_all(engine)
+    _add_missing_columns()
+
+
+def check_db() -> None:
+    """Fail fast if the schema was never created; one catalog query instead of create_all's per-table checks."""
+    missing = set(Base.metadata.tables) - set(inspect(engine).get_table_names())
+    if missing:
+        raise RuntimeError(f"missing tables {sorted(missing)}; run `python main.py init-db` first")
 
 
 @app.on_event("startup")
 def on_startup():
-    init_db()
+    started = time.perf_counter()
+    logger.info("database engine: %s", describe_engine(engine))
+    logger.info("price providers: %s", ", ".join(p.name for p in alpha_client.providers) or "none")
+    if async_engine is not None:
+        logger.info("async database engine: %s", describe_engine(async_engine.sync_engine))
+    if DB_SCHEMA_MODE == "create":
+        init_db()
+    elif DB_SCHEMA_MODE == "check":
+        check_db()
+    alert_engine.sync()
+    exposure_index.load()
+    if PRICE_REFRESHER_ENABLED:
+        quote_refresher.start()
+    if SENTIMENT_WARMUP:
+        threading.Thread(target=get_vader, name="vader-warmup", daemon=True).start()
+    logger.info("startup finished in %.1f ms", (time.perf_counter() - started) * 1000)
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    quote_refresher.stop()
+    quote_hub.stop()
+    quote_writer.stop()
+    report_pool.shutdown(wait=False, cancel_futures=True)
+    _shutdown_sentiment_pool()
+    await alpha_client.aclose()
+    if async_engine is not None:
+        await async_engine.dispose()
 
 
 def get_db():
@@ -107,13 +439,240 @@ def get_db():
         db.close()
 
 
+async def get_read_db():
+    """Session for the read routes: an AsyncSession in async mode, else a sync one."""
+    if ASYNC_DB_ENABLED:
+        async with AsyncSessionLocal() as db:
+            yield db
+        return
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        await run_in_threadpool(db.close)
+
+
+# ----- Instrumentation -----
+
+
+class RequestMetrics:
+    """What one request spent; shared by the threads and tasks working on it."""
+
+    __slots__ = ("sql_count", "sql_seconds", "upstream_count", "upstream_seconds", "cache_hits", "cache_misses")
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.upstream_count = 0
+        self.upstream_seconds = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def server_timing(self, total_seconds: float) -> str:
+        lookups = self.cache_hits + self.cache_misses
+        parts = [
+            f"app;dur={total_seconds * 1000:.2f}",
+            f'db;dur={self.sql_seconds * 1000:.2f};desc="{self.sql_count} queries"',
+            f'upstream;dur={self.upstream_seconds * 1000:.2f};desc="{self.upstream_count} calls"',
+        ]
+        if lookups:
+            parts.append(f'cache;desc="hit ratio {self.cache_hits / lookups:.2f}"')
+        return ", ".join(parts)
+
+
+_request_metrics: ContextVar[Optional[RequestMetrics]] = ContextVar("request_metrics", default=None)
+
+
+class MetricsRegistry:
+    """Process-wide counters and histograms rendered in the Prometheus text format."""
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    HELP = {
+        "http_requests_total": ("counter", "HTTP requests by route template and status."),
+        "http_request_duration_seconds": ("histogram", "Wall time per HTTP request."),
+        "db_statements_total": ("counter", "SQL statements executed."),
+        "db_statement_duration_seconds": ("histogram", "Time per SQL statement."),
+        "upstream_requests_total": ("counter", "Alpha Vantage calls by function and outcome."),
+        "upstream_request_duration_seconds": ("histogram", "Time per Alpha Vantage call."),
+        "quote_lookups_total": ("counter", "Quote lookups served from cache (memory or table) or not."),
+        "quote_flush_duration_seconds": ("histogram", "Time per write-behind quote flush."),
+        "quote_flush_rows_total": ("counter", "Quote rows written by write-behind flushes."),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        # per series: one count per bucket, the overflow count, then sum and count
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[float]] = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [0.0] * (len(self.BUCKETS) + 3)
+            series[bisect.bisect_left(self.BUCKETS, seconds)] += 1  # index len(BUCKETS) is +Inf only
+            series[-2] += seconds
+            series[-1] += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    @staticmethod
+    def _labels(pairs: Iterable[Tuple[str, str]]) -> str:
+        escaped = ((k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+        body = ",".join(f'{k}="{v}"' for k, v in escaped)
+        return "{" + body + "}" if body else ""
+
+    def render(self, snapshot: Optional[Dict[str, Tuple[str, float]]] = None) -> str:
+        """Everything recorded so far, plus ``snapshot`` values (name -> (type, value)) read at scrape time."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(series)) for key, series in self._histograms.items())
+        lines: List[str] = []
+        described: Set[str] = set()
+
+        def describe(name: str, kind: str, help_text: str) -> None:
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            describe(name, *self.HELP.get(name, ("counter", name)))
+            lines.append(f"{name}{self._labels(labels)} {value:g}")
+        for (name, labels), series in histograms:
+            describe(name, *self.HELP.get(name, ("histogram", name)))
+            cumulative = 0.0
+            for bound, count in zip(self.BUCKETS, series):
+                cumulative += count
+                lines.append(f"{name}_bucket{self._labels(labels + (('le', f'{bound:g}'),))} {cumulative:g}")
+            lines.append(f"{name}_bucket{self._labels(labels + (('le', '+Inf'),))} {series[-1]:g}")
+            lines.append(f"{name}_sum{self._labels(labels)} {series[-2]:.6f}")
+            lines.append(f"{name}_count{self._labels(labels)} {series[-1]:g}")
+        for name, (kind, value) in (snapshot or {}).items():
+            describe(name, kind, name.replace("_", " ") + ".")
+            lines.append(f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_metrics_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    metrics_registry.inc("db_statements_total")
+    metrics_registry.observe("db_statement_duration_seconds", elapsed)
+    current = _request_metrics.get()
+    if current is not None:
+        current.sql_count += 1
+        current.sql_seconds += elapsed
+
+
+def set_metrics_enabled(enabled: bool) -> None:
+    """Turn instrumentation on or off; when off no SQL hooks are installed at all."""
+    global METRICS_ENABLED
+    targets = [engine] + ([async_engine.sync_engine] if async_engine is not None else [])
+    hooks = (("before_cursor_execute", _before_cursor_execute), ("after_cursor_execute", _after_cursor_execute))
+    for target in targets:
+        for name, fn in hooks:
+            installed = event.contains(target, name, fn)
+            if enabled and not installed:
+                event.listen(target, name, fn)
+            elif not enabled and installed:
+                event.remove(target, name, fn)
+    METRICS_ENABLED = enabled
+
+
+def _record_upstream(function: str, outcome: str, seconds: Optional[float]) -> None:
+    metrics_registry.inc("upstream_requests_total", function=function, outcome=outcome)
+    if seconds is None:
+        return  # never left the process (throttled)
+    metrics_registry.observe("upstream_request_duration_seconds", seconds, function=function)
+    current = _request_metrics.get()
+    if current is not None:
+        current.upstream_count += 1
+        current.upstream_seconds += seconds
+
+
+def _record_lookups(hits: int, misses: int) -> None:
+    if not METRICS_ENABLED:
+        return
+    if hits:
+        metrics_registry.inc("quote_lookups_total", hits, result="hit")
+    if misses:
+        metrics_registry.inc("quote_lookups_total", misses, result="miss")
+    current = _request_metrics.get()
+    if current is not None:
+        current.cache_hits += hits
+        current.cache_misses += misses
+
+
+class InstrumentationMiddleware:
+    """Time each HTTP request, add a Server-Timing header and record it by route template.
+
+    Pure ASGI (no BaseHTTPMiddleware) so the disabled path is one flag check.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        current = RequestMetrics()
+        reset_token = _request_metrics.set(current)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message).append(
+                    "Server-Timing", current.server_timing(time.perf_counter() - started)
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_metrics.reset(reset_token)
+            elapsed = time.perf_counter() - started
+            # the template, not the raw path, so tokens and symbols don't explode the series count
+            route = getattr(scope.get("route"), "path", "unmatched")
+            metrics_registry.inc("http_requests_total", method=scope["method"], route=route, status=str(status))
+            metrics_registry.observe("http_request_duration_seconds", elapsed, route=route)
+
+
+app.add_middleware(InstrumentationMiddleware)
+set_metrics_enabled(METRICS_ENABLED)
+
+
 # ----- Schemas -----
 
 
 class PositionIn(BaseModel):
     symbol: str
-    qty: float
-    avg_cost: float
+    # JSON like 1e400 parses as inf, which would make every valuation of the portfolio non-finite
+    qty: float = Field(allow_inf_nan=False)
+    avg_cost: float = Field(allow_inf_nan=False)
     name: Optional[str] = None
 
 
@@ -128,6 +687,8 @@ class PortfolioSummary(BaseModel):
     total_value: float
     pnl: float
     pnl_pct: float = Field(..., description="PnL as percent of cost basis")
+    day_change: float = Field(0.0, description="Value change since the previous close")
+    day_change_pct: float = Field(0.0, description="Day change as percent of previous-close value")
     positions: List[PositionOut]
 
 
@@ -135,78 +696,2026 @@ class CreatePortfolioResponse(BaseModel):
     token: str
 
 
+class ImportResult(BaseModel):
+    token: str
+    imported: int
+    rejected: int
+    errors: List[dict] = Field(default_factory=list, description="First rejected rows with line numbers")
+
+
 # ----- Alpha Vantage Client with DB-backed Cache -----
 
 
-class AlphaVantageClient:
-    base_url = "https://www.alphavantage.co/query"
+class FetchedQuote(NamedTuple):
+    price: float
+    prev_close: Optional[float] = None
+
+
+class CachedQuote(NamedTuple):
+    price: float
+    fetched_at: datetime
+    prev_close: Optional[float] = None
+
+
+# a quotes-table row, or the same columns loaded without building the ORM object
+QuoteRow = Union[Quote, CachedQuote]
+
+
+class QuoteCache:
+    """Thread-safe in-process LRU of recent quotes, checked before the quotes table."""
+
+    def __init__(self, ttl_seconds: int, max_size: int):
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.max_size = max(1, max_size)
+        self._data: "OrderedDict[str, CachedQuote]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, symbol: str, now: Optional[datetime] = None) -> Optional[float]:
+        now = now or datetime.utcnow()
+        with self._lock:
+            entry = self._data.get(symbol)
+            if entry and (now - entry.fetched_at) < self.ttl:
+                self._data.move_to_end(symbol)
+                self.hits += 1
+                return entry.price
+            self.misses += 1
+            return None
+
+    def peek(self, symbol: str) -> Optional[CachedQuote]:
+        """Return the entry even if expired, without touching LRU order or counters."""
+        with self._lock:
+            return self._data.get(symbol)
+
+    def put(self, symbol: str, price: float, fetched_at: datetime, prev_close: Optional[float] = None) -> None:
+        with self._lock:
+            self._data[symbol] = CachedQuote(price, fetched_at, prev_close)
+            self._data.move_to_end(symbol)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class TokenBucket:
+    """Thread-safe token bucket: ``rate`` tokens per second, bursting up to ``capacity``."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self) -> float:
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+
+class CircuitBreaker:
+    """Thread-safe circuit breaker for one upstream.
+
+    Opens after ``failure_threshold`` consecutive failures (or at once on
+    :meth:`trip`), rejects calls for ``reset_seconds``, then lets a single
+    probe through: its success closes the circuit, its failure reopens it.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._probing or time.monotonic() - self._opened_at < self.reset_seconds:
+                return "open"
+            return "half_open"
+
+    def allow(self) -> Optional[str]:
+        """Admit a call: ``"closed"`` normally, ``"probe"`` for the one half-open trial, None while open."""
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._probing or time.monotonic() - self._opened_at < self.reset_seconds:
+                return None
+            self._probing = True
+            return "probe"
+
+    def release(self) -> None:
+        """Give back the probe slot :meth:`allow` granted to a call that never went out."""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                self._open()
+
+    def trip(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._open()
+
+    def _open(self) -> None:
+        if self._opened_at is None:
+            logger.warning("Alpha Vantage circuit opened after %d failure(s)", self.failures)
+        self._opened_at = time.monotonic()
+        self._probing = False
+
+
+class QuotaExhausted(RuntimeError):
+    """Raised instead of calling Alpha Vantage when this process's call budget is spent."""
+
+
+class CircuitOpen(QuotaExhausted):
+    """Raised instead of calling Alpha Vantage while the circuit breaker is open."""
+
+
+class UpstreamRateLimited(RuntimeError):
+    """Alpha Vantage answered 200 with a "Note"/"Information" rate-limit message instead of data."""
+
+
+class ProviderUnavailable(QuotaExhausted):
+    """Raised when no configured price provider could be asked, e.g. Alpha Vantage without an API key."""
+
+
+class PriceProvider(abc.ABC):
+    """An upstream source of quotes and daily bars.
+
+    :class:`AlphaVantageClient` serves from memory and the quotes table and
+    only asks its providers, in order, about misses; a provider that raises
+    hands the symbol to the next one, so an exhausted quota or an open
+    circuit fails over without waiting. Subclasses must implement
+    :meth:`fetch_quote` and :meth:`fetch_daily`.
+    """
+
+    name = "provider"
+
+    @abc.abstractmethod
+    def fetch_quote(self, symbol: str) -> FetchedQuote:
+        ...
+
+    async def afetch_quote(self, symbol: str) -> FetchedQuote:
+        return await run_in_threadpool(self.fetch_quote, symbol)
 
-    def __init__(self, api_key: str):
+    def fetch_quotes(self, symbols: Iterable[str]) -> Dict[str, FetchedQuote]:
+        """Bulk lookup; symbols this provider cannot price are left out."""
+        quotes: Dict[str, FetchedQuote] = {}
+        for symbol in symbols:
+            try:
+                quotes[symbol] = self.fetch_quote(symbol)
+            except QuotaExhausted:
+                break  # the rest would be refused too
+            except Exception:
+                continue
+        return quotes
+
+    @abc.abstractmethod
+    def fetch_daily(self, symbol: str, full: bool = False) -> List[dict]:
+        """Daily bars as ``store_price_bars`` rows; the latest ~100 unless ``full``."""
+
+
+class AlphaVantageProvider(PriceProvider):
+    """The Alpha Vantage HTTP API, through the client's rate limiter and circuit breaker."""
+
+    name = "alphavantage"
+
+    def __init__(self, client: "AlphaVantageClient"):
+        self.client = client
+
+    def fetch_quote(self, symbol: str) -> FetchedQuote:
+        return self.client._fetch_alphavantage(symbol)
+
+    async def afetch_quote(self, symbol: str) -> FetchedQuote:
+        return await self.client._afetch_alphavantage(symbol)
+
+    def fetch_daily(self, symbol: str, full: bool = False) -> List[dict]:
+        return self.client._alphavantage_bars(symbol, full)
+
+
+class ReplayProvider(PriceProvider):
+    """Serves recorded Alpha Vantage responses from a local JSON file.
+
+    The file maps each symbol to its GLOBAL_QUOTE and/or TIME_SERIES_DAILY
+    payloads, merged into one object (``{"IBM": {"Global Quote": {...},
+    "Time Series (Daily)": {...}}}``). Every call waits ``latency_ms`` first,
+    and a bulk lookup waits once, so offline runs keep realistic timings.
+    """
+
+    name = "replay"
+
+    def __init__(self, path: str, latency_ms: float = 0.0):
+        with open(path, "r", encoding="utf-8") as f:
+            self._data: Dict[str, dict] = {symbol.upper(): payload for symbol, payload in json.load(f).items()}
+        self.latency = latency_ms / 1000.0
+
+    def _quote(self, symbol: str) -> FetchedQuote:
+        data = self._data.get(symbol.upper())
+        if data is None:
+            raise KeyError(f"no recorded data for {symbol}")
+        return AlphaVantageClient._parse_global_quote(data) or AlphaVantageClient._parse_daily_close(data)
+
+    def fetch_quote(self, symbol: str) -> FetchedQuote:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._quote(symbol)
+
+    async def afetch_quote(self, symbol: str) -> FetchedQuote:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._quote(symbol)
+
+    def fetch_quotes(self, symbols: Iterable[str]) -> Dict[str, FetchedQuote]:
+        if self.latency:
+            time.sleep(self.latency)
+        quotes: Dict[str, FetchedQuote] = {}
+        for symbol in symbols:
+            try:
+                quotes[symbol] = self._quote(symbol)
+            except (KeyError, ValueError):
+                continue
+        return quotes
+
+    def fetch_daily(self, symbol: str, full: bool = False) -> List[dict]:
+        if self.latency:
+            time.sleep(self.latency)
+        bars = AlphaVantageClient._parse_daily_bars(symbol, self._data.get(symbol.upper(), {}))
+        bars.sort(key=lambda bar: bar["day"])
+        return bars if full else bars[-100:]  # Alpha Vantage's compact output size
+
+
+def build_providers(client: "AlphaVantageClient", names: str) -> List[PriceProvider]:
+    """Providers named in ``names`` (comma separated), in failover order."""
+    providers: List[PriceProvider] = []
+    for name in filter(None, (n.strip().lower() for n in names.split(","))):
+        if name == "alphavantage":
+            providers.append(AlphaVantageProvider(client))
+        elif name == "replay":
+            if not PRICE_REPLAY_FILE:
+                raise ValueError("the replay price provider needs PRICE_REPLAY_FILE")
+            providers.append(ReplayProvider(PRICE_REPLAY_FILE, PRICE_REPLAY_LATENCY_MS))
+        else:
+            raise ValueError(f"unknown price provider {name!r}")
+    return providers
+
+
+class AlphaVantageClient:
+    base_url = ALPHAVANTAGE_BASE_URL
+
+    def __init__(
+        self,
+        api_key: str,
+        max_workers: int = PRICE_FETCH_CONCURRENCY,
+        calls_per_minute: float = ALPHAVANTAGE_CALLS_PER_MINUTE / WEB_CONCURRENCY,
+        providers: str = PRICE_PROVIDERS,
+    ):
         self.api_key = api_key
-        self._client = httpx.Client(timeout=20.0)
+        # asked in order about symbols neither the memory nor the quotes table can serve
+        self.providers: List[PriceProvider] = build_providers(self, providers)
+        # a dead upstream should fail in seconds, not hold a worker for the old 20s
+        self.timeout = httpx.Timeout(ALPHAVANTAGE_READ_TIMEOUT_SECONDS, connect=ALPHAVANTAGE_CONNECT_TIMEOUT_SECONDS)
+        self._client = httpx.Client(timeout=self.timeout)
+        # every upstream HTTP call spends one token, whichever path makes it
+        self.bucket = TokenBucket(calls_per_minute / 60.0, max(1.0, calls_per_minute))
+        # while open, lookups fall back to cached prices without waiting on the network
+        self.breaker = CircuitBreaker(ALPHAVANTAGE_BREAKER_FAILURES, ALPHAVANTAGE_BREAKER_RESET_SECONDS)
+        # transient failures are retried once, but only while this process-wide budget lasts
+        retries = ALPHAVANTAGE_RETRIES_PER_MINUTE
+        self.retry_budget = TokenBucket(retries / 60.0, max(1.0, retries))
+        self.memory = QuoteCache(PRICE_CACHE_TTL_SECONDS, PRICE_MEMORY_CACHE_SIZE)
+        # bounded pool so a cold portfolio costs ~one round trip instead of N
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="av-fetch")
+        # single-flight: at most one upstream fetch per symbol at a time
+        self._inflight: Dict[str, "Future[Optional[FetchedQuote]]"] = {}
+        self._inflight_lock = threading.Lock()
+        self._ainflight: Dict[str, "asyncio.Future[Optional[FetchedQuote]]"] = {}
+        # pooled keep-alive clients for the async request path, one per event loop
+        self._aclients: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+        # called with (symbol, quote) whenever a fresh upstream quote is stored
+        self._listeners: List[Callable[[str, FetchedQuote], None]] = []
+        # background history downloads: symbols queued, and (monotonic time, full) of the last attempt
+        self._history_pending: Set[str] = set()
+        self._history_attempts: Dict[str, Tuple[float, bool]] = {}
+        self._history_lock = threading.Lock()
+
+    def add_listener(self, listener: Callable[[str, FetchedQuote], None]) -> None:
+        self._listeners.append(listener)
+
+    def _notify(self, symbol: str, quote: FetchedQuote) -> None:
+        for listener in self._listeners:
+            try:
+                listener(symbol, quote)
+            except Exception:
+                logger.exception("quote listener failed for %s", symbol)
+
+    def _global_quote_params(self, symbol: str) -> Dict[str, str]:
+        return {"function": "GLOBAL_QUOTE", "symbol": symbol, "apikey": self.api_key}
+
+    def _daily_params(self, symbol: str) -> Dict[str, str]:
+        return {
+            "function": "TIME_SERIES_DAILY",
+            "symbol": symbol,
+            "apikey": self.api_key,
+            "outputsize": "compact",
+        }
+
+    @staticmethod
+    def _parse_global_quote(data: dict) -> Optional[FetchedQuote]:
+        quote = data.get("Global Quote", {})
+        price_str = quote.get("05. price") or quote.get("05. Price")
+        if not price_str:
+            return None
+        prev_str = quote.get("08. previous close") or quote.get("08. Previous Close")
+        return FetchedQuote(float(price_str), float(prev_str) if prev_str else None)
+
+    @staticmethod
+    def _parse_daily_close(data: dict) -> FetchedQuote:
+        ts = data.get("Time Series (Daily)", {})
+        if not ts:
+            raise ValueError("No time series data returned")
+        days = sorted(ts.keys())
+        prev_close = float(ts[days[-2]]["4. close"]) if len(days) > 1 else None
+        return FetchedQuote(float(ts[days[-1]]["4. close"]), prev_close)  # close price
+
+    @staticmethod
+    def _parse_daily_bars(symbol: str, data: dict) -> List[dict]:
+        return [
+            {
+                "symbol": symbol.upper(),
+                "day": date.fromisoformat(day),
+                "open": float(bar["1. open"]),
+                "high": float(bar["2. high"]),
+                "low": float(bar["3. low"]),
+                "close": float(bar["4. close"]),
+                "volume": float(bar.get("5. volume", 0.0)),
+            }
+            for day, bar in data.get("Time Series (Daily)", {}).items()
+        ]
+
+    def _admit(self, function: str) -> None:
+        """Spend a quota token unless the breaker or the bucket says no."""
+        admitted = self.breaker.allow()
+        if admitted is None:
+            if METRICS_ENABLED:
+                _record_upstream(function, "circuit_open", None)
+            raise CircuitOpen(function)
+        if not self.bucket.try_acquire():
+            if admitted == "probe":  # a call admitted while closed must not free someone else's probe
+                self.breaker.release()
+            if METRICS_ENABLED:
+                _record_upstream(function, "throttled", None)
+            raise QuotaExhausted(function)
+
+    def _settle(
+        self,
+        function: str,
+        started: float,
+        response: Optional[httpx.Response],
+        error: Optional[Exception],
+    ) -> Union[dict, Exception]:
+        """Feed one attempt to the breaker and metrics; returns the JSON body, or the error to raise."""
+        outcome = "error"
+        if error is None:
+            try:
+                response.raise_for_status()
+                data = response.json()
+                if "Note" in data or "Information" in data:
+                    error = UpstreamRateLimited(data.get("Note") or data.get("Information"))
+                    outcome = "rate_limited"
+                else:
+                    outcome = "ok"
+            except Exception as exc:
+                error = exc
+        if METRICS_ENABLED:
+            _record_upstream(function, outcome, time.perf_counter() - started)
+        if outcome == "ok":
+            self.breaker.record_success()
+            return data
+        if outcome == "rate_limited":
+            self.breaker.trip()  # the rest of the minute will be refused too
+        else:
+            self.breaker.record_failure()
+        return error
+
+    def _should_retry(self, error: Exception) -> bool:
+        transient = isinstance(error, httpx.TransportError) or (
+            isinstance(error, httpx.HTTPStatusError) and error.response.status_code >= 500
+        )
+        return transient and self.breaker.state == "closed" and self.retry_budget.try_acquire()
+
+    def _get(self, params: Dict[str, str]) -> dict:
+        function = params["function"]
+        for attempt in range(2):
+            self._admit(function)
+            started, response, error = time.perf_counter(), None, None
+            try:
+                response = self._client.get(self.base_url, params=params)
+            except Exception as exc:
+                error = exc
+            result = self._settle(function, started, response, error)
+            if not isinstance(result, Exception):
+                return result
+            if attempt or not self._should_retry(result):
+                raise result
+
+    async def _aget(self, params: Dict[str, str]) -> dict:
+        function = params["function"]
+        for attempt in range(2):
+            self._admit(function)
+            started, response, error = time.perf_counter(), None, None
+            try:
+                response = await self._async_http().get(self.base_url, params=params)
+            except Exception as exc:
+                error = exc
+            result = self._settle(function, started, response, error)
+            if not isinstance(result, Exception):
+                return result
+            if attempt or not self._should_retry(result):
+                raise result
+
+    def _keep_history(self, symbol: str, data: dict) -> None:
+        """Persist every bar of a TIME_SERIES_DAILY response instead of only the last close."""
+        try:
+            store_price_bars(self._parse_daily_bars(symbol, data))
+        except Exception:
+            logger.exception("failed to store daily bars for %s", symbol)
+
+    def fetch_history(self, symbol: str, full: bool = False) -> int:
+        """Download and store daily bars for ``symbol`` from the first provider that has them."""
+        error: Optional[Exception] = None
+        for provider in self.providers:
+            try:
+                bars = provider.fetch_daily(symbol, full)
+            except Exception as exc:
+                error = exc
+                continue
+            store_price_bars(bars)
+            return len(bars)
+        raise error or ProviderUnavailable(symbol)
+
+    def _alphavantage_bars(self, symbol: str, full: bool) -> List[dict]:
+        if not self.api_key:
+            raise ProviderUnavailable("ALPHAVANTAGE_API_KEY is not set")
+        params = self._daily_params(symbol)
+        if full:
+            params["outputsize"] = "full"
+        return self._parse_daily_bars(symbol, self._get(params))
+
+    def backfill_history(self, symbols: List[str], full: bool = False) -> Dict[str, int]:
+        """Fetch history for several symbols concurrently; failures count as 0 bars."""
+
+        def _one(symbol: str) -> int:
+            try:
+                return self.fetch_history(symbol, full)
+            except Exception:
+                return 0
+
+        return dict(zip(symbols, self._pool.map(_one, symbols)))
+
+    def request_history(self, symbols: Iterable[str], full: bool = False) -> List[str]:
+        """Queue history downloads on the fetch pool and return the symbols queued.
+
+        Symbols already queued, or attempted within ``PRICE_HISTORY_REFETCH_SECONDS``
+        (including failed attempts), are skipped unless ``full`` asks for more
+        than that attempt fetched.
+        """
+        now = time.monotonic()
+        queued = []
+        with self._history_lock:
+            for symbol in symbols:
+                if symbol in self._history_pending:
+                    continue
+                attempt = self._history_attempts.get(symbol)
+                if attempt and now - attempt[0] < PRICE_HISTORY_REFETCH_SECONDS and (attempt[1] or not full):
+                    continue
+                self._history_pending.add(symbol)
+                queued.append(symbol)
+        for symbol in queued:
+            self._pool.submit(self._backfill_one, symbol, full)
+        return queued
+
+    def _backfill_one(self, symbol: str, full: bool) -> None:
+        remember = True
+        try:
+            self.fetch_history(symbol, full)
+        except QuotaExhausted:
+            remember = False  # out of budget, not a bad symbol; a later request retries
+        except Exception:
+            logger.warning("history backfill failed for %s", symbol, exc_info=True)
+        with self._history_lock:
+            self._history_pending.discard(symbol)
+            if remember:
+                self._history_attempts[symbol] = (time.monotonic(), full)
+
+    def _fetch_quote(self, symbol: str) -> FetchedQuote:
+        """Fetch a live price from the first provider that answers; raises the last provider's error."""
+        error: Optional[Exception] = None
+        for provider in self.providers:
+            try:
+                return provider.fetch_quote(symbol)
+            except Exception as exc:
+                error = exc
+        raise error or ProviderUnavailable(symbol)
+
+    async def _afetch_quote(self, symbol: str) -> FetchedQuote:
+        """Async twin of :meth:`_fetch_quote`."""
+        error: Optional[Exception] = None
+        for provider in self.providers:
+            try:
+                return await provider.afetch_quote(symbol)
+            except Exception as exc:
+                error = exc
+        raise error or ProviderUnavailable(symbol)
+
+    def _fetch_alphavantage(self, symbol: str) -> FetchedQuote:
+        """Fetch a live price and previous close from Alpha Vantage. Raises on network/quota errors."""
+        if not self.api_key:
+            raise ProviderUnavailable("ALPHAVANTAGE_API_KEY is not set")
+
+        # Try GLOBAL_QUOTE first
+        quote = self._parse_global_quote(self._get(self._global_quote_params(symbol)))
+        if quote is not None:
+            return quote
+
+        # Fallback: TIME_SERIES_DAILY last close
+        data = self._get(self._daily_params(symbol))
+        quote = self._parse_daily_close(data)
+        self._pool.submit(self._keep_history, symbol, data)  # callers wait on the quote, not the bars
+        return quote
+
+    async def _afetch_alphavantage(self, symbol: str) -> FetchedQuote:
+        """Async twin of :meth:`_fetch_alphavantage` over the shared keep-alive client."""
+        if not self.api_key:
+            raise ProviderUnavailable("ALPHAVANTAGE_API_KEY is not set")
+
+        quote = self._parse_global_quote(await self._aget(self._global_quote_params(symbol)))
+        if quote is not None:
+            return quote
+
+        data = await self._aget(self._daily_params(symbol))
+        quote = self._parse_daily_close(data)
+        self._pool.submit(self._keep_history, symbol, data)  # off the event loop
+        return quote
+
+    def _async_http(self) -> httpx.AsyncClient:
+        # connections are bound to the loop that opened them
+        loop = asyncio.get_running_loop()
+        http = self._aclients.get(loop)
+        if http is None:
+            # clients of loops that have shut down hold only dead transports
+            for old in [old for old in self._aclients if old.is_closed()]:
+                del self._aclients[old]
+            http = self._aclients[loop] = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=PRICE_FETCH_CONCURRENCY,
+                    max_keepalive_connections=PRICE_FETCH_CONCURRENCY,
+                ),
+            )
+        return http
+
+    async def aclose(self) -> None:
+        """Close the current loop's async client; call before that loop shuts down."""
+        http = self._aclients.pop(asyncio.get_running_loop(), None)
+        if http is not None:
+            await http.aclose()
+
+    def _try_fetch(self, symbol: str) -> Optional[FetchedQuote]:
+        try:
+            return self._fetch_quote(symbol)
+        except Exception:
+            # keep service resilient under quota/network errors
+            return None
+
+    async def _atry_fetch(self, symbol: str) -> Optional[FetchedQuote]:
+        try:
+            return await self._afetch_quote(symbol)
+        except Exception:
+            return None
+
+    def _afetch_shared(self, symbol: str) -> Tuple["asyncio.Future[Optional[FetchedQuote]]", bool]:
+        """Event-loop single-flight; only touched from the loop, so no lock."""
+        task = self._ainflight.get(symbol)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            return task, False
+        task = asyncio.ensure_future(self._atry_fetch(symbol))
+        self._ainflight[symbol] = task
+
+        def _done(t: "asyncio.Future[Optional[FetchedQuote]]") -> None:
+            if self._ainflight.get(symbol) is t:
+                del self._ainflight[symbol]
+
+        task.add_done_callback(_done)
+        return task, True
+
+    def _fetch_shared(self, symbol: str) -> Tuple["Future[Optional[FetchedQuote]]", bool]:
+        """Join the in-flight fetch for ``symbol`` or start one.
+
+        Returns the future and whether this caller is the leader (and so
+        responsible for persisting the result).
+        """
+        with self._inflight_lock:
+            fut = self._inflight.get(symbol)
+            if fut is not None:
+                return fut, False
+            # carry the request's context so the fetch is counted against it
+            fut = self._pool.submit(copy_context().run, self._try_fetch, symbol)
+            self._inflight[symbol] = fut
+
+        def _done(f: "Future[Optional[FetchedQuote]]") -> None:
+            with self._inflight_lock:
+                if self._inflight.get(symbol) is f:
+                    del self._inflight[symbol]
+
+        fut.add_done_callback(_done)
+        return fut, True
+
+    def _revalidate(self, symbol: str) -> None:
+        """Refresh ``symbol`` in the background unless a fetch is already running."""
+        fut, leader = self._fetch_shared(symbol)
+        if leader:
+            fut.add_done_callback(lambda f: self._store_background(symbol, f.result()))
+
+    def refresh(self, symbol: str) -> Optional[float]:
+        """Fetch ``symbol`` now (joining any in-flight fetch) and persist it."""
+        fut, leader = self._fetch_shared(symbol.upper())
+        fetched = fut.result()
+        if leader:
+            self._store_background(symbol.upper(), fetched)
+        return fetched.price if fetched else None
+
+    def _store_background(self, symbol: str, fetched: Optional[FetchedQuote]) -> None:
+        if fetched is None:
+            return  # keep serving the stale quote; the next request retries
+        now = datetime.utcnow()
+        quote_writer.submit(
+            [{"symbol": symbol, "price": fetched.price, "fetched_at": now, "prev_close": fetched.prev_close}]
+        )
+        self.memory.put(symbol, fetched.price, now, fetched.prev_close)
+        self._notify(symbol, fetched)
+
+    def previous_closes(
+        self,
+        symbols: Iterable[str],
+        quotes: Optional[Dict[str, Optional[QuoteRow]]] = None,
+    ) -> Dict[str, float]:
+        """Previous close per symbol from the hot cache (falling back to loaded rows).
+
+        Meant to run right after :meth:`get_prices`, which leaves every priced
+        symbol in the cache, so it costs one lookup per symbol and no SQL.
+        """
+        closes: Dict[str, float] = {}
+        for sym in symbols:
+            entry = self.memory.peek(sym)
+            prev = entry.prev_close if entry else None
+            if prev is None and quotes and quotes.get(sym) is not None:
+                prev = quotes[sym].prev_close
+            if prev is not None:
+                closes[sym] = prev
+        return closes
 
     def get_price(self, symbol: str, db: Session) -> float:
+        return self.get_prices([symbol], db)[symbol.upper()]
+
+    def get_prices(
+        self,
+        symbols: Iterable[str],
+        db: Session,
+        quotes: Optional[Dict[str, Optional[QuoteRow]]] = None,
+    ) -> Dict[str, float]:
+        """Price many symbols at once, keyed by upper-cased symbol.
+
+        Lookups fall through the in-process cache, then the quotes table (one
+        IN query), then the price providers; misses are fetched concurrently
+        and refreshed quotes go to :data:`quote_writer`, so the request never
+        writes. ``quotes`` holds rows
+        the caller already loaded (``None`` meaning "no row"), which skips the
+        IN query for those symbols.
+        """
+        now = datetime.utcnow()
+        prices, remaining = self._from_memory(symbols, now)
+        if not remaining:
+            _record_lookups(len(prices), 0)
+            return prices
+
+        cached = {sym: quotes[sym] for sym in remaining if quotes and sym in quotes}
+        unknown = [sym for sym in remaining if sym not in cached]
+        if unknown:
+            cached.update((q.symbol, q) for q in db.scalars(select(Quote).where(Quote.symbol.in_(unknown))))
+
+        misses = self._from_rows(remaining, cached, prices, now)
+        _record_lookups(len(prices), len(misses))
+        if not misses:
+            return prices
+
+        flights = {sym: self._fetch_shared(sym) for sym in misses}
+        results = {sym: (fut.result(), leader) for sym, (fut, leader) in flights.items()}
+        quote_writer.submit(self._apply_fetched(results, cached, prices, now))
+        return prices
+
+    async def aget_prices(
+        self,
+        symbols: Iterable[str],
+        db: AsyncSession,
+        quotes: Optional[Dict[str, Optional[QuoteRow]]] = None,
+    ) -> Dict[str, float]:
+        """Event-loop version of :meth:`get_prices` for the async request path."""
         now = datetime.utcnow()
-        # check cache
-        q = db.get(Quote, symbol.upper())
-        if q and (now - q.fetched_at) < timedelta(seconds=PRICE_CACHE_TTL_SECONDS):
-            return q.price
+        prices, remaining = self._from_memory(symbols, now)
+        if not remaining:
+            _record_lookups(len(prices), 0)
+            return prices
+
+        cached = {sym: quotes[sym] for sym in remaining if quotes and sym in quotes}
+        unknown = [sym for sym in remaining if sym not in cached]
+        if unknown:
+            rows = await db.scalars(select(Quote).where(Quote.symbol.in_(unknown)))
+            cached.update((q.symbol, q) for q in rows)
+
+        misses = self._from_rows(remaining, cached, prices, now)
+        _record_lookups(len(prices), len(misses))
+        if not misses:
+            return prices
+
+        flights = {sym: self._afetch_shared(sym) for sym in misses}
+        fetched = await asyncio.gather(*(task for task, _ in flights.values()))
+        results = {sym: (quote, leader) for (sym, (_, leader)), quote in zip(flights.items(), fetched)}
+        quote_writer.submit(self._apply_fetched(results, cached, prices, now))
+        return prices
+
+    def _from_memory(self, symbols: Iterable[str], now: datetime) -> Tuple[Dict[str, float], List[str]]:
+        prices: Dict[str, float] = {}
+        remaining: List[str] = []
+        for sym in dict.fromkeys(s.upper() for s in symbols):
+            price = self.memory.get(sym, now)
+            if price is not None:
+                prices[sym] = price
+            else:
+                remaining.append(sym)
+        return prices, remaining
+
+    def _from_rows(
+        self,
+        symbols: List[str],
+        cached: Dict[str, Optional[QuoteRow]],
+        prices: Dict[str, float],
+        now: datetime,
+    ) -> List[str]:
+        """Serve fresh (or revalidating stale) rows into ``prices``; return the misses."""
+        ttl = timedelta(seconds=PRICE_CACHE_TTL_SECONDS)
+        swr = timedelta(seconds=PRICE_STALE_WHILE_REVALIDATE_SECONDS)
+        misses: List[str] = []
+        for sym in symbols:
+            q = cached.get(sym)
+            if q and (now - q.fetched_at) < ttl:
+                prices[sym] = q.price
+                self.memory.put(sym, q.price, q.fetched_at, q.prev_close)
+                continue
+            stale = self.memory.peek(sym) or (CachedQuote(q.price, q.fetched_at, q.prev_close) if q else None)
+            if stale and (now - stale.fetched_at) < ttl + swr:
+                prices[sym] = stale.price
+                self._revalidate(sym)
+            else:
+                misses.append(sym)
+        return misses
+
+    def _apply_fetched(
+        self,
+        results: Dict[str, Tuple[Optional[FetchedQuote], bool]],
+        cached: Dict[str, Optional[QuoteRow]],
+        prices: Dict[str, float],
+        now: datetime,
+    ) -> List[dict]:
+        """Fill ``prices`` from fetch results and return the quote rows to upsert.
+
+        Only the flight leader writes so waiters never contend on the row, and
+        the write is an upsert because another leader may have inserted the
+        symbol since our read.
+        """
+        rows: List[dict] = []
+        for sym, (fetched, leader) in results.items():
+            q = cached.get(sym)
+            if fetched is None:
+                # nothing upstream answered (or the circuit is open): serve the stale quote as it is,
+                # without persisting it or bumping its fetched_at, and never store the placeholder
+                stale = self.memory.peek(sym) or q
+                prices[sym] = float(stale.price) if stale else 100.0
+                continue
+            prices[sym] = fetched.price
+            if not leader:
+                continue
+            prev_close = fetched.prev_close if fetched.prev_close is not None else (q.prev_close if q else None)
+            rows.append({"symbol": sym, "price": fetched.price, "fetched_at": now, "prev_close": prev_close})
+            self.memory.put(sym, fetched.price, now, prev_close)
+            self._notify(sym, FetchedQuote(fetched.price, prev_close))
+        return rows
+
+
+class QuoteWriter:
+    """Write-behind buffer for quote rows.
+
+    Fetched quotes are already served from :class:`QuoteCache`, so the table
+    copy can trail by a moment: rows are coalesced per symbol (newest
+    ``fetched_at`` wins) and upserted together by a background thread every
+    ``interval`` seconds, or sooner once ``max_rows`` are waiting. Request
+    handlers therefore never open a write transaction for a quote.
+    """
+
+    def __init__(self, interval: float = QUOTE_FLUSH_INTERVAL_SECONDS, max_rows: int = QUOTE_FLUSH_MAX_ROWS):
+        self.interval = interval
+        self.max_rows = max(1, max_rows)
+        self._pending: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # one flush at a time keeps per-symbol writes in order
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.flushes = 0
+        self.rows_written = 0
+        self.last_flush_seconds = 0.0
+
+    def submit(self, rows: Iterable[dict]) -> None:
+        with self._lock:
+            for row in rows:
+                current = self._pending.get(row["symbol"])
+                if current is None or row["fetched_at"] >= current["fetched_at"]:
+                    self._pending[row["symbol"]] = row
+            full = len(self._pending) >= self.max_rows
+        self._ensure_running()
+        if full:
+            self._wake.set()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self) -> int:
+        """Upsert everything buffered in one transaction; returns the number of rows written."""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = list(self._pending.values()), {}
+            if not rows:
+                return 0
+            started = time.perf_counter()
+            try:
+                with SessionLocal() as db:
+                    stmt = _quote_upsert(db)
+                    if stmt is not None:
+                        db.execute(stmt, rows)
+                    else:
+                        for row in rows:
+                            db.merge(Quote(**row))
+                    db.commit()
+            except Exception:
+                logger.exception("quote flush of %d rows failed; keeping them for the next one", len(rows))
+                self.submit(rows)
+                return 0
+            elapsed = time.perf_counter() - started
+            self.flushes += 1
+            self.rows_written += len(rows)
+            self.last_flush_seconds = elapsed
+            if METRICS_ENABLED:
+                metrics_registry.observe("quote_flush_duration_seconds", elapsed)
+                metrics_registry.inc("quote_flush_rows_total", len(rows))
+            return len(rows)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def _ensure_running(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._stop.is_set() or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._thread = threading.Thread(target=self._run, name="quote-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the flusher and write whatever is still buffered."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+        self._stop.clear()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "pending": self.pending(),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "last_flush_ms": round(self.last_flush_seconds * 1000, 3),
+        }
+
+
+quote_writer = QuoteWriter()
+alpha_client = AlphaVantageClient(ALPHAVANTAGE_API_KEY)
 
-        if not self.api_key:
-            # no API key -> fallback mock price
-            price = 100.0
+
+# ----- Price Streaming -----
+
+
+class Subscription:
+    """One streaming client's mailbox; bursts of updates coalesce to the latest price per symbol."""
+
+    def __init__(self, token: str, symbols: Iterable[str], version: Optional[int] = None):
+        self.token = token
+        self.symbols: Set[str] = set(symbols)
+        self.version = version  # portfolio version the client's last snapshot was read at
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+        self._lock = threading.Lock()
+        self._pending: Dict[str, float] = {}
+        self._resync = False
+
+    def _wake(self) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            pass  # loop already closed; the connection is gone
+
+    def push(self, symbol: str, price: float) -> None:
+        with self._lock:
+            self._pending[symbol] = price
+        self._wake()
+
+    def resync(self) -> None:
+        with self._lock:
+            self._resync = True
+        self._wake()
+
+    async def next(self) -> Tuple[bool, Dict[str, float]]:
+        """Wait for updates; returns (positions changed, latest price per symbol)."""
+        await self._event.wait()
+        self._event.clear()
+        with self._lock:
+            resync, self._resync = self._resync, False
+            pending, self._pending = self._pending, {}
+        return resync, pending
+
+
+class QuoteHub:
+    """Fans each refreshed quote out to every subscriber holding the symbol.
+
+    Quotes and portfolio writes are published in-process, so on its own the
+    hub only sees what this worker fetches or writes. While anyone is
+    subscribed, a poller re-reads the watched quote rows and portfolio
+    versions every ``sync_seconds`` and pushes whatever other workers changed.
+    """
+
+    def __init__(self, client: AlphaVantageClient, sync_seconds: float = STREAM_SYNC_SECONDS):
+        self.client = client
+        self.sync_seconds = sync_seconds
+        self._lock = threading.Lock()
+        self._by_symbol: Dict[str, Set[Subscription]] = {}
+        self._by_token: Dict[str, Set[Subscription]] = {}
+        self._seen: Dict[str, datetime] = {}  # symbol -> fetched_at of the row last polled
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def subscribe(self, token: str, symbols: Iterable[str], version: Optional[int] = None) -> Subscription:
+        sub = Subscription(token, symbols, version)
+        with self._lock:
+            self._by_token.setdefault(token, set()).add(sub)
+            for sym in sub.symbols:
+                self._by_symbol.setdefault(sym, set()).add(sub)
+            if self.sync_seconds > 0 and self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="quote-hub-poller", daemon=True)
+                self._thread.start()
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            self._discard(self._by_token, sub.token, sub)
+            for sym in sub.symbols:
+                self._discard(self._by_symbol, sym, sub)
+
+    def resubscribe(self, sub: Subscription, symbols: Iterable[str]) -> None:
+        symbols = set(symbols)
+        with self._lock:
+            for sym in sub.symbols - symbols:
+                self._discard(self._by_symbol, sym, sub)
+            for sym in symbols - sub.symbols:
+                self._by_symbol.setdefault(sym, set()).add(sub)
+            sub.symbols = symbols
+
+    @staticmethod
+    def _discard(index: Dict[str, Set[Subscription]], key: str, sub: Subscription) -> None:
+        subs = index.get(key)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del index[key]
+
+    def publish(self, symbol: str, quote: FetchedQuote) -> None:
+        with self._lock:
+            subs = list(self._by_symbol.get(symbol, ()))
+        for sub in subs:
+            sub.push(symbol, quote.price)
+
+    def portfolio_changed(self, token: str) -> None:
+        with self._lock:
+            subs = list(self._by_token.get(token, ()))
+        for sub in subs:
+            sub.resync()
+
+    def poll(self) -> None:
+        """Push watched quote rows and portfolio versions that changed since the last poll, whoever wrote them."""
+        with self._lock:
+            symbols = list(self._by_symbol)
+            tokens = list(self._by_token)
+        if not tokens:
+            return
+        with SessionLocal() as db:
+            quotes = db.execute(
+                select(Quote.symbol, Quote.price, Quote.fetched_at).where(Quote.symbol.in_(symbols))
+            ).all() if symbols else []
+            versions = {
+                token: version
+                for token, version in db.execute(
+                    select(Portfolio.token, func.coalesce(Portfolio.version, 0)).where(Portfolio.token.in_(tokens))
+                )
+            }
+        changed = []
+        for symbol, price, fetched_at in quotes:
+            if self._seen.get(symbol) == fetched_at:
+                continue
+            cached = self.client.memory.peek(symbol)
+            if cached is None or cached.fetched_at < fetched_at:  # this worker may already hold something newer
+                changed.append((symbol, price))
+        self._seen = {symbol: fetched_at for symbol, _, fetched_at in quotes}
+        with self._lock:
+            pushes = [(sub, sym, price) for sym, price in changed for sub in self._by_symbol.get(sym, ())]
+            stale = [
+                sub for token, version in versions.items()
+                for sub in self._by_token.get(token, ()) if sub.version != version
+            ]
+        for sub, sym, price in pushes:
+            sub.push(sym, price)
+        for sub in stale:
+            sub.version = versions[sub.token]
+            sub.resync()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.sync_seconds):
+            with self._lock:
+                if not self._by_token:
+                    self._thread = None
+                    return
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("stream poll failed")
+        with self._lock:
+            self._thread = None
+
+    def stop(self) -> None:
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=5)
+        self._stop.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "subscribers": sum(len(s) for s in self._by_token.values()),
+                "symbols": len(self._by_symbol),
+            }
+
+
+quote_hub = QuoteHub(alpha_client)
+alpha_client.add_listener(quote_hub.publish)
+
+
+# ----- Alerts -----
+
+
+ALERT_KINDS = ("price_above", "price_below", "pct_move", "weight_above")
+_RULE_RE = re.compile(r"^\s*(price|move|pct|weight)\s*(>=|>|<=|<)\s*(-?[\d.]+)\s*%?\s*$", re.I)
+
+
+class AlertOut(BaseModel):
+    id: int
+    symbol: str
+    kind: str
+    threshold: float
+    active: bool
+    created_at: Optional[datetime] = None
+    triggered_at: Optional[datetime] = None
+    triggered_price: Optional[float] = None
+
+    model_config = {"from_attributes": True}
+
+
+def parse_alert_rules(payload: dict) -> List[Tuple[str, float]]:
+    """Turn an alert payload into (kind, threshold) rules.
+
+    Accepts ``{"kind", "threshold"}``, the dashboard's ``{"above"}``/``{"below"}``
+    and rule strings such as ``"price > 200"``, ``"move >= 5%"`` or ``"weight > 25"``.
+    """
+    rules: List[Tuple[str, float]] = []
+    if payload.get("kind") is not None:
+        if payload["kind"] not in ALERT_KINDS:
+            raise ValueError(f"kind must be one of {', '.join(ALERT_KINDS)}")
+        if payload.get("threshold") is None:
+            raise ValueError("threshold is required with kind")
+        rules.append((payload["kind"], float(payload["threshold"])))
+    if payload.get("above") is not None:
+        rules.append(("price_above", float(payload["above"])))
+    if payload.get("below") is not None:
+        rules.append(("price_below", float(payload["below"])))
+    if payload.get("rule"):
+        m = _RULE_RE.match(str(payload["rule"]))
+        if not m:
+            raise ValueError("rule must look like 'price > 200', 'move >= 5%' or 'weight > 25'")
+        field, op, value = m.group(1).lower(), m.group(2), float(m.group(3))
+        if field == "price":
+            rules.append(("price_above" if ">" in op else "price_below", value))
+        elif ">" in op:
+            rules.append(("pct_move" if field in ("move", "pct") else "weight_above", abs(value)))
+        else:
+            raise ValueError(f"{field} alerts only support '>' thresholds")
+    if not rules:
+        raise ValueError("alert needs a kind/threshold, above/below or rule")
+    return rules
+
+
+class AlertEngine:
+    """Symbol-indexed alert rules.
+
+    Price and move rules live in per-symbol lists sorted by threshold, so a
+    quote update bisects to exactly the rules that fire instead of scanning
+    every alert. Weight rules need portfolio totals and are checked on the
+    fetch pool against stored quotes. Rules fire once and are deactivated.
+
+    The index is per process. With several workers each one indexes the
+    alerts created through it and picks up everyone else's within
+    ``ALERT_SYNC_SECONDS``; deletions and firings elsewhere are caught when
+    recording, which only touches rows that are still active.
+    """
+
+    def __init__(self, client: AlphaVantageClient, sync_seconds: int = ALERT_SYNC_SECONDS):
+        self.client = client
+        self.sync_seconds = sync_seconds
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._syncing = False
+        self._synced_at = 0.0
+        self._max_id = 0
+        self._above: Dict[str, List[Tuple[float, int]]] = {}
+        self._below: Dict[str, List[Tuple[float, int]]] = {}
+        self._moves: Dict[str, List[Tuple[float, int]]] = {}
+        self._weights: Dict[str, Dict[int, Tuple[str, float]]] = {}
+        self._rules: Dict[int, Tuple[str, str, float]] = {}  # id -> (symbol, kind, threshold)
+
+    def sync(self) -> None:
+        """Index active alerts created since the last sync, including other workers' alerts."""
+        with SessionLocal() as db:
+            rows = db.execute(
+                select(Alert.id, Alert.token, Alert.symbol, Alert.kind, Alert.threshold)
+                .where(Alert.active.is_(True), Alert.id > self._max_id)
+                .order_by(Alert.id)
+            ).all()
+        with self._lock:
+            for row in rows:
+                if row[0] not in self._rules:
+                    self._index(*row)
+                self._max_id = max(self._max_id, row[0])
+            self._loaded = True
+            self._syncing = False
+            self._synced_at = time.monotonic()
+
+    def _index(self, alert_id: int, token: str, symbol: str, kind: str, threshold: float) -> None:
+        if kind == "weight_above":
+            self._weights.setdefault(symbol, {})[alert_id] = (token, threshold)
         else:
-            # Try GLOBAL_QUOTE first
+            book = {"price_above": self._above, "price_below": self._below, "pct_move": self._moves}[kind]
+            bisect.insort(book.setdefault(symbol, []), (threshold, alert_id))
+        self._rules[alert_id] = (symbol, kind, threshold)
+
+    def add(self, alert: Alert) -> None:
+        with self._lock:
+            if alert.id not in self._rules:
+                self._index(alert.id, alert.token, alert.symbol, alert.kind, alert.threshold)
+
+    def remove(self, alert_id: int) -> None:
+        with self._lock:
+            self._unindex(alert_id)
+
+    def _unindex(self, alert_id: int) -> None:
+        rule = self._rules.pop(alert_id, None)
+        if rule is None:
+            return
+        symbol, kind, threshold = rule
+        if kind == "weight_above":
+            self._weights.get(symbol, {}).pop(alert_id, None)
+            return
+        book = {"price_above": self._above, "price_below": self._below, "pct_move": self._moves}[kind][symbol]
+        i = bisect.bisect_left(book, (threshold, alert_id))
+        if i < len(book) and book[i] == (threshold, alert_id):
+            del book[i]
+
+    def match(self, symbol: str, price: float, prev_close: Optional[float] = None) -> List[int]:
+        """Ids of the price/move rules ``price`` crosses; they are removed from the index."""
+        with self._lock:
+            above = self._above.get(symbol, [])
+            fired = [i for _, i in above[: bisect.bisect_right(above, (price, float("inf")))]]
+            below = self._below.get(symbol, [])
+            fired += [i for _, i in below[bisect.bisect_left(below, (price, -1)) :]]
+            moves = self._moves.get(symbol, [])
+            if moves and prev_close:
+                move = abs(price / prev_close - 1.0) * 100.0
+                fired += [i for _, i in moves[: bisect.bisect_right(moves, (move, float("inf")))]]
+            for alert_id in fired:
+                self._unindex(alert_id)
+        return fired
+
+    def on_quote(self, symbol: str, quote: FetchedQuote) -> None:
+        """Quote listener; may run on the event loop, so it only touches the in-memory index.
+
+        Anything needing the database (the first load, periodic syncs, weight
+        checks and recording) goes to the fetch pool.
+        """
+        with self._lock:
+            loaded = self._loaded
+            sync_due = loaded and not self._syncing and time.monotonic() - self._synced_at >= self.sync_seconds
+            if sync_due:
+                self._syncing = True
+        if not loaded:
+            self.client._pool.submit(self._evaluate, symbol, quote, True)
+            return
+        if sync_due:
+            self.client._pool.submit(self.sync)
+        self._evaluate(symbol, quote)
+
+    def _evaluate(self, symbol: str, quote: FetchedQuote, sync: bool = False) -> None:
+        if sync:
+            self.sync()
+        fired = self.match(symbol, quote.price, quote.prev_close)
+        with self._lock:
+            has_weights = bool(self._weights.get(symbol))
+        if fired:
+            self.client._pool.submit(self._record, fired, quote.price)
+        if has_weights:
+            self.client._pool.submit(self._check_weights, symbol, quote.price)
+
+    def _check_weights(self, symbol: str, price: float) -> None:
+        with self._lock:
+            candidates = dict(self._weights.get(symbol, {}))
+        tokens = {token for token, _ in candidates.values()}
+        with SessionLocal() as db:
+            rows = db.execute(
+                select(DBPosition.token, DBPosition.symbol, DBPosition.qty, Quote.price)
+                .outerjoin(Quote, Quote.symbol == DBPosition.symbol)
+                .where(DBPosition.token.in_(tokens))
+            ).all()
+        totals: Dict[str, float] = {}
+        held: Dict[str, float] = {}
+        unpriced: Set[str] = set()
+        for token, sym, qty, quote_price in rows:
+            if sym == symbol:
+                quote_price = price
+            elif quote_price is None:
+                entry = self.client.memory.peek(sym)  # fetched but not flushed yet
+                if entry is None:
+                    unpriced.add(token)  # a weight against a partial total would be overstated
+                    continue
+                quote_price = entry.price
+            value = qty * quote_price
+            totals[token] = totals.get(token, 0.0) + value
+            if sym == symbol:
+                held[token] = held.get(token, 0.0) + value
+        fired = []
+        for alert_id, (token, threshold) in candidates.items():
+            if token in unpriced or not totals.get(token):
+                continue
+            if 100.0 * held.get(token, 0.0) / totals[token] >= threshold:
+                fired.append(alert_id)
+        if fired:
+            with self._lock:
+                for alert_id in fired:
+                    self._unindex(alert_id)
+            self._record(fired, price)
+
+    def _record(self, alert_ids: List[int], price: float) -> None:
+        with SessionLocal() as db:
+            # rules deleted or fired by another worker are no longer active and stay untouched
+            result = db.execute(
+                update(Alert)
+                .where(Alert.id.in_(alert_ids), Alert.active.is_(True))
+                .values(active=False, triggered_at=datetime.utcnow(), triggered_price=price)
+            )
+            db.commit()
+        if result.rowcount:
+            logger.info("alerts triggered: %s", alert_ids)
+
+
+alert_engine = AlertEngine(alpha_client)
+alpha_client.add_listener(alert_engine.on_quote)
+
+
+# ----- Background Quote Refresher -----
+
+
+class QuoteRefresher:
+    """Refreshes held symbols shortly before their cached quote expires.
+
+    Each cycle picks symbols expiring within ``lead_seconds``, most widely held
+    first, and stops once the client's token bucket is empty; that bucket is
+    shared with request-path fetches so the upstream quota is never exceeded.
+    """
+
+    def __init__(
+        self,
+        client: AlphaVantageClient,
+        lead_seconds: int = PRICE_REFRESH_LEAD_SECONDS,
+        interval_seconds: int = PRICE_REFRESH_INTERVAL_SECONDS,
+    ):
+        self.client = client
+        self.lead = timedelta(seconds=lead_seconds)
+        self.interval = interval_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def due_symbols(self, db: Session, now: Optional[datetime] = None) -> List[str]:
+        """Held symbols expiring within the lead window, most-held then soonest first."""
+        now = now or datetime.utcnow()
+        ttl = timedelta(seconds=PRICE_CACHE_TTL_SECONDS)
+        rows = db.execute(
+            select(DBPosition.symbol, func.count(func.distinct(DBPosition.token)), Quote.fetched_at)
+            .outerjoin(Quote, Quote.symbol == DBPosition.symbol)
+            .group_by(DBPosition.symbol, Quote.fetched_at)
+        )
+        due = []
+        for symbol, holders, fetched_at in rows:
+            expires_at = fetched_at + ttl if fetched_at else now
+            if expires_at - now <= self.lead:
+                due.append((-holders, expires_at, symbol))
+        due.sort()
+        return [symbol for _, _, symbol in due]
+
+    def run_once(self) -> List[str]:
+        """Refresh as many due symbols as the rate limiter allows right now."""
+        with SessionLocal() as db:
+            due = self.due_symbols(db)
+        refreshed = []
+        for symbol in due:
+            if self._stop.is_set() or self.client.bucket.available() < 1 or self.client.breaker.state == "open":
+                break
+            self.client.refresh(symbol)
+            refreshed.append(symbol)
+        return refreshed
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
             try:
-                params = {"function": "GLOBAL_QUOTE", "symbol": symbol, "apikey": self.api_key}
-                r = self._client.get(self.base_url, params=params)
-                r.raise_for_status()
-                data = r.json()
-                price_str = (
-                    data.get("Global Quote", {}).get("05. price")
-                    or data.get("Global Quote", {}).get("05. Price")
-                )
-                if price_str:
-                    price = float(price_str)
-                else:
-                    # Fallback: TIME_SERIES_DAILY last close
-                    params = {
-                        "function": "TIME_SERIES_DAILY",
-                        "symbol": symbol,
-                        "apikey": self.api_key,
-                        "outputsize": "compact",
-                    }
-                    r = self._client.get(self.base_url, params=params)
-                    r.raise_for_status()
-                    data = r.json()
-                    ts = data.get("Time Series (Daily)", {})
-                    if not ts:
-                        raise ValueError("No time series data returned")
-                    latest_day = sorted(ts.keys())[-1]
-                    price = float(ts[latest_day]["4. close"])  # close price
+                self.run_once()
             except Exception:
-                # keep service resilient under quota/network errors
-                price = float(q.price) if q else 100.0
-
-        # upsert cache
-        cached = db.get(Quote, symbol.upper())
-        if cached:
-            cached.price = price
-            cached.fetched_at = now
+                logger.exception("quote refresher cycle failed")
+            self._stop.wait(self.interval)
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="quote-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+quote_refresher = QuoteRefresher(alpha_client)
+
+
+# ----- Portfolio Valuation -----
+
+
+def _touch_portfolio(db: Session, token: str) -> None:
+    """Bump the positions version; call in the same transaction as any position write."""
+    db.execute(
+        update(Portfolio)
+        .where(Portfolio.token == token)
+        .values(version=func.coalesce(Portfolio.version, 0) + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _load_positions(token: str, db: Session) -> Tuple[List[PositionOut], Dict[str, Optional[Quote]]]:
+    """Load a portfolio's positions and their cached quotes in one joined query."""
+    rows = db.execute(
+        select(DBPosition, Quote)
+        .outerjoin(Quote, Quote.symbol == DBPosition.symbol)
+        .where(DBPosition.token == token)
+        .order_by(DBPosition.id)
+    ).all()
+    if not rows and db.get(Portfolio, token) is None:
+        raise HTTPException(status_code=404, detail="Portfolio not found")
+    positions = [
+        PositionOut(symbol=pos.symbol, name=pos.name, qty=pos.qty, avg_cost=pos.avg_cost) for pos, _ in rows
+    ]
+    return positions, {pos.symbol: q for pos, q in rows}
+
+
+def _summarize(
+    positions: List[PositionOut],
+    prices: Dict[str, float],
+    prev_closes: Optional[Dict[str, float]] = None,
+) -> PortfolioSummary:
+    """Fill in price, value and weight on each position and total them up.
+
+    The arithmetic is :class:`PortfolioSnapshot`'s, so the model routes and
+    the columnar ones report identical numbers.
+    """
+    snapshot = PortfolioSnapshot(
+        [p.symbol.upper() for p in positions],
+        [p.name for p in positions],
+        [p.qty for p in positions],
+        [p.avg_cost for p in positions],
+    ).apply_prices(prices, prev_closes or {})
+    market_value, total_value, weights = snapshot._valued()
+    for p, price, value, weight in zip(positions, snapshot.price.tolist(), market_value.tolist(), weights.tolist()):
+        p.price, p.market_value, p.weight = price, value, weight
+    return PortfolioSummary(**snapshot.totals(total_value), positions=positions)
+
+
+def value_positions(
+    positions: List[PositionOut],
+    db: Session,
+    quotes: Optional[Dict[str, Optional[QuoteRow]]] = None,
+) -> PortfolioSummary:
+    prices = alpha_client.get_prices([p.symbol for p in positions], db, quotes)
+    return _summarize(positions, prices, alpha_client.previous_closes(prices, quotes))
+
+
+def value_portfolio(token: str, db: Session) -> PortfolioSummary:
+    positions, quotes = _load_positions(token, db)
+    return value_positions(positions, db, quotes)
+
+
+async def avalue_portfolio(token: str, db: Union[Session, AsyncSession]) -> PortfolioSummary:
+    """Value a portfolio without blocking the event loop on SQL or upstream I/O."""
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(value_portfolio, token, db)
+    positions, quotes = await db.run_sync(lambda sync_db: _load_positions(token, sync_db))
+    prices = await alpha_client.aget_prices([p.symbol for p in positions], db, quotes)
+    return _summarize(positions, prices, alpha_client.previous_closes(prices, quotes))
+
+
+# ----- Conditional Portfolio Reads -----
+
+
+class PortfolioState(NamedTuple):
+    """Everything a rendered position list depends on, read in one query."""
+
+    version: int
+    positions: int
+    priced: int
+    newest_quote: Optional[datetime]
+    oldest_quote: Optional[datetime]
+    price_sum: Optional[float]
+    fetched_sum: Optional[int]  # sum of fetched_at epochs; order-independent, so any refresh moves it
+
+    def fresh(self, now: datetime) -> bool:
+        """True when rendering would not refresh any quote, so the render is safe to reuse."""
+        if self.priced < self.positions:
+            return False
+        return self.oldest_quote is None or now - self.oldest_quote < timedelta(seconds=PRICE_CACHE_TTL_SECONDS)
+
+    def etag(self, token: str) -> str:
+        raw = ":".join(map(str, (token, *self)))
+        return '"' + hashlib.blake2b(raw.encode("utf-8"), digest_size=12).hexdigest() + '"'
+
+
+def _portfolio_state_query(token: str):
+    # a position write bumps version or the count; a quote refresh, including one that is neither
+    # the newest nor the oldest, moves the price and fetched_at sums
+    return (
+        select(
+            func.coalesce(Portfolio.version, 0),
+            func.count(DBPosition.id),
+            func.count(Quote.symbol),
+            func.max(Quote.fetched_at),
+            func.min(Quote.fetched_at),
+            func.sum(Quote.price),
+            func.sum(extract("epoch", Quote.fetched_at)),
+        )
+        .select_from(Portfolio)
+        .outerjoin(DBPosition, DBPosition.token == Portfolio.token)
+        .outerjoin(Quote, Quote.symbol == DBPosition.symbol)
+        .where(Portfolio.token == token)
+        .group_by(Portfolio.token)
+    )
+
+
+async def portfolio_state(token: str, db: Union[Session, AsyncSession]) -> Optional[PortfolioState]:
+    """The portfolio's current version, or None if it does not exist."""
+    stmt = _portfolio_state_query(token)
+    if isinstance(db, AsyncSession):
+        row = (await db.execute(stmt)).first()
+    else:
+        row = await run_in_threadpool(lambda: db.execute(stmt).first())
+    return PortfolioState(*row) if row else None
+
+
+class RenderedCache:
+    """Thread-safe LRU of rendered response bodies, one per token, valid for a single ETag."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max(1, max_size)
+        self._data: "OrderedDict[str, Tuple[str, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str, etag: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._data.get(token)
+            if entry is None or entry[0] != etag:
+                self.misses += 1
+                return None
+            self._data.move_to_end(token)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, token: str, etag: str, body: bytes) -> None:
+        with self._lock:
+            self._data[token] = (etag, body)
+            self._data.move_to_end(token)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._data), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+positions_cache = RenderedCache(POSITIONS_RESPONSE_CACHE_SIZE)
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return "*" in candidates or etag in (c[2:] if c.startswith("W/") else c for c in candidates)
+
+
+async def conditional_positions(request: Request, token: str, db: Union[Session, AsyncSession]) -> Response:
+    """A portfolio's priced positions with a strong ETag.
+
+    While every held quote is fresh, ``If-None-Match`` gets a 304 and a
+    repeated poll is served from :data:`positions_cache`; either way the cost
+    is the one state query. The state is read before rendering, so a quote
+    refreshed mid-render can only make the cached body newer than its ETag.
+    """
+    state = await portfolio_state(token, db)
+    etag = state.etag(token) if state is not None and state.fresh(datetime.utcnow()) else None
+    headers = {"ETag": etag, "Cache-Control": "no-cache"} if etag else {}
+    if etag:
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        body = positions_cache.get(token, etag)
+        if body is not None:
+            return Response(body, media_type="application/json", headers=headers)
+
+    response = JSONResponse(jsonable_encoder((await avalue_portfolio(token, db)).positions), headers=headers)
+    if etag:
+        positions_cache.put(token, etag, response.body)
+    return response
+
+
+# ----- Columnar Portfolio Snapshots -----
+
+
+class SymbolTable:
+    """Interns symbols to small integer ids shared by every snapshot."""
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._symbols: List[str] = []
+        self._lock = threading.Lock()
+
+    def intern(self, symbol: str) -> int:
+        sid = self._ids.get(symbol)
+        if sid is None:
+            with self._lock:
+                sid = self._ids.get(symbol)
+                if sid is None:
+                    sid = self._ids[symbol] = len(self._symbols)
+                    self._symbols.append(symbol)
+        return sid
+
+    def symbols(self, ids: np.ndarray) -> List[str]:
+        table = self._symbols
+        return [table[i] for i in ids.tolist()]
+
+
+symbol_table = SymbolTable()
+
+
+class PortfolioSnapshot:
+    """A portfolio's holdings as parallel columns instead of one object per position.
+
+    Row ``i`` holds ``ids[i]`` (an interned symbol) with float64 ``qty``,
+    ``avg_cost``, ``price`` and ``prev_close`` (NaN when unknown); valuation
+    is a handful of array operations, and JSON is built from the columns.
+    """
+
+    __slots__ = ("ids", "names", "qty", "avg_cost", "price", "prev_close")
+
+    def __init__(self, symbols: List[str], names: List[Optional[str]], qty: List[float], avg_cost: List[float]):
+        self.ids = np.fromiter((symbol_table.intern(s) for s in symbols), dtype=np.int32, count=len(symbols))
+        self.names = names
+        self.qty = np.asarray(qty, dtype=np.float64)
+        self.avg_cost = np.asarray(avg_cost, dtype=np.float64)
+        self.price = np.full(len(symbols), np.nan)
+        self.prev_close = np.full(len(symbols), np.nan)
+
+    @property
+    def symbols(self) -> List[str]:
+        return symbol_table.symbols(self.ids)
+
+    def apply_prices(self, prices: Dict[str, float], prev_closes: Dict[str, float]) -> "PortfolioSnapshot":
+        symbols = self.symbols
+        self.price = np.fromiter((prices[s] for s in symbols), dtype=np.float64, count=len(symbols))
+        self.prev_close = np.fromiter(
+            (prev_closes.get(s, np.nan) for s in symbols), dtype=np.float64, count=len(symbols)
+        )
+        return self
+
+    def _valued(self) -> Tuple[np.ndarray, float, np.ndarray]:
+        market_value = self.qty * self.price
+        total_value = float(market_value.sum())
+        weights = np.round(100.0 * market_value / (total_value or 1.0), 2)
+        return market_value, total_value, weights
+
+    def totals(self, total_value: Optional[float] = None) -> dict:
+        """Value, cost, PnL and day change; the ``PortfolioSummary`` fields except ``positions``."""
+        if total_value is None:
+            total_value = float(np.dot(self.qty, self.price))
+        total_cost = float(np.dot(self.qty, self.avg_cost))
+        known = ~np.isnan(self.prev_close)
+        day_change = float(np.dot(self.qty[known], self.price[known] - self.prev_close[known]))
+        baseline = float(np.dot(self.qty[known], self.prev_close[known]))
+        pnl = total_value - total_cost
+        return {
+            "total_cost": round(total_cost, 2),
+            "total_value": round(total_value, 2),
+            "pnl": round(pnl, 2),
+            "pnl_pct": round(pnl / total_cost * 100.0, 2) if total_cost else 0.0,
+            "day_change": round(day_change, 2),
+            "day_change_pct": round(day_change / baseline * 100.0, 2) if baseline else 0.0,
+        }
+
+    def summary(self) -> dict:
+        """The ``PortfolioSummary`` JSON shape, computed column-wise."""
+        market_value, total_value, weights = self._valued()
+        positions = [
+            {
+                "symbol": symbol,
+                "qty": qty,
+                "avg_cost": avg_cost,
+                "name": name,
+                "price": price,
+                "market_value": value,
+                "weight": weight,
+            }
+            for symbol, qty, avg_cost, name, price, value, weight in zip(
+                self.symbols,
+                self.qty.tolist(),
+                self.avg_cost.tolist(),
+                self.names,
+                self.price.tolist(),
+                market_value.tolist(),
+                weights.tolist(),
+            )
+        ]
+        return {**self.totals(total_value), "positions": positions}
+
+    def allocation(self) -> List[dict]:
+        _, _, weights = self._valued()
+        return [{"name": symbol, "value": weight} for symbol, weight in zip(self.symbols, weights.tolist())]
+
+
+def _load_snapshot(token: str, db: Session) -> Tuple[PortfolioSnapshot, Dict[str, Optional[QuoteRow]]]:
+    """Like :func:`_load_positions`, but selects plain columns so no ORM or Pydantic objects are built."""
+    rows = db.execute(
+        select(
+            DBPosition.symbol,
+            DBPosition.name,
+            DBPosition.qty,
+            DBPosition.avg_cost,
+            Quote.price,
+            Quote.fetched_at,
+            Quote.prev_close,
+        )
+        .outerjoin(Quote, Quote.symbol == DBPosition.symbol)
+        .where(DBPosition.token == token)
+        .order_by(DBPosition.id)
+    ).all()
+    if not rows and db.get(Portfolio, token) is None:
+        raise HTTPException(status_code=404, detail="Portfolio not found")
+    symbols, names, qty, avg_cost, prices, fetched, prev = zip(*rows) if rows else ((),) * 7
+    quotes = {
+        sym: CachedQuote(price, at, close) if at is not None else None
+        for sym, price, at, close in zip(symbols, prices, fetched, prev)
+    }
+    return PortfolioSnapshot(list(symbols), list(names), list(qty), list(avg_cost)), quotes
+
+
+def snapshot_portfolio(token: str, db: Session) -> PortfolioSnapshot:
+    snapshot, quotes = _load_snapshot(token, db)
+    prices = alpha_client.get_prices(snapshot.symbols, db, quotes)
+    return snapshot.apply_prices(prices, alpha_client.previous_closes(prices, quotes))
+
+
+async def asnapshot_portfolio(token: str, db: Union[Session, AsyncSession]) -> PortfolioSnapshot:
+    """Event-loop friendly :func:`snapshot_portfolio`, mirroring :func:`avalue_portfolio`."""
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(snapshot_portfolio, token, db)
+    snapshot, quotes = await db.run_sync(lambda sync_db: _load_snapshot(token, sync_db))
+    prices = await alpha_client.aget_prices(snapshot.symbols, db, quotes)
+    return snapshot.apply_prices(prices, alpha_client.previous_closes(prices, quotes))
+
+
+def _json_response(content) -> Response:
+    # bypasses response_model validation, which would rebuild the models the snapshot avoids
+    return Response(json.dumps(content, separators=(",", ":")), media_type="application/json")
+
+
+# ----- Price History and Timelines -----
+
+
+def store_price_bars(bars: List[dict]) -> None:
+    """Upsert daily bars on (symbol, day) in one statement."""
+    if not bars:
+        return
+    with SessionLocal() as db:
+        insert = _dialect_insert(db)
+        if insert is not None:
+            stmt = insert(PriceBar)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[PriceBar.symbol, PriceBar.day],
+                set_={c: stmt.excluded[c] for c in ("open", "high", "low", "close", "volume")},
+            )
+            db.execute(stmt, bars)
         else:
-            db.add(Quote(symbol=symbol.upper(), price=price, fetched_at=now))
+            for bar in bars:
+                db.merge(PriceBar(**bar))
         db.commit()
-        return price
 
 
-alpha_client = AlphaVantageClient(ALPHAVANTAGE_API_KEY)
+def portfolio_value_series(
+    holdings: Dict[str, float],
+    bars: Iterable[Tuple[str, date, float]],
+) -> Tuple[List[date], np.ndarray]:
+    """Daily portfolio value as one (days x symbols) @ (symbols,) matrix product.
+
+    ``bars`` are (symbol, day, close) rows. Gaps such as holidays or a symbol
+    missing a day carry the previous close forward; days before a symbol's
+    first bar count it at zero.
+    """
+    symbols = list(holdings)
+    col = {sym: i for i, sym in enumerate(symbols)}
+    rows = [(col[sym], day, close) for sym, day, close in bars if sym in col]
+    if not rows:
+        return [], np.zeros(0)
+
+    sym_idx, days, closes = zip(*rows)
+    axis, day_idx = np.unique(np.array(days, dtype="datetime64[D]"), return_inverse=True)
+    prices = np.full((len(axis), len(symbols)), np.nan)
+    prices[day_idx, np.array(sym_idx)] = closes
+
+    # forward-fill each column: index of the last observed row at or above each row
+    observed = np.where(~np.isnan(prices), np.arange(len(axis))[:, None], 0)
+    np.maximum.accumulate(observed, axis=0, out=observed)
+    prices = np.nan_to_num(prices[observed, np.arange(len(symbols))])
+
+    qty = np.array([holdings[sym] for sym in symbols], dtype=np.float64)
+    return axis.astype(date).tolist(), prices @ qty
+
+
+def portfolio_timeline(token: str, db: Session, days: int = TIMELINE_DEFAULT_DAYS) -> List[dict]:
+    """Value the current holdings over the last ``days`` days of stored bars.
+
+    Symbols with no bars in the window (or, past Alpha Vantage's ~100-bar
+    compact response, bars starting well after it) are queued for a
+    background download; the series reflects whatever is stored right now.
+    """
+    holdings: Dict[str, float] = {}
+    for symbol, qty in db.execute(select(DBPosition.symbol, DBPosition.qty).where(DBPosition.token == token)):
+        holdings[symbol] = holdings.get(symbol, 0.0) + qty
+    if not holdings:
+        return []
+
+    start = date.today() - timedelta(days=days)
+    query = select(PriceBar.symbol, PriceBar.day, PriceBar.close).where(
+        PriceBar.symbol.in_(list(holdings)), PriceBar.day >= start
+    )
+    bars = db.execute(query).all()
+    first_day: Dict[str, date] = {}
+    for symbol, day, _ in bars:
+        if symbol not in first_day or day < first_day[symbol]:
+            first_day[symbol] = day
+    full = days > 100
+    missing = [
+        sym for sym in holdings if sym not in first_day or (full and first_day[sym] > start + timedelta(days=7))
+    ]
+    if missing:
+        alpha_client.request_history(missing, full=full)
+
+    axis, values = portfolio_value_series(holdings, bars)
+    return [{"date": d.isoformat(), "value": round(float(v), 2)} for d, v in zip(axis, values)]
+
+
+# ----- Exposure Index -----
+
+
+class ExposureIndex:
+    """Inverted index of holdings across every portfolio: symbol -> {token: qty}.
+
+    Position writes update it in place, and per-symbol totals are kept
+    alongside, so "how much of X do we hold, and where" never scans
+    portfolios. Like :class:`AlertEngine` it is per process: each worker
+    applies its own writes immediately and reloads from the positions table
+    every ``EXPOSURE_SYNC_SECONDS`` to pick up the others'.
+    """
+
+    def __init__(self, client: AlphaVantageClient, sync_seconds: int = EXPOSURE_SYNC_SECONDS):
+        self.client = client
+        self.sync_seconds = sync_seconds
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._syncing = False
+        self._synced_at = 0.0
+        self._holders: Dict[str, Dict[str, float]] = {}
+        self._totals: Dict[str, float] = {}
+        self._by_token: Dict[str, Dict[str, float]] = {}
+        # writes applied while a reload is reading the table; replayed on top of it
+        self._journal: Optional[List[Tuple[str, Dict[str, float], bool]]] = None
+
+    def load(self) -> None:
+        """Rebuild the index from the positions table in one pass."""
+        with self._lock:
+            self._journal = []
+        try:
+            holders: Dict[str, Dict[str, float]] = {}
+            by_token: Dict[str, Dict[str, float]] = {}
+            with SessionLocal() as db:
+                for token, symbol, qty in db.execute(select(DBPosition.token, DBPosition.symbol, DBPosition.qty)):
+                    holders.setdefault(symbol, {})[token] = qty
+                    by_token.setdefault(token, {})[symbol] = qty
+            with self._lock:
+                self._holders = holders
+                self._by_token = by_token
+                self._totals = {symbol: sum(held.values()) for symbol, held in holders.items()}
+                for token, positions, replace in self._journal:
+                    self._apply(token, positions, replace)
+                self._loaded = True
+                self._synced_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._journal = None
+                self._syncing = False
+
+    def apply(self, token: str, positions: Dict[str, float], replace: bool = False) -> None:
+        """Record committed quantities for ``token``; ``replace`` drops symbols not listed."""
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((token, dict(positions), replace))
+            self._apply(token, positions, replace)
+
+    def _apply(self, token: str, positions: Dict[str, float], replace: bool) -> None:
+        held = self._by_token.setdefault(token, {})
+        if replace:
+            for symbol in [s for s in held if s not in positions]:
+                self._totals[symbol] -= held.pop(symbol)
+                del self._holders[symbol][token]
+                if not self._holders[symbol]:
+                    del self._holders[symbol], self._totals[symbol]
+        for symbol, qty in positions.items():
+            previous = held.get(symbol, 0.0)
+            held[symbol] = qty
+            self._holders.setdefault(symbol, {})[token] = qty
+            self._totals[symbol] = self._totals.get(symbol, 0.0) + qty - previous
+
+    def _ensure_fresh(self) -> None:
+        with self._lock:
+            loaded = self._loaded
+            sync_due = loaded and not self._syncing and time.monotonic() - self._synced_at >= self.sync_seconds
+            if sync_due:
+                self._syncing = True
+        if not loaded:
+            self.load()
+        elif sync_due:
+            self.client._pool.submit(self.load)
+
+    def exposure(self, symbol: str) -> Tuple[int, float]:
+        """(number of holding portfolios, total quantity) for ``symbol``."""
+        self._ensure_fresh()
+        with self._lock:
+            return len(self._holders.get(symbol, ())), self._totals.get(symbol, 0.0)
+
+    def holders(self, symbol: str) -> Dict[str, float]:
+        self._ensure_fresh()
+        with self._lock:
+            return dict(self._holders.get(symbol, {}))
+
+    def totals(self) -> Dict[str, Tuple[int, float]]:
+        """(holders, total qty) for every held symbol; sized by distinct symbols, not portfolios."""
+        self._ensure_fresh()
+        with self._lock:
+            return {symbol: (len(self._holders[symbol]), total) for symbol, total in self._totals.items()}
+
+
+exposure_index = ExposureIndex(alpha_client)
+
+
+def _latest_prices(symbols: Iterable[str], db: Session) -> Dict[str, float]:
+    """Last known price per symbol from the hot cache, then the quotes table; never calls upstream."""
+    prices: Dict[str, float] = {}
+    missing: List[str] = []
+    for symbol in symbols:
+        entry = alpha_client.memory.peek(symbol)
+        if entry is not None:
+            prices[symbol] = entry.price
+        else:
+            missing.append(symbol)
+    for start in range(0, len(missing), IMPORT_BATCH_SIZE):
+        chunk = missing[start : start + IMPORT_BATCH_SIZE]
+        rows = db.execute(select(Quote.symbol, Quote.price).where(Quote.symbol.in_(chunk)))
+        prices.update((symbol, price) for symbol, price in rows)
+    return prices
+
+
+def _require_admin(x_admin_token: Optional[str] = Header(default=None)) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Cross-portfolio endpoints are disabled; set ADMIN_TOKEN")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid x-admin-token header")
 
 
 # ----- Routes -----
 
 
 @app.get("/health")
-def health_check():
+async def health_check():
     return {"status": "ok", "time": int(time.time())}
 
 
@@ -231,36 +2740,17 @@ def create_portfolio(positions: Optional[List[PositionIn]] = None, db: Session =
                 )
             )
     db.commit()
+    exposure_index.apply(token, {p.symbol.upper(): p.qty for p in positions or []})
     return CreatePortfolioResponse(token=token)
 
 
 @app.get("/portfolio/{token}", response_model=List[PositionOut])
-def get_portfolio_for_token(token: str, db: Session = Depends(get_db)):
-    portfolio = db.get(Portfolio, token)
-    if not portfolio:
-        raise HTTPException(status_code=404, detail="Portfolio not found")
-    # enrich with prices and weights
-    enriched: List[PositionOut] = []
-    values = []
-    for pos in portfolio.positions:
-        price = alpha_client.get_price(pos.symbol, db)
-        mv = price * pos.qty
-        values.append(mv)
-        enriched.append(
-            PositionOut(
-                symbol=pos.symbol,
-                name=pos.name,
-                qty=pos.qty,
-                avg_cost=pos.avg_cost,
-                price=price,
-                market_value=mv,
-            )
-        )
-
-    total_value = sum(values) or 1.0
-    for e in enriched:
-        e.weight = round(100.0 * (e.market_value or 0.0) / total_value, 2)
-    return enriched
+async def get_portfolio_for_token(
+    token: str,
+    request: Request,
+    db: Union[Session, AsyncSession] = Depends(get_read_db),
+):
+    return await conditional_positions(request, token, db)
 
 
 @app.put("/portfolio/{token}", response_model=List[PositionOut])
@@ -273,6 +2763,7 @@ def replace_portfolio_positions(token: str, positions: List[PositionIn], db: Ses
 
     # Clear existing
     db.query(DBPosition).filter(DBPosition.token == token).delete()
+    written: List[PositionOut] = []
     for p in positions:
         db.add(
             DBPosition(
@@ -283,60 +2774,864 @@ def replace_portfolio_positions(token: str, positions: List[PositionIn], db: Ses
                 avg_cost=p.avg_cost,
             )
         )
+        written.append(PositionOut(symbol=p.symbol.upper(), name=p.name, qty=p.qty, avg_cost=p.avg_cost))
+    _touch_portfolio(db, token)
     db.commit()
-    return get_portfolio_for_token(token, db)
+    exposure_index.apply(token, {p.symbol: p.qty for p in written}, replace=True)
+    quote_hub.portfolio_changed(token)
+    # value what was just written instead of reloading it
+    return value_positions(written, db).positions
+
+
+@app.get("/quote/cache/stats")
+def quote_cache_stats():
+    return alpha_client.memory.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus scrape target; empty apart from cache gauges unless METRICS_ENABLED."""
+    cache = alpha_client.memory.stats()
+    rendered = positions_cache.stats()
+    snapshot = {
+        "quote_memory_cache_size": ("gauge", cache["size"]),
+        "upstream_circuit_open": ("gauge", int(alpha_client.breaker.state != "closed")),
+        "quote_write_buffer_depth": ("gauge", quote_writer.pending()),
+        "quote_write_flushes_total": ("counter", quote_writer.flushes),
+        "quote_write_rows_total": ("counter", quote_writer.rows_written),
+        "quote_write_last_flush_seconds": ("gauge", quote_writer.last_flush_seconds),
+        "quote_memory_cache_hits_total": ("counter", cache["hits"]),
+        "quote_memory_cache_misses_total": ("counter", cache["misses"]),
+        "quote_memory_cache_evictions_total": ("counter", cache["evictions"]),
+        "positions_response_cache_hits_total": ("counter", rendered["hits"]),
+        "positions_response_cache_misses_total": ("counter", rendered["misses"]),
+    }
+    return PlainTextResponse(metrics_registry.render(snapshot), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/quote/{symbol}")
-def get_quote(symbol: str, db: Session = Depends(get_db)):
-    price = alpha_client.get_price(symbol, db)
+async def get_quote(symbol: str, db: Union[Session, AsyncSession] = Depends(get_read_db)):
+    if isinstance(db, AsyncSession):
+        price = (await alpha_client.aget_prices([symbol], db))[symbol.upper()]
+    else:
+        price = await run_in_threadpool(alpha_client.get_price, symbol, db)
     return {"symbol": symbol.upper(), "price": price}
 
 
 @app.get("/portfolio/{token}/summary", response_model=PortfolioSummary)
-def portfolio_summary(token: str, db: Session = Depends(get_db)):
-    portfolio = db.get(Portfolio, token)
-    if not portfolio:
-        raise HTTPException(status_code=404, detail="Portfolio not found")
+async def portfolio_summary(token: str, db: Union[Session, AsyncSession] = Depends(get_read_db)):
+    return _json_response((await asnapshot_portfolio(token, db)).summary())
+
+
+# ----- Bulk Import / Export -----
+
+
+_MAX_REPORTED_ERRORS = 50
+
+
+def _detect_format(fmt: Optional[str], content_type: Optional[str]) -> str:
+    fmt = (fmt or "").lower()
+    if not fmt:
+        fmt = "ndjson" if "json" in (content_type or "") else "csv"
+    if fmt not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    return fmt
+
+
+async def _iter_lines(request: Request) -> AsyncIterator[bytes]:
+    """Yield raw lines from the request body as it streams in; callers decode per line."""
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+async def _iter_records(request: Request, fmt: str) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """Parse (line number, raw record, parse error) triples; CSV fields may not contain newlines."""
+    header: Optional[List[str]] = None
+    lineno = 0
+    async for raw in _iter_lines(request):
+        lineno += 1
+        try:
+            line = raw.decode("utf-8-sig").rstrip("\r")
+        except UnicodeDecodeError as exc:
+            yield lineno, None, f"invalid UTF-8: {exc}"  # e.g. a Latin-1 export; one bad row, not a failed import
+            continue
+        if not line.strip():
+            continue
+        if fmt == "ndjson":
+            try:
+                record = json.loads(line)
+            except ValueError as exc:
+                yield lineno, None, f"invalid JSON: {exc}"
+                continue
+            if isinstance(record, dict):
+                yield lineno, record, None
+            else:
+                yield lineno, None, "expected a JSON object"
+            continue
+        values = next(csv.reader([line]))
+        if header is None:
+            header = [h.strip() for h in values]
+            continue
+        yield lineno, {k: v for k, v in zip(header, values) if v != ""}, None
+
+
+def _upsert_positions(db: Session, token: str, rows: List[dict]) -> None:
+    """Insert or update one batch on ``uq_token_symbol`` with a single statement."""
+    insert = _dialect_insert(db)
+    if insert is not None:
+        stmt = insert(DBPosition)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[DBPosition.token, DBPosition.symbol],
+            set_={
+                "qty": stmt.excluded.qty,
+                "avg_cost": stmt.excluded.avg_cost,
+                "name": func.coalesce(stmt.excluded.name, DBPosition.name),
+            },
+        )
+    else:
+        db.query(DBPosition).filter(
+            DBPosition.token == token, DBPosition.symbol.in_([r["symbol"] for r in rows])
+        ).delete(synchronize_session=False)
+        stmt = DBPosition.__table__.insert()
+    db.execute(stmt, rows)
+
+
+@app.post("/portfolio/{token}/import", response_model=ImportResult)
+async def import_positions(
+    token: str,
+    request: Request,
+    format: Optional[str] = Query(default=None, description="csv or ndjson; defaults from Content-Type"),
+    replace: bool = Query(default=False, description="Drop existing positions first"),
+    db: Session = Depends(get_db),
+):
+    """Stream a CSV (header row) or NDJSON upload of positions into a portfolio.
+
+    Rows are validated as they arrive and bad rows are skipped and reported.
+    Valid rows are buffered per symbol (the last row for a symbol wins) only
+    until ``IMPORT_BATCH_SIZE`` are waiting; each full batch is upserted and
+    committed in its own short transaction, so memory stays bounded and a slow
+    upload never holds the database writer lock between batches. With
+    ``replace``, existing positions are dropped in the first batch's
+    transaction.
+    """
+    fmt = _detect_format(format, request.headers.get("content-type"))
+
+    rejected = 0
+    imported = 0
+    first = True
+    errors: List[dict] = []
+    rows: Dict[str, dict] = {}  # keyed by symbol so a batch never conflicts with itself
+
+    def _write(batch: List[dict], clear: bool) -> None:
+        if db.get(Portfolio, token) is None:
+            db.add(Portfolio(token=token))
+            db.flush()
+        if clear:
+            db.query(DBPosition).filter(DBPosition.token == token).delete()
+        if batch:
+            _upsert_positions(db, token, batch)
+        _touch_portfolio(db, token)
+        db.commit()
 
-    positions_out = get_portfolio_for_token(token, db)
-    total_cost = sum((p.qty * p.avg_cost) for p in portfolio.positions)
-    total_value = sum((p.market_value or 0.0) for p in positions_out)
-    pnl = total_value - total_cost
-    pnl_pct = (pnl / total_cost * 100.0) if total_cost else 0.0
-
-    return PortfolioSummary(
-        total_cost=round(total_cost, 2),
-        total_value=round(total_value, 2),
-        pnl=round(pnl, 2),
-        pnl_pct=round(pnl_pct, 2),
-        positions=positions_out,
+    async def _flush() -> None:
+        nonlocal imported, first, rows
+        batch, rows = list(rows.values()), {}
+        await run_in_threadpool(_write, batch, replace and first)
+        exposure_index.apply(token, {row["symbol"]: row["qty"] for row in batch}, replace=replace and first)
+        imported += len(batch)
+        first = False
+
+    async for lineno, record, error in _iter_records(request, fmt):
+        try:
+            if error is not None:
+                raise ValueError(error)
+            if "avgCost" in record and "avg_cost" not in record:
+                record["avg_cost"] = record.pop("avgCost")
+            p = PositionIn(**record)
+        except (ValidationError, ValueError, TypeError) as exc:
+            rejected += 1
+            if len(errors) < _MAX_REPORTED_ERRORS:
+                errors.append({"line": lineno, "error": str(exc).splitlines()[0]})
+            continue
+        symbol = p.symbol.strip().upper()
+        rows[symbol] = {"token": token, "symbol": symbol, "name": p.name, "qty": p.qty, "avg_cost": p.avg_cost}
+        if len(rows) >= IMPORT_BATCH_SIZE:
+            await _flush()
+
+    if rows or first:
+        await _flush()  # the remainder, or an empty import that still creates (or clears) the portfolio
+    quote_hub.portfolio_changed(token)
+    return ImportResult(token=token, imported=imported, rejected=rejected, errors=errors)
+
+
+def _export_rows(token: str, fmt: str) -> Iterator[str]:
+    # owns its session: route dependencies are closed before the body streams
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(DBPosition.symbol, DBPosition.name, DBPosition.qty, DBPosition.avg_cost)
+            .where(DBPosition.token == token)
+            .order_by(DBPosition.id)
+            .execution_options(yield_per=IMPORT_BATCH_SIZE)
+        )
+        if fmt == "ndjson":
+            for symbol, name, qty, avg_cost in rows:
+                yield json.dumps({"symbol": symbol, "name": name, "qty": qty, "avg_cost": avg_cost}) + "\n"
+            return
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(["symbol", "name", "qty", "avg_cost"])
+        for symbol, name, qty, avg_cost in rows:
+            writer.writerow([symbol, name or "", qty, avg_cost])
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+        yield out.getvalue()
+
+
+@app.get("/portfolio/{token}/export")
+def export_positions(
+    token: str,
+    format: str = Query(default="csv", description="csv or ndjson"),
+    db: Session = Depends(get_db),
+):
+    fmt = _detect_format(format, None)
+    if db.get(Portfolio, token) is None:
+        raise HTTPException(status_code=404, detail="Portfolio not found")
+    media_type = "application/x-ndjson" if fmt == "ndjson" else "text/csv"
+    return StreamingResponse(
+        _export_rows(token, fmt),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="portfolio.{fmt}"'},
     )
 
 
 # ----- Sentiment (lightweight stub; spaCy can be integrated later) -----
 
 
-try:
-    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+_vader = None
+_vader_loaded = False
+_vader_lock = threading.Lock()
+
+
+def get_vader():
+    """The shared VADER analyzer, loaded on first use; None if vaderSentiment is unavailable."""
+    global _vader, _vader_loaded
+    if not _vader_loaded:
+        with _vader_lock:
+            if not _vader_loaded:
+                try:
+                    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+
+                    _vader = SentimentIntensityAnalyzer()
+                except Exception:  # pragma: no cover
+                    logger.warning("VADER unavailable; sentiment scores will be neutral", exc_info=True)
+                _vader_loaded = True
+    return _vader
+
 
-    _vader = SentimentIntensityAnalyzer()
-except Exception:  # pragma: no cover
-    _vader = None
+_NO_VADER = {"compound": 0.0, "pos": 0.0, "neu": 1.0, "neg": 0.0, "note": "VADER not installed"}
 
 
 class SentimentRequest(BaseModel):
     text: str
 
 
+class SentimentBatchRequest(BaseModel):
+    texts: List[str]
+
+
+def _score_texts(texts: List[str]) -> List[Dict[str, float]]:
+    """Score a chunk of texts; runs in a worker process for large batches."""
+    vader = get_vader()
+    if vader is None:
+        return [dict(_NO_VADER) for _ in texts]
+    return [vader.polarity_scores(text) for text in texts]
+
+
+class SentimentCache:
+    """Thread-safe LRU of VADER scores keyed by a digest of the text."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max(1, max_size)
+        self._data: "OrderedDict[bytes, Dict[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def get(self, key: bytes) -> Optional[Dict[str, float]]:
+        with self._lock:
+            scores = self._data.get(key)
+            if scores is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return scores
+
+    def put(self, key: bytes, scores: Dict[str, float]) -> None:
+        with self._lock:
+            self._data[key] = scores
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._data), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+sentiment_cache = SentimentCache(SENTIMENT_CACHE_SIZE)
+_sentiment_pool: Optional[ProcessPoolExecutor] = None
+_sentiment_pool_lock = threading.Lock()
+
+
+def _sentiment_executor() -> Optional[ProcessPoolExecutor]:
+    """The scoring process pool, started on first use; None when SENTIMENT_WORKERS is 0."""
+    global _sentiment_pool
+    if SENTIMENT_WORKERS <= 0:
+        return None
+    with _sentiment_pool_lock:
+        if _sentiment_pool is None:
+            # spawn, not fork: this process already runs threads (fetch pool, refresher)
+            _sentiment_pool = ProcessPoolExecutor(
+                max_workers=SENTIMENT_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _sentiment_pool
+
+
+def _shutdown_sentiment_pool() -> None:
+    global _sentiment_pool
+    with _sentiment_pool_lock:
+        if _sentiment_pool is not None:
+            _sentiment_pool.shutdown(cancel_futures=True)
+            _sentiment_pool = None
+
+
+async def score_texts(texts: List[str]) -> Tuple[List[Dict[str, float]], Dict[str, float]]:
+    """Score ``texts`` in order, returning the scores and the batch's timing.
+
+    Cached and repeated texts are scored once. Misses beyond one chunk are
+    split across the process pool since VADER is pure-Python and CPU-bound;
+    smaller batches run on a thread, where pickling would cost more than it saves.
+    """
+    started = time.perf_counter()
+    keys = [SentimentCache.key(text) for text in texts]
+    results = [sentiment_cache.get(key) for key in keys]
+    pending: Dict[bytes, str] = {}
+    for key, text, scores in zip(keys, texts, results):
+        if scores is None:
+            pending.setdefault(key, text)
+    lookup_ms = (time.perf_counter() - started) * 1000
+
+    todo = list(pending.items())
+    chunks = [todo[i : i + SENTIMENT_CHUNK_SIZE] for i in range(0, len(todo), max(1, SENTIMENT_CHUNK_SIZE))]
+    executor = _sentiment_executor() if len(chunks) > 1 else None
+    if executor is None:
+        scored = await run_in_threadpool(_score_texts, [text for _, text in todo]) if todo else []
+    else:
+        loop = asyncio.get_running_loop()
+        parts = await asyncio.gather(
+            *(loop.run_in_executor(executor, _score_texts, [text for _, text in chunk]) for chunk in chunks)
+        )
+        scored = [scores for part in parts for scores in part]
+    fresh = {}
+    for (key, _), scores in zip(todo, scored):
+        sentiment_cache.put(key, scores)
+        fresh[key] = scores
+
+    timing = {
+        "texts": len(texts),
+        "cached": sum(scores is not None for scores in results),
+        "scored": len(todo),
+        "workers": len(chunks) if executor else 0,
+        "lookup_ms": round(lookup_ms, 3),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+    }
+    return [scores if scores is not None else fresh[key] for scores, key in zip(results, keys)], timing
+
+
+async def _batch_texts(request: Request) -> List[str]:
+    """Texts from a JSON list / ``{"texts": [...]}`` body or an NDJSON stream of strings or ``{"text"}``."""
+    if "ndjson" not in (request.headers.get("content-type") or ""):
+        try:
+            body = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=422, detail="body must be JSON or NDJSON")
+        try:
+            return SentimentBatchRequest.model_validate(body if isinstance(body, dict) else {"texts": body}).texts
+        except ValidationError as exc:
+            raise HTTPException(status_code=422, detail=str(exc).splitlines()[0])
+
+    texts: List[str] = []
+    lineno = 0
+    async for line in _iter_lines(request):
+        lineno += 1
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            raise HTTPException(status_code=422, detail=f"line {lineno}: invalid JSON")
+        text = item.get("text") if isinstance(item, dict) else item
+        if not isinstance(text, str):
+            raise HTTPException(status_code=422, detail=f"line {lineno}: expected a string or {{\"text\": ...}}")
+        texts.append(text)
+        if len(texts) > SENTIMENT_MAX_BATCH:
+            break
+    return texts
+
+
 @app.post("/sentiment")
 def sentiment(req: SentimentRequest):
-    if _vader is None:
-        return {"compound": 0.0, "pos": 0.0, "neu": 1.0, "neg": 0.0, "note": "VADER not installed"}
-    scores = _vader.polarity_scores(req.text)
+    key = SentimentCache.key(req.text)
+    scores = sentiment_cache.get(key)
+    if scores is None:
+        scores = _score_texts([req.text])[0]
+        sentiment_cache.put(key, scores)
     return scores
 
 
+@app.post("/sentiment/batch")
+async def sentiment_batch(request: Request):
+    """Score many texts in one call; ``results`` are in input order."""
+    texts = await _batch_texts(request)
+    if len(texts) > SENTIMENT_MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"at most {SENTIMENT_MAX_BATCH} texts per batch")
+    results, timing = await score_texts(texts)
+    return {"results": results, "timing": timing}
+
+
+@app.get("/sentiment/cache/stats")
+def sentiment_cache_stats():
+    return sentiment_cache.stats()
+
+
+# ----- Politician Trade Disclosures -----
+
+
+_DISCLOSURE_NAME_KEYS = ("politician", "representative", "senator", "name")
+_DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%Y/%m/%d")
+_AMOUNT_RE = re.compile(r"[\d,]+(?:\.\d+)?")
+
+
+def _parse_disclosure_date(value: Optional[str]) -> Optional[date]:
+    if not value:
+        return None
+    value = str(value).strip()[:10]
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_amount(value) -> Tuple[Optional[float], Optional[float]]:
+    """``"$1,001 - $15,000"`` -> (1001, 15000); open-ended ranges like ``"Over $50,000,000"`` have no max."""
+    if value is None or value == "":
+        return None, None
+    if isinstance(value, (int, float)):
+        return float(value), float(value)
+    text_value = str(value)
+    bounds = [float(m.replace(",", "")) for m in _AMOUNT_RE.findall(text_value)]
+    if not bounds:
+        return None, None
+    if len(bounds) > 1:
+        return bounds[0], bounds[1]
+    open_ended = "over" in text_value.lower() or "+" in text_value
+    return bounds[0], None if open_ended else bounds[0]
+
+
+def normalize_disclosure(record: dict) -> Optional[dict]:
+    """Map one House/Senate dump record onto disclosure columns; None if it has no usable ticker/date/name."""
+    name = next((str(record[k]).strip() for k in _DISCLOSURE_NAME_KEYS if record.get(k)), "")
+    ticker = str(record.get("ticker") or record.get("symbol") or "").strip().upper()
+    tx_date = _parse_disclosure_date(record.get("transaction_date") or record.get("transactionDate"))
+    if not name or not tx_date or not ticker or ticker in ("--", "N/A"):
+        return None
+    amount = record.get("amount")
+    amount_min, amount_max = _parse_amount(amount)
+    chamber = record.get("chamber")
+    if not chamber:
+        chamber = "senate" if record.get("senator") else "house" if record.get("representative") else None
+    kind = str(record.get("type") or record.get("transaction_type") or "unknown").strip().lower()
+    owner = (str(record["owner"]).strip() or None) if record.get("owner") else None
+    fingerprint = hashlib.blake2b(
+        "|".join([name, ticker, tx_date.isoformat(), kind, str(amount), owner or ""]).encode("utf-8"), digest_size=16
+    ).hexdigest()
+    return {
+        "politician": {
+            "name": name,
+            "chamber": chamber,
+            "party": record.get("party") or None,
+            "state": record.get("state") or (str(record["district"])[:2] if record.get("district") else None),
+        },
+        "fingerprint": fingerprint,
+        "ticker": ticker,
+        "transaction_date": tx_date,
+        "disclosure_date": _parse_disclosure_date(record.get("disclosure_date") or record.get("disclosureDate")),
+        "type": kind[:32],
+        "amount_min": amount_min,
+        "amount_max": amount_max,
+        "owner": owner[:32] if owner else None,
+        "asset_description": (str(record.get("asset_description") or "")[:256] or None),
+    }
+
+
+def _json_element_end(buffer: str) -> int:
+    """Index of the ``,`` or ``]`` closing the array element at the start of ``buffer``, or -1 if not buffered yet."""
+    depth = 0
+    in_string = escaped = False
+    for i, ch in enumerate(buffer):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "[{":
+            depth += 1
+        elif ch in "]}" and depth:
+            depth -= 1
+        elif ch in ",]" and not depth:
+            return i
+    return -1
+
+
+def _iter_disclosure_records(fp: io.TextIOBase) -> Iterator[Optional[dict]]:
+    """Stream records from a CSV, NDJSON or JSON-array dump without loading the whole file.
+
+    Yields None for rows that are not JSON objects so callers can count them as rejected.
+    """
+    head = fp.read(1)
+    while head and head.isspace():
+        head = fp.read(1)
+    if head == "[":
+        decoder = json.JSONDecoder()
+        buffer = ""
+        while True:
+            buffer = buffer.lstrip(" \t\r\n,")
+            if buffer.startswith("]"):
+                return
+            try:
+                record, end = decoder.raw_decode(buffer)
+            except ValueError:
+                end = _json_element_end(buffer)
+                if end >= 0:  # the whole element is buffered, so it is malformed rather than cut off
+                    buffer = buffer[end:]
+                    yield None
+                    continue
+                chunk = fp.read(64 * 1024)
+                if not chunk:
+                    if buffer.strip():
+                        yield None  # truncated last element
+                    return
+                buffer += chunk
+                continue
+            buffer = buffer[end:]
+            yield record if isinstance(record, dict) else None
+    elif head == "{":
+        for line in itertools.chain([head + fp.readline()], fp):
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    yield None
+                    continue
+                yield record if isinstance(record, dict) else None
+    elif head:
+        yield from csv.DictReader(itertools.chain([head + fp.readline()], fp))
+
+
+def _politician_ids(db: Session, politicians: Dict[str, dict], known: Dict[str, int]) -> None:
+    """Insert unseen politicians (first record's details win) and add their ids to ``known``."""
+    new = [p for name, p in politicians.items() if name not in known]
+    if not new:
+        return
+    insert = _dialect_insert(db)
+    if insert is not None:
+        db.execute(insert(Politician).on_conflict_do_nothing(index_elements=[Politician.name]), new)
+    else:
+        existing = set(db.scalars(select(Politician.name).where(Politician.name.in_([p["name"] for p in new]))))
+        db.add_all(Politician(**p) for p in new if p["name"] not in existing)
+        db.flush()
+    rows = db.execute(select(Politician.name, Politician.id).where(Politician.name.in_([p["name"] for p in new])))
+    known.update((name, politician_id) for name, politician_id in rows)
+
+
+def _store_disclosures(db: Session, rows: List[dict], known: Dict[str, int]) -> int:
+    _politician_ids(db, {row["politician"]["name"]: row["politician"] for row in rows}, known)
+    values = [
+        {**{k: v for k, v in row.items() if k != "politician"}, "politician_id": known[row["politician"]["name"]]}
+        for row in rows
+    ]
+    # one unique-index probe per chunk keeps the inserted count exact on every dialect
+    fingerprints = [v["fingerprint"] for v in values]
+    seen = set(db.scalars(select(Disclosure.fingerprint).where(Disclosure.fingerprint.in_(fingerprints))))
+    fresh = [v for v in values if v["fingerprint"] not in seen]
+    if fresh:
+        insert = _dialect_insert(db)
+        if insert is not None:
+            # a concurrent ingest of the same dump may have won the race
+            stmt = insert(Disclosure).on_conflict_do_nothing(index_elements=[Disclosure.fingerprint])
+        else:
+            stmt = Disclosure.__table__.insert()
+        db.execute(stmt, fresh)
+    db.commit()
+    return len(fresh)
+
+
+def ingest_disclosures(path: Union[str, os.PathLike], batch_size: int = IMPORT_BATCH_SIZE) -> Dict[str, int]:
+    """Load a congressional trade disclosure dump (CSV, NDJSON or JSON array) in committed chunks.
+
+    Records are normalised and deduplicated by fingerprint, so a dump can be
+    re-ingested, or a newer one layered on top, without creating duplicates.
+    """
+    counts = {"read": 0, "inserted": 0, "rejected": 0}
+    known: Dict[str, int] = {}
+    batch: Dict[str, dict] = {}
+    with SessionLocal() as db, open(path, encoding="utf-8-sig", newline="") as fp:
+        for record in _iter_disclosure_records(fp):
+            counts["read"] += 1
+            row = normalize_disclosure(record) if record is not None else None
+            if row is None:
+                counts["rejected"] += 1
+                continue
+            batch[row["fingerprint"]] = row
+            if len(batch) >= batch_size:
+                counts["inserted"] += _store_disclosures(db, list(batch.values()), known)
+                batch = {}
+        if batch:
+            counts["inserted"] += _store_disclosures(db, list(batch.values()), known)
+    counts["politicians"] = len(known)
+    return counts
+
+
+def portfolio_disclosures(token: str, db: Session, days: int, limit: int) -> List[dict]:
+    """Disclosed trades in the caller's symbols, newest first.
+
+    Joins positions (via ``uq_token_symbol``) to disclosures (via
+    ``ix_disclosures_ticker_date``), so cost tracks the portfolio and the
+    matching trades, not the size of the disclosure table.
+    """
+    since = date.today() - timedelta(days=days)
+    rows = db.execute(
+        select(Disclosure, Politician)
+        .join(DBPosition, DBPosition.symbol == Disclosure.ticker)
+        .join(Politician, Politician.id == Disclosure.politician_id)
+        .where(DBPosition.token == token, Disclosure.transaction_date >= since)
+        .order_by(Disclosure.transaction_date.desc(), Disclosure.id.desc())
+        .limit(limit)
+    )
+    return [
+        {
+            "id": d.id,
+            "politician": p.name,
+            "chamber": p.chamber,
+            "party": p.party,
+            "state": p.state,
+            "symbol": d.ticker,
+            "type": d.type,
+            "transactionDate": d.transaction_date.isoformat(),
+            "disclosureDate": d.disclosure_date.isoformat() if d.disclosure_date else None,
+            "amountMin": d.amount_min,
+            "amountMax": d.amount_max,
+            "owner": d.owner,
+        }
+        for d, p in rows.tuples()
+    ]
+
+
+# ----- Report Jobs -----
+
+
+class ReportRequest(BaseModel):
+    type: str
+    days: int = Field(default=TIMELINE_DEFAULT_DAYS, ge=1, le=3650)  # performance window
+    targets: Optional[Dict[str, float]] = None  # allocation_drift target weights in %, default cost basis
+
+
+def _report_pnl(positions: List[PositionOut], prices: Dict[str, float], req: ReportRequest, db: Session) -> dict:
+    """Unrealised PnL per position; realised PnL needs trade history, which positions do not keep."""
+    rows = []
+    for p in positions:
+        cost = p.qty * p.avg_cost
+        value = p.qty * prices[p.symbol]
+        rows.append(
+            {
+                "symbol": p.symbol,
+                "cost": round(cost, 2),
+                "value": round(value, 2),
+                "unrealised": round(value - cost, 2),
+                "unrealisedPct": round((value - cost) / cost * 100.0, 2) if cost else 0.0,
+            }
+        )
+    total_cost = sum(r["cost"] for r in rows)
+    total_value = sum(r["value"] for r in rows)
+    return {
+        "positions": sorted(rows, key=lambda r: r["unrealised"]),
+        "cost": round(total_cost, 2),
+        "value": round(total_value, 2),
+        "unrealised": round(total_value - total_cost, 2),
+    }
+
+
+def _report_allocation_drift(
+    positions: List[PositionOut], prices: Dict[str, float], req: ReportRequest, db: Session
+) -> dict:
+    """Current weights against target weights (by default the cost-basis weights)."""
+    values = {p.symbol: p.qty * prices[p.symbol] for p in positions}
+    if req.targets is not None:
+        targets = {sym.upper(): weight for sym, weight in req.targets.items()}
+    else:
+        costs = {p.symbol: p.qty * p.avg_cost for p in positions}
+        total_cost = sum(costs.values()) or 1.0
+        targets = {sym: 100.0 * cost / total_cost for sym, cost in costs.items()}
+    total_value = sum(values.values()) or 1.0
+    rows = [
+        {
+            "symbol": sym,
+            "weight": round(100.0 * values.get(sym, 0.0) / total_value, 2),
+            "target": round(targets.get(sym, 0.0), 2),
+            "drift": round(100.0 * values.get(sym, 0.0) / total_value - targets.get(sym, 0.0), 2),
+        }
+        for sym in sorted(set(values) | set(targets))
+    ]
+    rows.sort(key=lambda r: -abs(r["drift"]))
+    return {"positions": rows, "maxDrift": max((abs(r["drift"]) for r in rows), default=0.0)}
+
+
+def _report_performance(
+    positions: List[PositionOut], prices: Dict[str, float], req: ReportRequest, db: Session
+) -> dict:
+    """Return, volatility and drawdown of today's holdings over the stored daily closes."""
+    holdings: Dict[str, float] = {}
+    for p in positions:
+        holdings[p.symbol] = holdings.get(p.symbol, 0.0) + p.qty
+    start = date.today() - timedelta(days=req.days)
+    bars = db.execute(
+        select(PriceBar.symbol, PriceBar.day, PriceBar.close).where(
+            PriceBar.symbol.in_(list(holdings)), PriceBar.day >= start
+        )
+    ).all()
+    axis, values = portfolio_value_series(holdings, bars)
+    if len(values) < 2 or not values[0]:
+        return {"days": req.days, "points": len(values), "return": None}
+    returns = np.diff(values) / np.where(values[:-1] == 0, np.nan, values[:-1])
+    drawdown = values / np.maximum.accumulate(values) - 1.0
+    return {
+        "days": req.days,
+        "points": len(values),
+        "start": axis[0].isoformat(),
+        "end": axis[-1].isoformat(),
+        "startValue": round(float(values[0]), 2),
+        "endValue": round(float(values[-1]), 2),
+        "return": round(float(values[-1] / values[0] - 1.0) * 100.0, 2),
+        "volatility": round(float(np.nanstd(returns)) * 100.0, 4),
+        "maxDrawdown": round(float(drawdown.min()) * 100.0, 2),
+    }
+
+
+REPORTS: Dict[str, Callable[[List[PositionOut], Dict[str, float], ReportRequest, Session], dict]] = {
+    "pnl": _report_pnl,
+    "allocation_drift": _report_allocation_drift,
+    "performance": _report_performance,
+}
+
+
+def _report_inputs(token: str, req: ReportRequest, db: Session) -> Tuple[List[PositionOut], Dict[str, float], str]:
+    """Positions, cached-quote prices and the cache key for ``req``, from one joined read.
+
+    The key covers the positions version, the quote rows used and the request
+    parameters (plus the stored bars for performance reports), so an unchanged
+    portfolio maps to the same key and is never recomputed.
+    """
+    positions, quotes = _load_positions(token, db)
+    version = db.scalar(select(func.coalesce(Portfolio.version, 0)).where(Portfolio.token == token))
+    prices: Dict[str, float] = {}
+    snapshot = []
+    for p in positions:
+        q = quotes.get(p.symbol)
+        # positions without a cached quote are valued at cost rather than fetched upstream
+        prices[p.symbol] = float(q.price) if q else p.avg_cost
+        snapshot.append((p.symbol, q.price if q else None, q.fetched_at.isoformat() if q else None))
+    key_parts = [token, req.type, version, sorted(snapshot), req.model_dump()]
+    if req.type == "performance":
+        start = date.today() - timedelta(days=req.days)
+        bars = db.execute(
+            select(func.count(), func.max(PriceBar.day)).where(
+                PriceBar.symbol.in_([p.symbol for p in positions]), PriceBar.day >= start
+            )
+        ).one()
+        key_parts += [start.isoformat(), bars[0], bars[1].isoformat() if bars[1] else None]
+    key = hashlib.blake2b(json.dumps(key_parts, default=str).encode("utf-8"), digest_size=16).hexdigest()
+    return positions, prices, key
+
+
+def _run_report(job_id: str) -> None:
+    """Worker: compute one queued job, or reuse the stored result if its inputs have not changed since."""
+    with SessionLocal() as db:
+        job = db.get(ReportJob, job_id)
+        if job is None:
+            return
+        job.status = "running"
+        db.commit()
+        try:
+            req = ReportRequest(type=job.kind, **json.loads(job.params))
+            positions, prices, key = _report_inputs(job.token, req, db)
+            job.cached = db.get(ReportResult, key) is not None
+            if not job.cached:
+                result = REPORTS[req.type](positions, prices, req, db)
+                db.merge(ReportResult(cache_key=key, token=job.token, kind=req.type, result=json.dumps(result)))
+            job.cache_key = key
+            job.status = "done"
+        except Exception as exc:
+            db.rollback()
+            logger.exception("report job %s failed", job_id)
+            job = db.get(ReportJob, job_id)
+            job.status = "failed"
+            job.error = (getattr(exc, "detail", None) or str(exc) or type(exc).__name__)[:512]
+        job.finished_at = datetime.utcnow()
+        db.commit()
+
+
+report_pool = ThreadPoolExecutor(max_workers=max(1, REPORT_WORKERS), thread_name_prefix="report")
+
+
+def _report_out(job: ReportJob, result: Optional[str] = None) -> dict:
+    out = {
+        "id": job.id,
+        "type": job.kind,
+        "params": json.loads(job.params),
+        "status": job.status,
+        "cached": job.cached,
+        "error": job.error,
+        "createdAt": job.created_at.isoformat() if job.created_at else None,
+        "finishedAt": job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if result is not None:
+        out["result"] = json.loads(result)
+    return out
+
+
 # ----- Minimal /api routes to align with frontend service -----
 
 
@@ -348,8 +3643,8 @@ def _token_from_header(x_pt_token: Optional[str] = Header(default=None)) -> str:
 
 class PositionUpsert(BaseModel):
     symbol: str
-    qty: float
-    avg_cost: Optional[float] = Field(default=None, alias="avgCost")
+    qty: float = Field(allow_inf_nan=False)
+    avg_cost: Optional[float] = Field(default=None, alias="avgCost", allow_inf_nan=False)
     name: Optional[str] = None
 
     model_config = {
@@ -359,13 +3654,17 @@ class PositionUpsert(BaseModel):
 
 
 @app.get("/api/health")
-def api_health():
-    return health_check()
+async def api_health():
+    return await health_check()
 
 
 @app.get("/api/positions", response_model=List[PositionOut])
-def api_positions(token: str = Depends(_token_from_header), db: Session = Depends(get_db)):
-    return get_portfolio_for_token(token, db)
+async def api_positions(
+    request: Request,
+    token: str = Depends(_token_from_header),
+    db: Union[Session, AsyncSession] = Depends(get_read_db),
+):
+    return await conditional_positions(request, token, db)
 
 
 @app.post("/api/positions", response_model=List[PositionOut])
@@ -401,46 +3700,293 @@ def api_upsert_position(
                 name=pos.name,
             )
         )
+    _touch_portfolio(db, token)
     db.commit()
-    return get_portfolio_for_token(token, db)
+    exposure_index.apply(token, {pos.symbol.upper(): pos.qty})
+    quote_hub.portfolio_changed(token)
+    return value_portfolio(token, db).positions
 
 
 @app.get("/api/portfolio")
-def api_portfolio(token: str = Depends(_token_from_header), db: Session = Depends(get_db)):
-    summary = portfolio_summary(token, db)
+async def api_portfolio(
+    token: str = Depends(_token_from_header),
+    db: Union[Session, AsyncSession] = Depends(get_read_db),
+):
+    summary = (await asnapshot_portfolio(token, db)).totals()
     return {
-        "value": summary.total_value,
-        "dayChange": 0.0,  # placeholder without intraday baseline
-        "dayPct": 0.0,
+        "value": summary["total_value"],
+        "dayChange": summary["day_change"],
+        "dayPct": summary["day_change_pct"],
     }
 
 
 @app.get("/api/allocation")
-def api_allocation(token: str = Depends(_token_from_header), db: Session = Depends(get_db)):
-    positions = get_portfolio_for_token(token, db)
-    return [{"name": p.symbol, "value": round(p.weight or 0.0, 2)} for p in positions]
+async def api_allocation(
+    token: str = Depends(_token_from_header),
+    db: Union[Session, AsyncSession] = Depends(get_read_db),
+):
+    return _json_response((await asnapshot_portfolio(token, db)).allocation())
+
+
+@app.get("/api/exposure/top", dependencies=[Depends(_require_admin)])
+def api_exposure_top(limit: int = Query(default=10, ge=1, le=500), db: Session = Depends(get_db)):
+    """Largest holdings across all portfolios by market value at the last known price."""
+    totals = exposure_index.totals()
+    prices = _latest_prices(totals, db)
+    top = heapq.nlargest(limit, totals, key=lambda symbol: totals[symbol][1] * prices.get(symbol, 0.0))
+    return [
+        {
+            "symbol": symbol,
+            "portfolios": totals[symbol][0],
+            "qty": totals[symbol][1],
+            "price": prices.get(symbol),
+            "value": round(totals[symbol][1] * prices.get(symbol, 0.0), 2),
+        }
+        for symbol in top
+    ]
+
+
+@app.get("/api/exposure/{symbol}", dependencies=[Depends(_require_admin)])
+def api_exposure(symbol: str, db: Session = Depends(get_db)):
+    symbol = symbol.upper()
+    holders, qty = exposure_index.exposure(symbol)
+    price = _latest_prices([symbol], db).get(symbol)
+    return {
+        "symbol": symbol,
+        "portfolios": holders,
+        "qty": qty,
+        "price": price,
+        "value": round(qty * price, 2) if price is not None else None,
+    }
+
+
+@app.get("/api/exposure/{symbol}/affected", dependencies=[Depends(_require_admin)])
+def api_exposure_affected(
+    symbol: str,
+    move_pct: float = Query(default=-5.0, alias="movePct", description="Hypothetical price move in percent"),
+    limit: int = Query(default=100, ge=1, le=10000),
+    db: Session = Depends(get_db),
+):
+    """Portfolios holding ``symbol``, largest value change under ``movePct`` first."""
+    symbol = symbol.upper()
+    holders = exposure_index.holders(symbol)
+    price = _latest_prices([symbol], db).get(symbol, 0.0)
+    hit = heapq.nlargest(limit, holders.items(), key=lambda item: abs(item[1]))
+    return {
+        "symbol": symbol,
+        "movePct": move_pct,
+        "portfolios": len(holders),
+        "affected": [
+            {"token": token, "qty": qty, "valueChange": round(qty * price * move_pct / 100.0, 2)}
+            for token, qty in hit
+        ],
+    }
+
+
+def _stream_watch(token: str) -> Tuple[int, List[str]]:
+    """The portfolio's version and symbols, read before the snapshot so nothing in between is missed."""
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(func.coalesce(Portfolio.version, 0), DBPosition.symbol)
+            .outerjoin(DBPosition, DBPosition.token == Portfolio.token)
+            .where(Portfolio.token == token)
+        ).all()
+    if not rows:
+        raise HTTPException(status_code=404, detail="Portfolio not found")
+    return rows[0][0], [symbol for _, symbol in rows if symbol]
+
+
+def _stream_snapshot(token: str) -> PortfolioSummary:
+    with SessionLocal() as db:
+        return value_portfolio(token, db)
+
+
+def _stream_message(kind: str, positions: Dict[str, PositionOut], symbols: Iterable[str]) -> dict:
+    total = sum(p.market_value or 0.0 for p in positions.values())
+    return {
+        "type": kind,
+        "value": round(total, 2),
+        "positions": [
+            {"symbol": p.symbol, "price": p.price, "market_value": p.market_value, "weight": p.weight}
+            for p in (positions[sym] for sym in symbols)
+        ],
+    }
+
+
+def _apply_prices(positions: Dict[str, PositionOut], prices: Dict[str, float]) -> List[str]:
+    """Re-price held symbols; return every symbol whose price, value or weight changed."""
+    changed = set()
+    for sym, price in prices.items():
+        p = positions.get(sym)
+        if p is not None and p.price != price:
+            p.price = price
+            p.market_value = price * p.qty
+            changed.add(sym)
+    if changed:
+        denom = sum(p.market_value or 0.0 for p in positions.values()) or 1.0
+        for sym, p in positions.items():
+            weight = round(100.0 * (p.market_value or 0.0) / denom, 2)
+            if weight != p.weight:
+                p.weight = weight
+                changed.add(sym)
+    return [sym for sym in positions if sym in changed]
+
+
+@app.websocket("/api/stream")
+async def api_stream(websocket: WebSocket, token: Optional[str] = Query(default=None)):
+    """Push position updates whenever a held symbol's quote refreshes.
+
+    The token comes from ``x-pt-token`` or, for browsers that cannot set
+    WebSocket headers, the ``token`` query parameter. The first message is a
+    full ``snapshot``; later ``update`` messages carry only changed positions,
+    and a new ``snapshot`` follows any write to the portfolio. Changes made
+    through other workers arrive within ``STREAM_SYNC_SECONDS``.
+    """
+    token = token or websocket.headers.get("x-pt-token")
+    if not token:
+        await websocket.close(code=1008, reason="Missing x-pt-token")
+        return
+    await websocket.accept()
+    try:
+        version, symbols = await run_in_threadpool(_stream_watch, token)
+    except HTTPException as exc:
+        await websocket.close(code=1008, reason=str(exc.detail))
+        return
+    # subscribe before reading the snapshot: a refresh or write landing in between is queued, not lost
+    sub = quote_hub.subscribe(token, symbols, version)
+    try:
+        summary = await run_in_threadpool(_stream_snapshot, token)
+    except HTTPException as exc:
+        quote_hub.unsubscribe(sub)
+        await websocket.close(code=1008, reason=str(exc.detail))
+        return
+    positions = {p.symbol: p for p in summary.positions}
+
+    async def _pump() -> None:
+        nonlocal positions
+        await websocket.send_json(_stream_message("snapshot", positions, positions))
+        while True:
+            resync, prices = await sub.next()
+            if resync:
+                sub.version, symbols = await run_in_threadpool(_stream_watch, token)
+                quote_hub.resubscribe(sub, symbols)
+                summary = await run_in_threadpool(_stream_snapshot, token)
+                positions = {p.symbol: p for p in summary.positions}
+                await websocket.send_json(_stream_message("snapshot", positions, positions))
+                continue
+            changed = _apply_prices(positions, prices)
+            if changed:
+                await websocket.send_json(_stream_message("update", positions, changed))
+
+    pump = asyncio.create_task(_pump())
+    try:
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    finally:
+        pump.cancel()
+        quote_hub.unsubscribe(sub)
 
 
 @app.get("/api/timelines")
-def api_timelines(token: str = Depends(_token_from_header)):
-    return []
+def api_timelines(
+    token: str = Depends(_token_from_header),
+    days: int = Query(default=TIMELINE_DEFAULT_DAYS, ge=1, le=3650),
+    db: Session = Depends(get_db),
+):
+    return portfolio_timeline(token, db, days)
 
 
 @app.get("/api/politicians")
-def api_politicians(token: str = Depends(_token_from_header)):
-    return []
+def api_politicians(
+    token: str = Depends(_token_from_header),
+    days: int = Query(default=365, ge=1, le=3650),
+    limit: int = Query(default=200, ge=1, le=1000),
+    db: Session = Depends(get_db),
+):
+    """Politicians' disclosed trades in symbols the caller holds."""
+    return portfolio_disclosures(token, db, days, limit)
 
 
-@app.get("/api/alerts")
-def api_alerts(token: str = Depends(_token_from_header)):
-    return []
+@app.get("/api/alerts", response_model=List[AlertOut])
+def api_alerts(token: str = Depends(_token_from_header), db: Session = Depends(get_db)):
+    return db.scalars(select(Alert).where(Alert.token == token).order_by(Alert.id)).all()
 
 
 @app.post("/api/alerts")
-def api_create_alert(payload: dict, token: str = Depends(_token_from_header)):
-    return {"ok": True, "alert": payload}
+def api_create_alert(payload: dict, token: str = Depends(_token_from_header), db: Session = Depends(get_db)):
+    symbol = str(payload.get("symbol") or "").strip().upper()
+    if not symbol:
+        raise HTTPException(status_code=422, detail="symbol is required")
+    try:
+        rules = parse_alert_rules(payload)
+    except (TypeError, ValueError) as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+
+    alerts = [Alert(token=token, symbol=symbol, kind=kind, threshold=threshold) for kind, threshold in rules]
+    db.add_all(alerts)
+    db.commit()
+    for alert in alerts:
+        alert_engine.add(alert)
+    return {"ok": True, "alert": payload, "rules": [AlertOut.model_validate(a) for a in alerts]}
+
+
+@app.delete("/api/alerts/{alert_id}")
+def api_delete_alert(alert_id: int, token: str = Depends(_token_from_header), db: Session = Depends(get_db)):
+    alert = db.get(Alert, alert_id)
+    if not alert or alert.token != token:
+        raise HTTPException(status_code=404, detail="Alert not found")
+    db.delete(alert)
+    db.commit()
+    alert_engine.remove(alert_id)
+    return {"ok": True}
 
 
 @app.get("/api/reports")
-def api_reports(token: str = Depends(_token_from_header)):
-    return []
+def api_reports(token: str = Depends(_token_from_header), db: Session = Depends(get_db)):
+    jobs = db.scalars(
+        select(ReportJob).where(ReportJob.token == token).order_by(ReportJob.created_at.desc()).limit(50)
+    )
+    return [_report_out(job) for job in jobs]
+
+
+@app.post("/api/reports", status_code=202)
+def api_create_report(req: ReportRequest, token: str = Depends(_token_from_header), db: Session = Depends(get_db)):
+    """Queue a report; answered immediately, with the result, when nothing it depends on has changed."""
+    if req.type not in REPORTS:
+        raise HTTPException(status_code=422, detail=f"type must be one of {', '.join(REPORTS)}")
+    _, _, key = _report_inputs(token, req, db)
+    stored = db.get(ReportResult, key)
+    params = req.model_dump(exclude={"type"})
+    job = ReportJob(id=uuid.uuid4().hex, token=token, kind=req.type, params=json.dumps(params))
+    if stored is not None:
+        job.status, job.cached, job.cache_key, job.finished_at = "done", True, key, datetime.utcnow()
+    db.add(job)
+    db.commit()
+    if stored is None:
+        report_pool.submit(_run_report, job.id)
+    return _report_out(job, stored.result if stored else None)
+
+
+@app.get("/api/reports/{job_id}")
+def api_report(job_id: str, token: str = Depends(_token_from_header), db: Session = Depends(get_db)):
+    job = db.get(ReportJob, job_id)
+    if job is None or job.token != token:
+        raise HTTPException(status_code=404, detail="Report not found")
+    stored = db.get(ReportResult, job.cache_key) if job.status == "done" else None
+    return _report_out(job, stored.result if stored else None)
+
+
+if __name__ == "__main__":
+    import sys
+
+    command, args = (sys.argv[1], sys.argv[2:]) if len(sys.argv) > 1 else ("", [])
+    if command == "init-db" and not args:
+        # run once per deploy so workers can start with DB_SCHEMA_MODE=check
+        init_db()
+        print(f"schema ready: {describe_engine(engine)}")
+    elif command == "ingest-disclosures" and args:
+        init_db()
+        for path in args:
+            print(f"{path}: {ingest_disclosures(path)}")
+    else:
+        sys.exit("usage: python main.py init-db | ingest-disclosures FILE [FILE ...]")
@@ -1,7 +1,17 @@
+import asyncio
+import json
 import os
+import subprocess
 import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
 from pathlib import Path
 
+import httpx
+import numpy as np
+import pytest
 from fastapi.testclient import TestClient
 
 # Make sure backend directory (where main.py lives) is on sys.path
@@ -9,8 +19,34 @@ ROOT = Path(__file__).resolve().parents[1]  # this is the backend/ folder
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
-from main import app  # now this should work
+# Run against a throwaway SQLite file so cache state never leaks between runs
+_TEST_DB = Path(tempfile.mkdtemp()) / "test.db"
+os.environ["DATABASE_URL"] = f"sqlite:///{_TEST_DB}"
 
+from sqlalchemy import event, text
+
+import main
+from main import (  # now this should work
+    Alert,
+    CircuitBreaker,
+    CircuitOpen,
+    FetchedQuote,
+    Quote,
+    QuoteCache,
+    QuoteRefresher,
+    SessionLocal,
+    TokenBucket,
+    alpha_client,
+    app,
+    describe_engine,
+    engine,
+    init_db,
+    portfolio_value_series,
+    quote_writer,
+    store_price_bars,
+)
+
+init_db()
 client = TestClient(app)
 
 
@@ -74,6 +110,73 @@ def test_sentiment():
     assert "neg" in body
 
 
+def test_sentiment_batch_caches_and_keeps_order(monkeypatch):
+    main.sentiment_cache.clear()
+    texts = ["Great earnings beat!", "Terrible guidance cut.", "Great earnings beat!"]
+    r = client.post("/sentiment/batch", json=texts)
+    assert r.status_code == 200
+    body = r.json()
+    assert body["results"][0] == body["results"][2]
+    assert body["results"][0]["compound"] > 0 > body["results"][1]["compound"]
+    assert (body["timing"]["texts"], body["timing"]["scored"], body["timing"]["cached"]) == (3, 2, 0)
+
+    ndjson = '"Terrible guidance cut."\n{"text": "Great earnings beat!"}\n'
+    r = client.post("/sentiment/batch", content=ndjson, headers={"content-type": "application/x-ndjson"})
+    assert r.json()["timing"]["cached"] == 2
+    assert r.json()["results"] == body["results"][1::-1]
+    assert client.post("/sentiment/batch", json={"texts": [1]}).status_code == 422
+
+    # past one chunk the misses fan out over worker processes
+    monkeypatch.setattr(main, "SENTIMENT_CHUNK_SIZE", 2)
+    monkeypatch.setattr(main, "SENTIMENT_WORKERS", 2)
+    try:
+        body = client.post("/sentiment/batch", json={"texts": [f"good day {i}" for i in range(5)]}).json()
+    finally:
+        main._shutdown_sentiment_pool()
+    assert body["timing"]["workers"] == 3
+    assert len(body["results"]) == 5 and all(r["compound"] > 0 for r in body["results"])
+
+
+_STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    ready = time.perf_counter()
+    lazy = not main._vader_loaded
+    assert client.post("/sentiment", json={"text": "good"}).json()["compound"] > 0
+print(json.dumps({"import": imported - started, "ready": ready - started, "lazy": lazy}))
+"""
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "5"))
+
+
+def test_startup_time_within_budget():
+    # schema created by this process, so the fresh worker only checks it
+    env = dict(os.environ, DB_SCHEMA_MODE="check", SENTIMENT_WARMUP="0")
+    proc = subprocess.run(
+        [sys.executable, "-c", _STARTUP_SCRIPT], cwd=ROOT, env=env, capture_output=True, text=True, timeout=60
+    )
+    assert proc.returncode == 0, proc.stderr
+    timing = json.loads(proc.stdout.splitlines()[-1])
+    assert timing["lazy"], "VADER lexicon loaded during startup"
+    assert timing["ready"] < STARTUP_BUDGET_SECONDS, timing
+
+
+def test_schema_check_mode_reports_missing_tables(tmp_path):
+    env = dict(os.environ, DB_SCHEMA_MODE="check", DATABASE_URL=f"sqlite:///{tmp_path / 'empty.db'}")
+    script = "import main\nfrom fastapi.testclient import TestClient\nTestClient(main.app).__enter__()"
+    proc = subprocess.run([sys.executable, "-c", script], cwd=ROOT, env=env, capture_output=True, text=True, timeout=60)
+    assert proc.returncode != 0 and "python main.py init-db" in proc.stderr
+    proc = subprocess.run(
+        [sys.executable, "main.py", "init-db"], cwd=ROOT, env=env, capture_output=True, text=True, timeout=60
+    )
+    assert proc.returncode == 0, proc.stderr
+    proc = subprocess.run([sys.executable, "-c", script], cwd=ROOT, env=env, capture_output=True, text=True, timeout=60)
+    assert proc.returncode == 0, proc.stderr
+
+
 def _make_token():
     # helper to create a token via /portfolio
     r = client.post("/portfolio", json=None)
@@ -158,3 +261,1003 @@ def test_api_alerts_and_reports_and_timeline_and_politicians():
     r = client.get("/api/reports", headers=headers)
     assert r.status_code == 200
     assert r.json() == []
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_alert_rules_persist_fire_and_delete(monkeypatch):
+    token = _make_token()
+    headers = {"x-pt-token": token}
+    r = client.post("/api/alerts", json={"symbol": "ZZAL", "kind": "price_above"}, headers=headers)
+    assert r.status_code == 422  # missing threshold
+
+    rules = [
+        {"symbol": "zzal", "rule": "price > 200"},
+        {"symbol": "ZZAL", "below": 150},
+        {"symbol": "ZZAL", "rule": "move >= 5%"},
+        {"symbol": "ZZAL", "kind": "price_above", "threshold": 300},
+    ]
+    ids = [client.post("/api/alerts", json=rule, headers=headers).json()["rules"][0]["id"] for rule in rules]
+    listed = client.get("/api/alerts", headers=headers).json()
+    assert [(a["symbol"], a["kind"], a["threshold"]) for a in listed] == [
+        ("ZZAL", "price_above", 200.0),
+        ("ZZAL", "price_below", 150.0),
+        ("ZZAL", "pct_move", 5.0),
+        ("ZZAL", "price_above", 300.0),
+    ]
+
+    # a fresh engine rebuilds its index from the table
+    restored = main.AlertEngine(alpha_client)
+    restored.sync()
+    assert sorted(restored.match("ZZAL", 310.0, 300.0)) == [ids[0], ids[3]]
+
+    assert client.delete(f"/api/alerts/{ids[3]}", headers=headers).json() == {"ok": True}
+    assert client.delete(f"/api/alerts/{ids[3]}", headers=headers).status_code == 404
+
+    monkeypatch.setattr(alpha_client, "_fetch_quote", lambda symbol: FetchedQuote(210.0, 195.0))
+    alpha_client.refresh("ZZAL")  # +7.7% through the 200 line: fires price_above and pct_move
+    triggered = lambda: {a["id"] for a in client.get("/api/alerts", headers=headers).json() if not a["active"]}
+    assert _wait_for(lambda: triggered() == {ids[0], ids[2]})
+    fired = {a["id"]: a for a in client.get("/api/alerts", headers=headers).json()}
+    assert fired[ids[0]]["triggered_price"] == 210.0
+    assert fired[ids[1]]["active"] is True
+    assert ids[3] not in fired
+
+
+def test_weight_alert_fires_on_breach_and_skips_unpriced_holdings(monkeypatch):
+    positions = [{"symbol": "ZZAW1", "qty": 10, "avg_cost": 1}, {"symbol": "ZZAW2", "qty": 1, "avg_cost": 1}]
+    priced = client.post("/portfolio", json=positions).json()["token"]
+    partial = positions[:1] + [{"symbol": "ZZAW3", "qty": 1, "avg_cost": 1}]  # ZZAW3 has no quote
+    unpriced = client.post("/portfolio", json=partial).json()["token"]
+    with SessionLocal() as db:
+        db.add(Quote(symbol="ZZAW2", price=10.0, fetched_at=datetime.utcnow()))
+        db.commit()
+    ids = {}
+    for token in (priced, unpriced):
+        r = client.post("/api/alerts", json={"symbol": "ZZAW1", "rule": "weight > 50"}, headers={"x-pt-token": token})
+        ids[token] = r.json()["rules"][0]["id"]
+
+    monkeypatch.setattr(alpha_client, "_fetch_quote", lambda symbol: FetchedQuote(10.0))
+    alpha_client.refresh("ZZAW1")  # 100 of 110 in the priced portfolio
+    with SessionLocal() as db:
+        assert _wait_for(lambda: db.get(Alert, ids[priced], populate_existing=True).active is False)
+        assert db.get(Alert, ids[unpriced]).active is True
+
+
+def test_ingest_disclosures_and_join_on_holdings(tmp_path):
+    recent = (date.today() - timedelta(days=10)).isoformat()
+    old = (date.today() - timedelta(days=800)).isoformat()
+    house = tmp_path / "house.json"
+    house.write_text(
+        json.dumps(
+            [
+                {"representative": "Hon. Ada Ames", "ticker": "ZZPA", "transaction_date": recent,
+                 "disclosure_date": recent, "type": "purchase", "amount": "$1,001 - $15,000", "district": "CA12"},
+                {"representative": "Hon. Ada Ames", "ticker": "ZZPB", "transaction_date": old,
+                 "type": "sale_full", "amount": "$15,001 - $50,000"},
+                {"representative": "Hon. Ada Ames", "ticker": "--", "transaction_date": recent},
+                [1, 2],
+            ]
+        )
+    )
+    senate = tmp_path / "senate.csv"
+    senate.write_text(
+        "senator,ticker,transaction_date,type,amount,party\n"
+        f"Bo Brown,ZZPB,{date.today().strftime('%m/%d/%Y')},purchase,\"Over $50,000,000\",D\n"
+        f"Bo Brown,ZZPQ,{recent},purchase,\"$1,001 - $15,000\",D\n"
+    )
+    assert main.ingest_disclosures(house, batch_size=1) == {"read": 4, "inserted": 2, "rejected": 2, "politicians": 1}
+    assert main.ingest_disclosures(house)["inserted"] == 0  # re-ingesting is a no-op
+    assert main.ingest_disclosures(senate)["inserted"] == 2
+
+    # a malformed element mid-array is rejected on its own; the rest of the dump still loads
+    rows = [
+        json.dumps({"representative": "Cy Cole, Jr. [R]", "ticker": f"ZZPM{i}", "transaction_date": recent})
+        for i in range(6)
+    ]
+    broken = tmp_path / "broken.json"
+    broken.write_text("[" + ",\n".join(rows[:1] + ['{"representative": "Cy Cole", bad json}'] + rows[1:]) + "]")
+    assert main.ingest_disclosures(broken) == {"read": 7, "inserted": 6, "rejected": 1, "politicians": 1}
+
+    positions = [{"symbol": "ZZPA", "qty": 1, "avg_cost": 1}, {"symbol": "ZZPB", "qty": 1, "avg_cost": 1}]
+    token = client.post("/portfolio", json=positions).json()["token"]
+    trades = client.get("/api/politicians", headers={"x-pt-token": token}).json()
+    assert [(t["politician"], t["symbol"]) for t in trades] == [("Bo Brown", "ZZPB"), ("Hon. Ada Ames", "ZZPA")]
+    assert (trades[0]["amountMin"], trades[0]["amountMax"], trades[0]["party"]) == (50000000.0, None, "D")
+    assert (trades[1]["amountMin"], trades[1]["amountMax"], trades[1]["chamber"]) == (1001.0, 15000.0, "house")
+    trades = client.get("/api/politicians?days=1000", headers={"x-pt-token": token}).json()
+    assert len(trades) == 3
+
+    # the join probes the disclosure index rather than scanning the table
+    stmt = main.select(main.Disclosure.id).join(main.DBPosition, main.DBPosition.symbol == main.Disclosure.ticker)
+    stmt = stmt.where(main.DBPosition.token == token, main.Disclosure.transaction_date >= date.today())
+    with engine.connect() as conn:
+        sql = str(stmt.compile(engine, compile_kwargs={"literal_binds": True}))
+        plan = " ".join(str(row) for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+    assert "ix_disclosures_ticker_date" in plan
+
+
+def test_report_jobs_compute_once_per_portfolio_state(monkeypatch):
+    positions = [{"symbol": "ZZRA", "qty": 2, "avg_cost": 10}, {"symbol": "ZZRB", "qty": 1, "avg_cost": 20}]
+    token = client.post("/portfolio", json=positions).json()["token"]
+    headers = {"x-pt-token": token}
+    with SessionLocal() as db:
+        db.add_all([Quote(symbol="ZZRA", price=15.0, fetched_at=datetime.utcnow()),
+                    Quote(symbol="ZZRB", price=10.0, fetched_at=datetime.utcnow())])
+        db.commit()
+    runs = []
+    compute = main.REPORTS["pnl"]
+    monkeypatch.setitem(main.REPORTS, "pnl", lambda *args: runs.append(1) or compute(*args))
+
+    def finished(job):
+        assert _wait_for(lambda: client.get(f"/api/reports/{job['id']}", headers=headers).json()["status"] == "done")
+        return client.get(f"/api/reports/{job['id']}", headers=headers).json()
+
+    assert client.post("/api/reports", json={"type": "nope"}, headers=headers).status_code == 422
+    job = client.post("/api/reports", json={"type": "pnl"}, headers=headers).json()
+    assert job["status"] in ("queued", "running", "done")
+    report = finished(job)
+    assert (report["result"]["cost"], report["result"]["value"], report["result"]["unrealised"]) == (40.0, 40.0, 0.0)
+    assert report["cached"] is False
+
+    # unchanged positions and quotes: answered from the cache without queueing
+    again = client.post("/api/reports", json={"type": "pnl"}, headers=headers).json()
+    assert (again["status"], again["cached"], again["result"]) == ("done", True, report["result"])
+    assert len(runs) == 1
+
+    client.post("/api/positions", json={"symbol": "ZZRB", "qty": 3, "avgCost": 20}, headers=headers)
+    assert finished(client.post("/api/reports", json={"type": "pnl"}, headers=headers).json())["result"]["value"] == 60.0
+    with SessionLocal() as db:
+        db.get(Quote, "ZZRA").price = 16.0
+        db.commit()
+    assert finished(client.post("/api/reports", json={"type": "pnl"}, headers=headers).json())["result"]["value"] == 62.0
+    assert len(runs) == 3
+
+    drift = finished(
+        client.post("/api/reports", json={"type": "allocation_drift", "targets": {"zzra": 50}}, headers=headers).json()
+    )["result"]
+    assert {r["symbol"]: r["drift"] for r in drift["positions"]} == {"ZZRA": 1.61, "ZZRB": 48.39}
+    assert [r["type"] for r in client.get("/api/reports", headers=headers).json()][:2] == ["allocation_drift", "pnl"]
+
+
+def test_get_prices_batches_cold_misses(monkeypatch):
+    fetched = []
+
+    def fake_fetch(symbol):
+        fetched.append(symbol)
+        return FetchedQuote(42.0)
+
+    monkeypatch.setattr(alpha_client, "_fetch_quote", fake_fetch)
+    symbols = [f"ZZB{i}" for i in range(5)]
+    with SessionLocal() as db:
+        prices = alpha_client.get_prices(symbols + ["zzb0"], db)
+        assert prices == {s: 42.0 for s in symbols}
+        assert sorted(fetched) == sorted(symbols)
+
+        # second call is served from the quotes table
+        assert alpha_client.get_prices(symbols, db) == prices
+        assert len(fetched) == len(symbols)
+
+
+def _count_statements(fn):
+    statements = []
+
+    def count(conn, cursor, statement, params, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        result = fn()
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    return result, statements
+
+
+def test_hot_quotes_served_from_memory_without_sql(monkeypatch):
+    monkeypatch.setattr(alpha_client, "_fetch_quote", lambda symbol: FetchedQuote(7.5))
+    with SessionLocal() as db:
+        alpha_client.get_prices(["ZZM1", "ZZM2"], db)
+
+    before = alpha_client.memory.stats()["hits"]
+    r, statements = _count_statements(lambda: client.get("/quote/ZZM1"))
+    assert r.json()["price"] == 7.5
+    assert statements == []
+
+    stats = client.get("/quote/cache/stats").json()
+    assert stats["hits"] == before + 1
+    assert {"size", "max_size", "misses", "evictions"} <= set(stats)
+
+
+def test_quote_cache_ttl_and_lru_eviction():
+    cache = QuoteCache(ttl_seconds=60, max_size=2)
+    now = datetime.utcnow()
+    cache.put("A", 1.0, now)
+    cache.put("B", 2.0, now)
+    assert cache.get("A", now) == 1.0  # A becomes most recently used
+    cache.put("C", 3.0, now)  # evicts B
+    assert cache.get("B", now) is None
+    assert cache.get("C", now) == 3.0
+    assert cache.get("A", now + timedelta(seconds=61)) is None  # expired
+    assert cache.stats()["evictions"] == 1
+
+
+def test_concurrent_misses_share_one_fetch(monkeypatch):
+    calls = []
+
+    def slow_fetch(symbol):
+        calls.append(symbol)
+        time.sleep(0.2)
+        return FetchedQuote(11.0)
+
+    monkeypatch.setattr(alpha_client, "_fetch_quote", slow_fetch)
+    results = []
+
+    def worker():
+        with SessionLocal() as db:
+            results.append(alpha_client.get_price("ZZSF", db))
+
+    threads = [threading.Thread(target=worker) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [11.0] * 5
+    assert calls == ["ZZSF"]
+
+
+def test_leader_upserts_quote_inserted_since_its_read(monkeypatch):
+    monkeypatch.setattr(alpha_client, "_fetch_quote", lambda symbol: FetchedQuote(12.0, 11.0))
+    with SessionLocal() as db:
+        db.add(Quote(symbol="ZZUPS", price=10.0, fetched_at=datetime.utcnow()))
+        db.commit()
+        # the caller's snapshot predates the other leader's insert
+        assert alpha_client.get_prices(["ZZUPS"], db, quotes={"ZZUPS": None}) == {"ZZUPS": 12.0}
+    quote_writer.flush()
+    with SessionLocal() as db:
+        row = db.get(Quote, "ZZUPS")
+        assert (row.price, row.prev_close) == (12.0, 11.0)
+
+
+def test_quote_reads_never_write_and_flushes_coalesce_per_symbol(monkeypatch):
+    prices = iter([1.0, 2.0, 3.0])
+    monkeypatch.setattr(alpha_client, "_fetch_quote", lambda symbol: FetchedQuote(next(prices)))
+    quote_writer.flush()
+
+    r, statements = _count_statements(lambda: client.get("/quote/ZZWB1"))
+    assert r.json()["price"] == 1.0
+    assert not [s for s in statements if not s.lstrip().upper().startswith("SELECT")]
+    alpha_client.memory.clear()
+    with SessionLocal() as db:
+        assert db.get(Quote, "ZZWB1") is None  # not flushed yet
+        assert alpha_client.refresh("ZZWB1") == 2.0
+        assert alpha_client.refresh("ZZWB1") == 3.0
+    assert quote_writer.pending() == 1  # three fetches, one buffered row
+    assert "quote_write_buffer_depth 1" in client.get("/metrics").text
+
+    _, statements = _count_statements(quote_writer.flush)
+    assert len([s for s in statements if "INSERT" in s.upper()]) == 1
+    with SessionLocal() as db:
+        assert db.get(Quote, "ZZWB1").price == 3.0
+
+    # a full buffer is flushed by the background thread without waiting for the interval
+    monkeypatch.setattr(quote_writer, "max_rows", 2)
+    monkeypatch.setattr(quote_writer, "interval", 60.0)
+    now, written = datetime.utcnow(), quote_writer.rows_written
+    rows = [{"symbol": s, "price": 1.0, "fetched_at": now, "prev_close": None} for s in ("ZZWB2", "ZZWB3")]
+    quote_writer.submit(rows)
+    _wait_for(lambda: quote_writer.rows_written == written + 2)
+    with SessionLocal() as db:
+        assert db.get(Quote, "ZZWB3").price == 1.0
+
+
+def test_stale_while_revalidate_serves_expired_price(monkeypatch):
+    release = threading.Event()
+
+    def gated_fetch(symbol):
+        release.wait(5)
+        return FetchedQuote(20.0)
+
+    monkeypatch.setattr(alpha_client, "_fetch_quote", gated_fetch)
+    monkeypatch.setattr(main, "PRICE_STALE_WHILE_REVALIDATE_SECONDS", 3600)
+    expired = datetime.utcnow() - timedelta(seconds=main.PRICE_CACHE_TTL_SECONDS + 60)
+    with SessionLocal() as db:
+        db.add(Quote(symbol="ZZSWR", price=10.0, fetched_at=expired))
+        db.commit()
+        assert alpha_client.get_price("ZZSWR", db) == 10.0  # stale, returned immediately
+
+    release.set()
+    deadline = time.time() + 5
+    while alpha_client.memory.get("ZZSWR") is None and time.time() < deadline:
+        time.sleep(0.01)
+    assert alpha_client.memory.get("ZZSWR") == 20.0
+    quote_writer.flush()
+    with SessionLocal() as db:
+        assert db.get(Quote, "ZZSWR").price == 20.0
+
+
+def _mock_upstream(monkeypatch, handler):
+    """Route the Alpha Vantage client's HTTP calls to ``handler`` (so the bucket is charged)."""
+    monkeypatch.setattr(alpha_client, "api_key", "test")
+    monkeypatch.setattr(alpha_client, "_client", httpx.Client(transport=httpx.MockTransport(handler)))
+
+
+def test_refresher_prioritises_widely_held_symbols(monkeypatch):
+    fetched = []
+
+    def handler(request):
+        fetched.append(request.url.params["symbol"])
+        return httpx.Response(200, json={"Global Quote": {"05. price": "55.0"}})
+
+    for _ in range(3):
+        client.post("/portfolio", json=[{"symbol": "ZZHOT", "qty": 1, "avg_cost": 1}])
+    client.post("/portfolio", json=[{"symbol": "ZZCOLD", "qty": 1, "avg_cost": 1}])
+    _mock_upstream(monkeypatch, handler)
+    monkeypatch.setattr(alpha_client, "bucket", TokenBucket(0.0, 1.0))
+
+    refresher = QuoteRefresher(alpha_client)
+    with SessionLocal() as db:
+        due = refresher.due_symbols(db)
+    assert due.index("ZZHOT") < due.index("ZZCOLD")
+
+    # a one-call budget refreshes only the most widely held symbol
+    assert refresher.run_once() == ["ZZHOT"]
+    assert fetched == ["ZZHOT"]
+    quote_writer.flush()
+    with SessionLocal() as db:
+        assert db.get(Quote, "ZZHOT").price == 55.0
+        assert "ZZHOT" not in refresher.due_symbols(db)
+
+
+def test_every_upstream_call_spends_a_token(monkeypatch):
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.params["function"])
+        if request.url.params["function"] == "GLOBAL_QUOTE":
+            return httpx.Response(200, json={"Global Quote": {}})
+        return httpx.Response(200, json={"Time Series (Daily)": {"2024-01-02": {
+            "1. open": "1", "2. high": "1", "3. low": "1", "4. close": "7.0", "5. volume": "1"}}})
+
+    _mock_upstream(monkeypatch, handler)
+    monkeypatch.setattr(alpha_client, "bucket", TokenBucket(0.0, 3.0))
+    # the daily fallback costs a second call
+    assert alpha_client.refresh("ZZTOK") == 7.0
+    assert calls == ["GLOBAL_QUOTE", "TIME_SERIES_DAILY"]
+    assert alpha_client.bucket.available() < 2
+    # history backfill draws from the same budget, then the budget is spent
+    assert alpha_client.backfill_history(["ZZTOK", "ZZTOK2"]) in ({"ZZTOK": 1, "ZZTOK2": 0}, {"ZZTOK": 0, "ZZTOK2": 1})
+    assert alpha_client.refresh("ZZTOK3") is None
+    assert len(calls) == 3
+
+
+def test_circuit_breaker_serves_cached_prices_and_retries_within_budget(monkeypatch):
+    replies = []
+
+    def handler(request):
+        return replies.pop(0) if replies else httpx.Response(200, json={"Global Quote": {"05. price": "30.0"}})
+
+    calls = []
+    _mock_upstream(monkeypatch, lambda request: calls.append(request.url.params["function"]) or handler(request))
+    monkeypatch.setattr(alpha_client, "bucket", TokenBucket(1e6, 1e6))
+    monkeypatch.setattr(alpha_client, "breaker", CircuitBreaker(3, 0.2))
+    assert alpha_client.timeout.connect == main.ALPHAVANTAGE_CONNECT_TIMEOUT_SECONDS
+
+    # a rate-limit "Note" opens the circuit at once and skips the TIME_SERIES_DAILY fallback
+    replies.append(httpx.Response(200, json={"Note": "Thank you for using Alpha Vantage!"}))
+    expired = datetime.utcnow() - timedelta(seconds=main.PRICE_CACHE_TTL_SECONDS + 60)
+    with SessionLocal() as db:
+        db.add(Quote(symbol="ZZCB1", price=10.0, fetched_at=expired))
+        db.commit()
+        assert alpha_client.get_price("ZZCB1", db) == 10.0
+    assert (calls, alpha_client.breaker.state) == (["GLOBAL_QUOTE"], "open")
+
+    # while open nothing goes upstream, and the stale row is served as it is rather than re-stamped
+    started = time.perf_counter()
+    with pytest.raises(CircuitOpen):
+        alpha_client._fetch_quote("ZZCB1")
+    assert time.perf_counter() - started < 0.1 and len(calls) == 1
+    with SessionLocal() as db:
+        assert alpha_client.get_price("ZZCB1", db) == 10.0
+    quote_writer.flush()
+    with SessionLocal() as db:
+        assert db.get(Quote, "ZZCB1").fetched_at == expired
+
+    # after the reset window one probe closes it again; an out-of-quota probe hands its slot back
+    _wait_for(lambda: alpha_client.breaker.state == "half_open")
+    with monkeypatch.context() as m:
+        m.setattr(alpha_client, "bucket", TokenBucket(0.0, 0.0))
+        with pytest.raises(main.QuotaExhausted):
+            alpha_client._fetch_quote("ZZCB1")
+    assert alpha_client.breaker.state == "half_open"
+    assert alpha_client._fetch_quote("ZZCB1").price == 30.0
+    assert alpha_client.breaker.state == "closed"
+
+    # a 5xx is retried once while the retry budget lasts, then surfaces
+    calls.clear()
+    replies.append(httpx.Response(503))
+    assert alpha_client._fetch_quote("ZZCB1").price == 30.0
+    assert calls == ["GLOBAL_QUOTE", "GLOBAL_QUOTE"]
+    monkeypatch.setattr(alpha_client, "retry_budget", TokenBucket(0.0, 0.0))
+    replies.append(httpx.Response(503))
+    with pytest.raises(httpx.HTTPStatusError):
+        alpha_client._fetch_quote("ZZCB1")
+    assert len(calls) == 3 and alpha_client.breaker.failures == 1
+
+
+def test_replay_provider_takes_over_when_alpha_vantage_cannot_answer(monkeypatch, tmp_path):
+    recorded = {
+        "zzrp1": {"Global Quote": {"05. price": "42.5", "08. previous close": "40.0"}},
+        "ZZRP2": {
+            "Time Series (Daily)": {
+                f"2024-01-{day:02d}": {"1. open": "1", "2. high": "1", "3. low": "1", "4. close": str(day)}
+                for day in range(2, 6)
+            }
+        },
+    }
+    path = tmp_path / "replay.json"
+    path.write_text(json.dumps(recorded))
+    replay = main.ReplayProvider(str(path), latency_ms=30)
+    monkeypatch.setattr(alpha_client, "api_key", "")  # Alpha Vantage refuses at once, no network
+    monkeypatch.setattr(alpha_client, "providers", [main.AlphaVantageProvider(alpha_client), replay])
+
+    started = time.perf_counter()
+    assert alpha_client._fetch_quote("ZZRP1") == FetchedQuote(42.5, 40.0)
+    assert time.perf_counter() - started >= 0.03
+    assert asyncio.run(alpha_client._afetch_quote("ZZRP2")) == FetchedQuote(5.0, 4.0)
+    assert alpha_client.refresh("ZZRP1") == 42.5
+    quote_writer.flush()
+    with SessionLocal() as db:
+        assert db.get(Quote, "ZZRP1").price == 42.5
+
+    started = time.perf_counter()
+    assert replay.fetch_quotes(["ZZRP1", "ZZRP2", "ZZMISSING"]) == {
+        "ZZRP1": FetchedQuote(42.5, 40.0),
+        "ZZRP2": FetchedQuote(5.0, 4.0),
+    }
+    assert time.perf_counter() - started < 0.06  # one simulated round trip for the batch
+    assert alpha_client.fetch_history("ZZRP2") == 4
+    with pytest.raises(KeyError):
+        alpha_client._fetch_quote("ZZMISSING")
+    with pytest.raises(ValueError):
+        main.build_providers(alpha_client, "alphavantage,nope")
+
+    # when every provider fails nothing is written: no placeholder row, no re-stamped stale row
+    expired = datetime.utcnow() - timedelta(seconds=main.PRICE_CACHE_TTL_SECONDS + 60)
+    with SessionLocal() as db:
+        db.add(Quote(symbol="ZZRPOLD", price=7.0, fetched_at=expired))
+        db.commit()
+        assert alpha_client.get_prices(["ZZRPOLD", "ZZMISSING"], db) == {"ZZRPOLD": 7.0, "ZZMISSING": 100.0}
+    quote_writer.flush()
+    with SessionLocal() as db:
+        assert db.get(Quote, "ZZMISSING") is None
+        assert (db.get(Quote, "ZZRPOLD").price, db.get(Quote, "ZZRPOLD").fetched_at) == (7.0, expired)
+
+    class QuotesOnly(main.PriceProvider):
+        def fetch_quote(self, symbol):
+            return FetchedQuote(1.0)
+
+    with pytest.raises(TypeError):
+        QuotesOnly()  # refused up front rather than mid-failover
+
+
+def test_portfolio_reads_use_constant_sql_statements(monkeypatch):
+    monkeypatch.setattr(alpha_client, "_fetch_quote", lambda symbol: FetchedQuote(3.0))
+    counts = {}
+    for size in (1, 30):
+        positions = [{"symbol": f"ZZN{size}X{i}", "qty": 2, "avg_cost": 1.0} for i in range(size)]
+        token = client.post("/portfolio", json=positions).json()["token"]
+        client.get(f"/portfolio/{token}")  # warm the quote cache
+
+        headers = {"x-pt-token": token}
+        for path, kwargs in (
+            (f"/portfolio/{token}", {}),
+            (f"/portfolio/{token}/summary", {}),
+            ("/api/portfolio", {"headers": headers}),
+            ("/api/allocation", {"headers": headers}),
+        ):
+            r, statements = _count_statements(lambda: client.get(path, **kwargs))
+            assert r.status_code == 200
+            counts.setdefault(path.replace(token, "{token}"), []).append(len(statements))
+
+        summary = client.get(f"/portfolio/{token}/summary").json()
+        assert summary["total_value"] == 6.0 * size
+        assert summary["pnl"] == 4.0 * size
+
+    for path, (small, large) in counts.items():
+        assert small == large, path
+        assert large <= 2, path
+
+
+def test_position_reads_send_etags_and_304_until_positions_or_quotes_change(monkeypatch):
+    monkeypatch.setattr(alpha_client, "_fetch_quote", lambda symbol: FetchedQuote(4.0))
+    token = client.post("/portfolio", json=[{"symbol": "ZZET1", "qty": 2, "avg_cost": 1}]).json()["token"]
+    assert "etag" not in client.get(f"/portfolio/{token}").headers  # priced by this request, so not reusable
+    quote_writer.flush()
+
+    first = client.get(f"/portfolio/{token}")
+    etag = first.headers["etag"]
+    assert first.json()[0]["price"] == 4.0 and etag.startswith('"')
+
+    monkeypatch.setattr(alpha_client, "_fetch_quote", lambda symbol: (_ for _ in ()).throw(AssertionError(symbol)))
+    cached, statements = _count_statements(lambda: client.get(f"/portfolio/{token}"))
+    assert (cached.content, cached.headers["etag"], len(statements)) == (first.content, etag, 1)
+    not_modified, statements = _count_statements(
+        lambda: client.get(f"/portfolio/{token}", headers={"If-None-Match": etag})
+    )
+    assert (not_modified.status_code, not_modified.content, len(statements)) == (304, b"", 1)
+    api = client.get("/api/positions", headers={"x-pt-token": token, "If-None-Match": f"W/{etag}"})
+    assert api.status_code == 304
+
+    # a position write changes the version
+    client.post("/api/positions", headers={"x-pt-token": token}, json={"symbol": "ZZET1", "qty": 3})
+    changed = client.get(f"/portfolio/{token}", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.json()[0]["qty"] == 3
+    etag = changed.headers["etag"]
+
+    # so does refreshing a held quote
+    monkeypatch.setattr(alpha_client, "_fetch_quote", lambda symbol: FetchedQuote(5.0))
+    time.sleep(0.01)
+    alpha_client.refresh("ZZET1")
+    quote_writer.flush()
+    refreshed = client.get(f"/portfolio/{token}", headers={"If-None-Match": etag})
+    assert refreshed.status_code == 200 and refreshed.json()[0]["price"] == 5.0
+    assert refreshed.headers["etag"] != etag
+
+    # ...even one that is neither the newest nor the oldest held quote
+    for symbol in ("ZZET2", "ZZET3"):
+        client.post("/api/positions", headers={"x-pt-token": token}, json={"symbol": symbol, "qty": 1})
+    client.get(f"/portfolio/{token}")
+    quote_writer.flush()
+    now = datetime.utcnow()
+    with SessionLocal() as db:
+        for symbol, at in (("ZZET1", now - timedelta(seconds=30)), ("ZZET3", now + timedelta(seconds=30))):
+            db.merge(Quote(symbol=symbol, price=5.0, fetched_at=at))
+        db.commit()
+    alpha_client.memory.clear()
+    etag = client.get(f"/portfolio/{token}").headers["etag"]
+    monkeypatch.setattr(alpha_client, "_fetch_quote", lambda symbol: FetchedQuote(6.0))
+    alpha_client.refresh("ZZET2")
+    quote_writer.flush()
+    refreshed = client.get(f"/portfolio/{token}", headers={"If-None-Match": etag})
+    assert refreshed.status_code == 200 and refreshed.headers["etag"] != etag
+    assert {p["symbol"]: p["price"] for p in refreshed.json()}["ZZET2"] == 6.0
+
+
+_ASYNC_MODE_SCRIPT = """
+import asyncio, main
+from fastapi.testclient import TestClient
+from main import FetchedQuote, Quote, SessionLocal, alpha_client, app
+
+assert main.async_engine is not None and main.async_engine.url.drivername == "sqlite+aiosqlite"
+calls = []
+
+async def fake_afetch(symbol):
+    calls.append(symbol)
+    return FetchedQuote(9.0)
+
+def no_sync_fetch(symbol):
+    raise AssertionError("sync fetch path used in async mode")
+
+alpha_client._fetch_quote = no_sync_fetch
+alpha_client._afetch_quote = fake_afetch
+with TestClient(app) as client:
+    token = client.post("/portfolio", json=[{"symbol": "ZZASY", "qty": 2, "avg_cost": 4.0}]).json()["token"]
+    r = client.get(f"/portfolio/{token}/summary")
+    assert r.status_code == 200, r.text
+    assert r.json()["total_value"] == 18.0
+    assert client.get("/quote/ZZASY").json()["price"] == 9.0
+    assert client.get("/portfolio/missing-token").status_code == 404
+assert calls == ["ZZASY"]
+with SessionLocal() as db:
+    assert db.get(Quote, "ZZASY").price == 9.0
+"""
+
+
+def test_async_mode_read_path():
+    # a fresh interpreter so main builds its async engine from ASYNC_DB_ENABLED at import time
+    env = dict(os.environ, ASYNC_DB_ENABLED="1", DATABASE_URL=f"sqlite:///{_TEST_DB.with_name('async.db')}")
+    env.pop("ASYNC_DATABASE_URL", None)
+    proc = subprocess.run(
+        [sys.executable, "-c", _ASYNC_MODE_SCRIPT], cwd=ROOT, env=env, capture_output=True, text=True, timeout=60
+    )
+    assert proc.returncode == 0, proc.stderr
+
+
+def test_async_http_client_per_event_loop():
+    async def open_client():
+        return alpha_client._async_http()
+
+    first = asyncio.run(open_client())
+    second = asyncio.run(open_client())
+    assert first is not second
+    assert first not in alpha_client._aclients.values()  # its loop closed, so it was dropped
+
+    async def open_and_close():
+        http = alpha_client._async_http()
+        await alpha_client.aclose()
+        return http
+
+    assert asyncio.run(open_and_close()).is_closed
+
+
+def test_sqlite_engine_tuning():
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() > 0
+    described = describe_engine(engine)
+    assert "pool=QueuePool" in described
+    assert "pre_ping=True" in described
+
+
+def test_engine_options_follow_the_dialect_pool():
+    for url in ("sqlite://", "sqlite:///:memory:"):
+        mem = main.build_engine(url)
+        with mem.connect() as conn:
+            assert conn.execute(text("SELECT 1")).scalar() == 1
+        assert "size=" not in describe_engine(mem)
+    assert "pool_size" in main._engine_options("postgresql+asyncpg://u@h/db")  # AsyncAdaptedQueuePool
+
+    async def roundtrip(url):
+        async_engine = main.build_async_engine(url)
+        try:
+            async with async_engine.connect() as conn:
+                return (await conn.execute(text("SELECT 1"))).scalar(), describe_engine(async_engine.sync_engine)
+        finally:
+            await async_engine.dispose()
+
+    for url in (f"sqlite+aiosqlite:///{_TEST_DB}", "sqlite+aiosqlite://"):
+        value, described = asyncio.run(roundtrip(url))
+        assert value == 1
+        assert "size=" not in described and "pre_ping=True" in described
+
+
+def test_bulk_import_and_streaming_export():
+    token = client.post("/portfolio", json=[{"symbol": "AAA", "qty": 1, "avg_cost": 1.0}]).json()["token"]
+    body = "symbol,qty,avg_cost,name\nAAA,5,10.5,Triple A\nbbb,2,3\nCCC,not-a-number,1\n"
+    r = client.post(f"/portfolio/{token}/import", content=body, headers={"content-type": "text/csv"})
+    assert r.status_code == 200
+    result = r.json()
+    assert (result["imported"], result["rejected"]) == (2, 1)
+    assert result["errors"][0]["line"] == 4
+
+    ndjson = '{"symbol": "DDD", "qty": 4, "avgCost": 2}\n{"symbol": "AAA", "qty": 6, "avg_cost": 11}\n'
+    r = client.post(f"/portfolio/{token}/import?format=ndjson", content=ndjson)
+    assert r.json()["imported"] == 2
+
+    r = client.get(f"/portfolio/{token}/export?format=ndjson")
+    assert r.status_code == 200
+    rows = [json.loads(line) for line in r.text.splitlines()]
+    assert {row["symbol"]: (row["qty"], row["avg_cost"]) for row in rows} == {
+        "AAA": (6.0, 11.0),
+        "BBB": (2.0, 3.0),
+        "DDD": (4.0, 2.0),
+    }
+    assert next(row for row in rows if row["symbol"] == "AAA")["name"] == "Triple A"
+
+    r = client.get(f"/portfolio/{token}/export")
+    assert r.headers["content-type"].startswith("text/csv")
+    assert r.text.splitlines()[0] == "symbol,name,qty,avg_cost"
+    assert len(r.text.splitlines()) == 4
+
+    r = client.post(f"/portfolio/{token}/import?replace=true", content="symbol,qty,avg_cost\nEEE,1,1\n")
+    assert [p["symbol"] for p in client.get(f"/portfolio/{token}").json()] == ["EEE"]
+
+    # repeated symbols count once; malformed lines are reported, not imported
+    ndjson = '{"symbol": "FFF", "qty": 1, "avg_cost": 1}\n[1]\n{bad\n{"symbol": "fff", "qty": 3, "avg_cost": 2}\n'
+    result = client.post(f"/portfolio/{token}/import?format=ndjson", content=ndjson).json()
+    assert (result["imported"], result["rejected"]) == (1, 2)
+    assert [e["line"] for e in result["errors"]] == [2, 3]
+    assert {p["symbol"]: p["qty"] for p in client.get(f"/portfolio/{token}").json()} == {"EEE": 1.0, "FFF": 3.0}
+
+
+def test_import_rejects_undecodable_and_non_finite_rows_and_writes_in_batches(monkeypatch):
+    token = client.post("/portfolio", json=[]).json()["token"]
+    body = "symbol,qty,avg_cost,name\nZZI1,1,1,Soci\xe9t\xe9\nZZI2,2,1,Plain\n".encode("latin-1")
+    result = client.post(f"/portfolio/{token}/import", content=body, headers={"content-type": "text/csv"}).json()
+    assert (result["imported"], result["rejected"]) == (1, 1)
+    assert result["errors"][0]["line"] == 2 and "UTF-8" in result["errors"][0]["error"]
+
+    ndjson = '{"symbol": "ZZI3", "qty": 1e400, "avg_cost": 1}\n{"symbol": "ZZI4", "qty": 1, "avg_cost": "nan"}\n'
+    result = client.post(f"/portfolio/{token}/import?format=ndjson", content=ndjson).json()
+    assert (result["imported"], result["rejected"]) == (0, 2)
+
+    # every IMPORT_BATCH_SIZE rows are committed on their own instead of buffering the whole upload
+    monkeypatch.setattr(main, "IMPORT_BATCH_SIZE", 2)
+    commits = []
+    on_commit = lambda conn: commits.append(conn)  # noqa: E731
+    event.listen(SessionLocal.kw["bind"], "commit", on_commit)
+    try:
+        lines = "".join(f'{{"symbol": "ZZB{i}", "qty": {i}, "avg_cost": 1}}\n' for i in range(5))
+        result = client.post(f"/portfolio/{token}/import?format=ndjson&replace=true", content=lines).json()
+    finally:
+        event.remove(SessionLocal.kw["bind"], "commit", on_commit)
+    assert result["imported"] == 5 and len(commits) == 3
+    exported = client.get(f"/portfolio/{token}/export?format=ndjson").text.splitlines()
+    assert sorted(json.loads(line)["symbol"] for line in exported) == [f"ZZB{i}" for i in range(5)]
+
+
+def test_portfolio_value_series_forward_fills_gaps():
+    d1, d2, d3 = date(2024, 1, 2), date(2024, 1, 3), date(2024, 1, 4)
+    bars = [("A", d1, 10.0), ("A", d3, 12.0), ("B", d2, 5.0), ("B", d3, 6.0)]
+    axis, values = portfolio_value_series({"A": 2.0, "B": 10.0}, bars)
+    assert axis == [d1, d2, d3]
+    # B has no bar on d1 (counts 0); A carries 10.0 forward into d2
+    assert values.tolist() == [20.0, 70.0, 84.0]
+
+
+def test_api_timelines_from_stored_bars():
+    token = client.post("/portfolio", json=[{"symbol": "ZZTL", "qty": 3, "avg_cost": 1.0}]).json()["token"]
+    today = date.today()
+    store_price_bars(
+        [
+            {"symbol": "ZZTL", "day": today - timedelta(days=i), "open": 1, "high": 1, "low": 1, "close": 10.0 + i}
+            for i in range(5)
+        ]
+    )
+    r = client.get("/api/timelines?days=3", headers={"x-pt-token": token})
+    assert r.status_code == 200
+    series = r.json()
+    assert [p["date"] for p in series] == [(today - timedelta(days=i)).isoformat() for i in (3, 2, 1, 0)]
+    assert [p["value"] for p in series] == [39.0, 36.0, 33.0, 30.0]
+
+
+def test_timeline_backfills_history_in_the_background(monkeypatch):
+    calls = []
+    done = threading.Event()
+
+    def fake_history(symbol, full=False):
+        calls.append((symbol, full))
+        if len(calls) == 2:
+            done.set()
+        raise RuntimeError("unknown symbol")
+
+    monkeypatch.setattr(alpha_client, "fetch_history", fake_history)
+    token = client.post("/portfolio", json=[{"symbol": "ZZBF", "qty": 1, "avg_cost": 1.0}]).json()["token"]
+    headers = {"x-pt-token": token}
+    assert client.get("/api/timelines?days=30", headers=headers).json() == []  # no wait on the download
+    deadline = time.time() + 5
+    while "ZZBF" in alpha_client._history_pending and time.time() < deadline:
+        time.sleep(0.01)
+
+    client.get("/api/timelines?days=30", headers=headers)  # the failure is remembered
+    client.get("/api/timelines?days=365", headers=headers)  # a longer window asks for the full series
+    assert done.wait(5)
+    assert calls == [("ZZBF", False), ("ZZBF", True)]
+
+
+def test_day_change_from_previous_close(monkeypatch):
+    quotes = {"ZZDA": FetchedQuote(110.0, 100.0), "ZZDB": FetchedQuote(50.0, None)}
+    monkeypatch.setattr(alpha_client, "_fetch_quote", lambda symbol: quotes[symbol])
+    token = client.post(
+        "/portfolio",
+        json=[{"symbol": "ZZDA", "qty": 2, "avg_cost": 90.0}, {"symbol": "ZZDB", "qty": 1, "avg_cost": 50.0}],
+    ).json()["token"]
+
+    body = client.get("/api/portfolio", headers={"x-pt-token": token}).json()
+    assert body == {"value": 270.0, "dayChange": 20.0, "dayPct": 10.0}
+    quote_writer.flush()
+    with SessionLocal() as db:
+        assert db.get(Quote, "ZZDA").prev_close == 100.0
+
+    # a cold process recovers the baseline from the quotes table
+    alpha_client.memory.clear()
+    summary = client.get(f"/portfolio/{token}/summary").json()
+    assert (summary["day_change"], summary["day_change_pct"]) == (20.0, 10.0)
+
+
+def test_columnar_summary_matches_model_valuation(monkeypatch):
+    quotes = {f"ZZCS{i}": FetchedQuote(10.0 + i * 1.37, (9.0 + i) if i % 3 else None) for i in range(40)}
+    monkeypatch.setattr(alpha_client, "_fetch_quote", lambda symbol: quotes[symbol])
+    positions = [
+        {"symbol": sym, "qty": 1 + i % 7, "avg_cost": 5.0 + i, "name": f"Co {i}" if i % 2 else None}
+        for i, sym in enumerate(quotes)
+    ]
+    token = client.post("/portfolio", json=positions).json()["token"]
+    headers = {"x-pt-token": token}
+
+    summary = client.get(f"/portfolio/{token}/summary").json()
+    with SessionLocal() as db:
+        expected = main.value_portfolio(token, db).model_dump()
+    assert summary == expected  # one valuation implementation, so no tolerance
+    allocation = client.get("/api/allocation", headers=headers).json()
+    assert allocation == [{"name": p["symbol"], "value": p["weight"]} for p in summary["positions"]]
+    assert sum(a["value"] for a in allocation) == pytest.approx(100.0, abs=0.5)
+
+    snapshot = main.PortfolioSnapshot(["ZZCS1", "ZZCS1"], [None, None], [1.0, 2.0], [1.0, 1.0])
+    assert snapshot.ids.dtype == np.int32 and snapshot.ids[0] == snapshot.ids[1]  # interned once
+    assert not hasattr(snapshot, "__dict__")
+
+    empty = client.post("/portfolio", json=[]).json()["token"]
+    assert client.get(f"/portfolio/{empty}/summary").json()["positions"] == []
+    assert client.get("/portfolio/nope/summary").status_code == 404
+
+
+def test_exposure_index_tracks_position_writes_across_portfolios(monkeypatch):
+    monkeypatch.setattr(alpha_client, "_fetch_quote", lambda symbol: FetchedQuote({"ZZEX1": 10.0}.get(symbol, 2.0)))
+    admin = {"x-admin-token": "ops"}
+    assert client.get("/api/exposure/ZZEX1", headers=admin).status_code == 403  # disabled without ADMIN_TOKEN
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "ops")
+    assert client.get("/api/exposure/ZZEX1", headers={"x-admin-token": "nope"}).status_code == 403
+
+    a = client.post("/portfolio", json=[{"symbol": "ZZEX1", "qty": 3, "avg_cost": 1}]).json()["token"]
+    b = client.post(
+        "/portfolio", json=[{"symbol": "zzex1", "qty": 5, "avg_cost": 1}, {"symbol": "ZZEX2", "qty": 1, "avg_cost": 1}]
+    ).json()["token"]
+    client.get(f"/portfolio/{a}")  # price the symbols
+    client.get(f"/portfolio/{b}")
+    assert client.get("/api/exposure/ZZEX1", headers=admin).json() == {
+        "symbol": "ZZEX1",
+        "portfolios": 2,
+        "qty": 8.0,
+        "price": 10.0,
+        "value": 80.0,
+    }
+
+    client.post("/api/positions", headers={"x-pt-token": a}, json={"symbol": "ZZEX1", "qty": 7})
+    client.put(f"/portfolio/{b}", json=[{"symbol": "ZZEX2", "qty": 4, "avg_cost": 1}])
+    client.post(f"/portfolio/{b}/import?format=ndjson", content='{"symbol": "ZZEX3", "qty": 2, "avg_cost": 1}\n')
+    assert client.get("/api/exposure/zzex1", headers=admin).json()["qty"] == 7.0
+    assert client.get("/api/exposure/ZZEX2", headers=admin).json()["portfolios"] == 1
+
+    affected = client.get("/api/exposure/ZZEX1/affected?movePct=-10", headers=admin).json()
+    assert affected["affected"] == [{"token": a, "qty": 7.0, "valueChange": -7.0}]
+
+    top = [row["symbol"] for row in client.get("/api/exposure/top?limit=500", headers=admin).json()]
+    assert top.index("ZZEX1") < top.index("ZZEX2")
+
+    # a reload from the table agrees with the incrementally maintained index
+    before = main.exposure_index.totals()
+    main.exposure_index.load()
+    assert {s: before[s] for s in ("ZZEX1", "ZZEX2", "ZZEX3")} == {
+        s: main.exposure_index.totals()[s] for s in ("ZZEX1", "ZZEX2", "ZZEX3")
+    }
+
+
+def test_parse_global_quote_previous_close():
+    data = {"Global Quote": {"05. price": "12.5", "08. previous close": "12.0"}}
+    assert alpha_client._parse_global_quote(data) == FetchedQuote(12.5, 12.0)
+
+
+def test_stream_pushes_changed_positions(monkeypatch):
+    prices = {"ZZWA": FetchedQuote(10.0), "ZZWB": FetchedQuote(30.0)}
+    monkeypatch.setattr(alpha_client, "_fetch_quote", lambda symbol: prices[symbol])
+    token = client.post(
+        "/portfolio",
+        json=[{"symbol": "ZZWA", "qty": 1, "avg_cost": 1.0}, {"symbol": "ZZWB", "qty": 1, "avg_cost": 1.0}],
+    ).json()["token"]
+
+    with client.websocket_connect(f"/api/stream?token={token}") as ws:
+        snapshot = ws.receive_json()
+        assert snapshot["type"] == "snapshot"
+        assert snapshot["value"] == 40.0
+
+        prices["ZZWA"] = FetchedQuote(20.0)
+        alpha_client.refresh("ZZWA")
+        update = ws.receive_json()
+        assert update["type"] == "update"
+        assert update["value"] == 50.0
+        by_symbol = {p["symbol"]: p for p in update["positions"]}
+        assert by_symbol["ZZWA"]["price"] == 20.0
+        assert by_symbol["ZZWB"]["weight"] == 60.0  # weight moved, price did not
+
+        prices["ZZWC"] = FetchedQuote(5.0)
+        client.post("/api/positions", json={"symbol": "ZZWC", "qty": 1, "avgCost": 1}, headers={"x-pt-token": token})
+        resync = ws.receive_json()
+        assert resync["type"] == "snapshot"
+        assert len(resync["positions"]) == 3
+
+
+def test_stream_picks_up_other_workers_writes(monkeypatch):
+    monkeypatch.setattr(alpha_client, "_fetch_quote", lambda symbol: FetchedQuote(10.0))
+    token = client.post("/portfolio", json=[{"symbol": "ZZWX", "qty": 2, "avg_cost": 1.0}]).json()["token"]
+
+    with client.websocket_connect(f"/api/stream?token={token}") as ws:
+        assert ws.receive_json()["value"] == 20.0
+        quote_writer.flush()
+
+        # another worker refreshes the quote: only the table changes, nothing is published here
+        with SessionLocal() as db:
+            db.merge(Quote(symbol="ZZWX", price=12.0, fetched_at=datetime.utcnow() + timedelta(seconds=1)))
+            db.commit()
+        main.quote_hub.poll()
+        update = ws.receive_json()
+        assert (update["type"], update["value"]) == ("update", 24.0)
+
+        # ...and writes to the portfolio, which bumps its version
+        with SessionLocal() as db:
+            db.add(main.DBPosition(token=token, symbol="ZZWY", qty=1, avg_cost=1.0))
+            main._touch_portfolio(db, token)
+            db.commit()
+        main.quote_hub.poll()
+        resync = ws.receive_json()
+        assert resync["type"] == "snapshot" and len(resync["positions"]) == 2
+
+
+def test_benchmark_harness_measures_and_flags_regressions(monkeypatch):
+    sys.path.insert(0, str(ROOT / "benchmarks"))
+    import bench_api
+
+    stub = bench_api.StubAlphaVantage(latency_ms=1, jitter_ms=0).start()
+    monkeypatch.setattr(alpha_client, "api_key", "bench")
+    monkeypatch.setattr(alpha_client, "base_url", stub.url)
+    monkeypatch.setattr(alpha_client, "bucket", TokenBucket(1e6, 1e6))
+    symbols = ["ZZBM1", "ZZBM2", "ZZBM3"]
+    token = client.post("/portfolio", json=[{"symbol": s, "qty": 1, "avg_cost": 1} for s in symbols]).json()["token"]
+
+    def reset():
+        quote_writer.flush()
+        alpha_client.memory.clear()
+        with SessionLocal() as db:
+            db.query(Quote).filter(Quote.symbol.in_(symbols)).delete()
+            db.commit()
+
+    counter = bench_api.StatementCounter(engine)
+    try:
+        summary = lambda i: ("GET", f"/portfolio/{token}/summary", {})
+        cold = bench_api.run_case(client, 4, 1, summary, counter, stub, reset=reset)
+        warm = bench_api.run_case(client, 4, 2, summary, counter, stub)
+        # the write-behind flusher's statements are not charged to requests
+        before = counter.count
+        row = {"symbol": symbols[0], "price": bench_api.stub_price(symbols[0]), "fetched_at": datetime.utcnow()}
+        quote_writer.submit([{**row, "prev_close": None}])
+        writer = threading.Thread(target=quote_writer.flush, name="quote-writer")
+        writer.start()
+        writer.join()
+        assert counter.count == before
+    finally:
+        counter.close()
+        stub.stop()
+    assert (cold["upstream_calls"], cold["errors"], warm["upstream_calls"]) == (12, 0, 0)
+    assert cold["sql_per_request"] >= warm["sql_per_request"] >= 1
+    assert client.get(f"/portfolio/{token}/summary").json()["total_value"] == round(
+        sum(bench_api.stub_price(s) for s in symbols), 2
+    )
+
+    slower = {**warm, "p99_ms": warm["p99_ms"] * 2 + 10, "sql_per_request": warm["sql_per_request"] + 3}
+    assert bench_api.compare({"summary/warm/3": warm}, {"summary/warm/3": warm}, 0.25) == []
+    regressions = bench_api.compare({"summary/warm/3": warm}, {"summary/warm/3": slower}, 0.25)
+    assert [r.split(":")[0] for r in regressions] == ["summary/warm/3 p99_ms", "summary/warm/3 sql_per_request"]
+
+
+def test_metrics_time_requests_and_count_sql_and_upstream_calls(monkeypatch):
+    def handler(request):
+        return httpx.Response(200, json={"Global Quote": {"05. price": "12.5"}})
+
+    token = client.post("/portfolio", json=[{"symbol": "ZZMT1", "qty": 2, "avg_cost": 1}]).json()["token"]
+    _mock_upstream(monkeypatch, handler)
+    monkeypatch.setattr(alpha_client, "bucket", TokenBucket(1e6, 1e6))
+    assert "server-timing" not in client.get(f"/portfolio/{token}/summary").headers  # off by default
+
+    main.metrics_registry.reset()
+    main.set_metrics_enabled(True)
+    try:
+        alpha_client.memory.clear()
+        with SessionLocal() as db:
+            db.query(Quote).filter(Quote.symbol == "ZZMT1").delete()
+            db.commit()
+        cold = client.get(f"/portfolio/{token}/summary")
+        warm = client.get(f"/portfolio/{token}/summary")
+    finally:
+        main.set_metrics_enabled(False)
+
+    assert cold.json()["total_value"] == 25.0
+    assert '"1 calls"' in cold.headers["server-timing"]
+    assert 'desc="0 calls"' in warm.headers["server-timing"]
+    assert 'hit ratio 1.00' in warm.headers["server-timing"]
+    assert "queries" in warm.headers["server-timing"]
+
+    body = client.get("/metrics").text
+    assert 'http_requests_total{method="GET",route="/portfolio/{token}/summary",status="200"} 2' in body
+    assert 'upstream_requests_total{function="GLOBAL_QUOTE",outcome="ok"} 1' in body
+    assert 'quote_lookups_total{result="miss"} 1' in body
+    assert "db_statements_total " in body
+    assert 'http_request_duration_seconds_count{route="/portfolio/{token}/summary"} 2' in body
+    # once switched off nothing is recorded and the SQL hooks are gone
+    assert not main.event.contains(engine, "after_cursor_execute", main._after_cursor_execute)
+    assert 'route="/metrics"' not in client.get("/metrics").text